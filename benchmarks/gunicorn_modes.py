@@ -0,0 +1,143 @@
+"""
+Gunicorn worker mode benchmark
+==============================
+
+Starts gunicorn with `gunicorn.conf.py` for each worker class, and measures
+the throughput and latency of the given paths with concurrent keep-alive
+clients.
+
+To run the benchmark against a local MongoDB:
+    $ MONGO_URL=mongodb://localhost/tjts5901 python benchmarks/gunicorn_modes.py
+
+Results are printed as JSON. Modes whose worker class is not installed (eg.
+gevent) are skipped.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from time import monotonic, perf_counter, sleep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "sync": {},
+    "gthread": {},
+    "gevent": {"requires": "gevent"},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port: int, timeout: float = 30):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/livez")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        sleep(0.2)
+    raise TimeoutError(f"Gunicorn did not start on port {port}")
+
+
+def load(port: int, paths, clients: int, duration: float):
+    """
+    Run `clients` threads requesting `paths` in turns for `duration` seconds.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = monotonic() + duration
+
+    def client():
+        nonlocal errors
+        own = []
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = 0
+        while monotonic() < stop_at:
+            started = perf_counter()
+            try:
+                conn.request("GET", paths[i % len(paths)])
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            own.append(perf_counter() - started)
+            i += 1
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per mode")
+    parser.add_argument("--path", action="append", dest="paths", help="Paths to request (repeatable)")
+    parser.add_argument("--mode", action="append", dest="modes", choices=MODES, help="Worker classes to test")
+    args = parser.parse_args()
+
+    paths = args.paths or ["/", "/hello", "/server-info"]
+    results = {}
+
+    for mode in args.modes or MODES:
+        if (requires := MODES[mode].get("requires")) and importlib.util.find_spec(requires) is None:
+            results[mode] = {"skipped": f"{requires} is not installed"}
+            continue
+
+        port = free_port()
+        env = dict(os.environ, GUNICORN_WORKER_CLASS=mode, FLASK_RUN_PORT=str(port))
+        server = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "gunicorn", "--config", os.path.join(ROOT, "gunicorn.conf.py"),
+             "--access-logfile", "/dev/null", "tjts5901.app:flask_app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_ready(port)
+            results[mode] = load(port, paths, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(json.dumps({"clients": args.clients, "paths": paths, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+"""
+Load benchmark
+==============
+
+Seeds a database with realistic volumes of users, items, bids and
+notifications using `faker`, and measures the throughput and latency of the
+main user flows through the Flask test client, with concurrent clients:
+
+- ``listing``: item listing pages.
+- ``item_view``: item pages.
+- ``bid_contended``: all clients bidding on the same item.
+- ``bid_spread``: clients bidding on random items.
+- ``search``: item search.
+- ``rankings``: precomputed item rankings.
+- ``notifications``: notification polling.
+- ``closing``: closing expired auctions, and notifying the seller and buyer.
+- ``login``: logging in with a password.
+
+Faker is installed with the test extras:
+    $ pip install -e .[test]
+
+Against a local MongoDB:
+    $ MONGO_URL=mongodb://localhost/tjts5901-bench python benchmarks/load.py --output report.json
+
+Without `MONGO_URL` an in-memory mongomock database is used, which is good
+for quick micro benchmarks, but doesn't show the cost of queries or indexes.
+
+The benchmark database is dropped and seeded again on every run. To avoid
+dropping real data, the database name has to contain "bench", unless
+`--force` is given.
+
+The report is JSON, with the same seed producing the same data and request
+sequence. To compare against an earlier run, eg. from the main branch:
+    $ python benchmarks/load.py --output new.json --baseline report.json
+
+Scenarios whose p95 latency or throughput got worse by more than
+`--threshold` are listed, and the command exits with status 1.
+"""
+
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import count
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+os.environ.setdefault("MONGO_URL", "mongomock://localhost/tjts5901-bench")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORT_VERSION = 1
+
+PASSWORD = "benchmark-password"
+"Password of all the seeded users."
+
+BID_BASE = 10 ** 7
+"Benchmark bids start from this amount, above any seeded bid."
+
+HEADERS = {
+    "Accept": "text/html,application/json;q=0.9,*/*;q=0.8",
+    "Accept-Language": "fi-FI,fi;q=0.9,en;q=0.8",
+}
+"Sent with every request, like a browser would."
+
+SEARCH_WORDS = ("common", "light", "production", "international", "education", "economic")
+"Words searched for in the search scenario. Common in the texts faker generates."
+
+RANKING_NAMES = ("ending-soon", "trending", "highest-price")
+"Rankings read in the rankings scenario."
+
+CURRENCY_RATES = "Date, USD, SEK, GBP, \n19 October 2026, 1.08, 11.5, 0.86, \n"
+"Fixed ECB rates, so that the benchmark doesn't need to download them."
+
+
+@dataclass
+class Dataset:
+    """
+    Ids of the seeded documents, used by the scenarios.
+    """
+
+    users: List[dict] = field(default_factory=list)
+    "Users as dicts with `id`, `email` and `token`."
+
+    open_items: List[str] = field(default_factory=list)
+    expired_items: List[str] = field(default_factory=list)
+    pages: int = 1
+
+
+@dataclass
+class Worker:
+    """
+    State of one benchmark client.
+    """
+
+    app: object
+    client: object
+    user: dict
+    rng: random.Random
+
+
+@dataclass
+class Scenario:
+    name: str
+    run: Callable[[Worker, "Context"], object]
+    "Make one request, and return the response status."
+
+    scale: float = 1.0
+    "Share of `--requests` to make, for scenarios that are slow by design."
+
+    login: bool = False
+    "Log the clients in with a session cookie."
+
+
+class Context:
+    """
+    State shared by the clients of a scenario.
+    """
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.amounts = count(BID_BASE)
+        self.expired = iter(list(dataset.expired_items))
+        self.lock = threading.Lock()
+
+    def next_amount(self) -> int:
+        with self.lock:
+            return next(self.amounts)
+
+    def next_expired(self) -> Optional[str]:
+        with self.lock:
+            return next(self.expired, None)
+
+
+def seed(app, args) -> Dataset:
+    """
+    Drop the benchmark database, and fill it with fake data.
+    """
+    from faker import Faker  # pylint: disable=import-outside-toplevel
+    from werkzeug.security import generate_password_hash  # pylint: disable=import-outside-toplevel
+    from tjts5901.db import db  # pylint: disable=import-outside-toplevel
+    from tjts5901.i18n import SupportedLocales  # pylint: disable=import-outside-toplevel
+    from tjts5901.models import AccessToken, Bid, Item, Notification, User  # pylint: disable=import-outside-toplevel
+    from tjts5901.rankings import refresh_rankings  # pylint: disable=import-outside-toplevel
+
+    Faker.seed(args.seed)
+    fake = Faker()
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    dataset = Dataset()
+
+    with app.app_context():
+        database = db.get_db()
+        if "bench" not in database.name and not args.force:
+            sys.exit(f"Refusing to drop database {database.name!r}, use a name with 'bench' or --force")
+        for name in database.list_collection_names():
+            database.drop_collection(name)
+
+        for model in (User, Item, Bid, AccessToken, Notification):
+            model.ensure_indexes()
+
+        # Hashing is slow by design, so all the users share the same hash.
+        password = generate_password_hash(PASSWORD)
+        users = [{
+            "email": fake.unique.email(),
+            "password": password,
+            "locale": rng.choice(list(SupportedLocales)).value,
+            "created_at": now - timedelta(days=rng.randint(1, 365)),
+        } for _ in range(args.users)]
+        user_ids = User._get_collection().insert_many(users).inserted_ids  # pylint: disable=protected-access
+
+        tokens = [{
+            "name": "benchmark",
+            "user": user_id,
+            "token": fake.sha256(),
+            "created_at": now,
+        } for user_id in user_ids]
+        AccessToken._get_collection().insert_many(tokens)  # pylint: disable=protected-access
+
+        dataset.users = [{"id": str(user_id), "email": user["email"], "token": token["token"]}
+                         for user_id, user, token in zip(user_ids, users, tokens)]
+
+        items = []
+        amounts = []
+        for i in range(args.items + args.expired_items):
+            expired = i >= args.items
+            created_at = now - timedelta(hours=rng.randint(1, 24 * 14))
+            starting_bid = rng.randint(1, 500)
+
+            item_amounts = []
+            for _ in range(rng.randint(0, 2 * args.bids_per_item)):
+                item_amounts.append((item_amounts[-1] if item_amounts else starting_bid) + rng.randint(1, 50))
+            amounts.append(item_amounts)
+
+            items.append({
+                "title": fake.sentence(nb_words=4)[:100],
+                "description": fake.paragraph(nb_sentences=5)[:2000],
+                "starting_bid": starting_bid,
+                "price": item_amounts[-1] if item_amounts else starting_bid,
+                "seller": rng.choice(user_ids),
+                "closed": False,
+                "created_at": created_at,
+                "closes_at": now - timedelta(minutes=rng.randint(1, 600)) if expired
+                else now + timedelta(minutes=rng.randint(10, 60 * 24 * 7)),
+            })
+        item_ids = Item._get_collection().insert_many(items).inserted_ids  # pylint: disable=protected-access
+
+        bids = [{
+            "amount": amount,
+            "bidder": rng.choice(user_ids),
+            "item": item_id,
+            "created_at": item["created_at"] + timedelta(minutes=rng.randint(1, 600)),
+        } for item_id, item, item_amounts in zip(item_ids, items, amounts) for amount in item_amounts]
+        if bids:
+            Bid._get_collection().insert_many(bids)  # pylint: disable=protected-access
+
+        notifications = [{
+            "user": user_id,
+            "category": "message",
+            "title": fake.sentence(nb_words=3),
+            "message": fake.sentence(),
+            "created_at": now - timedelta(minutes=rng.randint(1, 600)),
+        } for user_id in user_ids for _ in range(rng.randint(0, 2 * args.notifications_per_user))]
+        if notifications:
+            Notification._get_collection().insert_many(notifications)  # pylint: disable=protected-access
+
+        # The scheduler isn't running, so rank the items once.
+        refresh_rankings()
+
+    dataset.open_items = [str(item_id) for item_id in item_ids[:args.items]]
+    dataset.expired_items = [str(item_id) for item_id in item_ids[args.items:]]
+    dataset.pages = max(1, (args.items + 9) // 10)
+    return dataset
+
+
+def listing(worker: Worker, context: Context):
+    page = worker.rng.randint(1, context.dataset.pages)
+    return worker.client.get("/" if page == 1 else f"/items/{page}").status_code
+
+
+def item_view(worker: Worker, context: Context):
+    return worker.client.get(f"/item/{worker.rng.choice(context.dataset.open_items)}").status_code
+
+
+def _place_bid(worker: Worker, context: Context, item_id: str):
+    response = worker.client.post(f"/api/items/{item_id}/bids",
+                                  data={"amount": context.next_amount()},
+                                  headers={"Authorization": f"Bearer {worker.user['token']}"})
+    # Bids losing a race are answered with `200` and an error.
+    if response.status_code == 200 and not response.json["success"]:
+        return "rejected"
+    return response.status_code
+
+
+def bid_contended(worker: Worker, context: Context):
+    return _place_bid(worker, context, context.dataset.open_items[0])
+
+
+def bid_spread(worker: Worker, context: Context):
+    return _place_bid(worker, context, worker.rng.choice(context.dataset.open_items))
+
+
+def search(worker: Worker, context: Context):
+    word = worker.rng.choice(SEARCH_WORDS)
+    return worker.client.get(f"/api/items/search?q={word}&status=open").status_code
+
+
+def rankings(worker: Worker, context: Context):
+    name = worker.rng.choice(RANKING_NAMES)
+    return worker.client.get(f"/api/items/rankings/{name}").status_code
+
+
+def notifications(worker: Worker, context: Context):
+    return worker.client.get("/notifications.json").status_code
+
+
+def closing(worker: Worker, context: Context):
+    from tjts5901.scheduler import close_item  # pylint: disable=import-outside-toplevel
+
+    if (item_id := context.next_expired()) is None:
+        raise StopIteration
+    with worker.app.app_context():
+        close_item(item_id)
+    return "closed"
+
+
+def login(worker: Worker, context: Context):
+    return worker.client.post("/auth/login", data={
+        "email": worker.user["email"],
+        "password": PASSWORD,
+    }).status_code
+
+
+SCENARIOS: Dict[str, Scenario] = {scenario.name: scenario for scenario in (
+    Scenario("listing", listing),
+    Scenario("item_view", item_view),
+    Scenario("bid_contended", bid_contended),
+    Scenario("bid_spread", bid_spread),
+    Scenario("search", search),
+    Scenario("rankings", rankings),
+    Scenario("notifications", notifications, login=True),
+    Scenario("closing", closing),
+    # Password hashing takes most of the time.
+    Scenario("login", login, scale=0.1),
+)}
+
+
+def percentile(latencies: List[float], p: float) -> Optional[float]:
+    if not latencies:
+        return None
+    return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+
+def run_scenario(app, dataset: Dataset, scenario: Scenario, requests: int, clients: int, seed_value: int) -> dict:
+    """
+    Make `requests` requests with `clients` concurrent clients.
+    """
+    context = Context(dataset)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index: int, quota: int):
+        nonlocal errors
+        test_client = app.test_client()
+        test_client.environ_base.update(
+            {"HTTP_" + name.upper().replace("-", "_"): value for name, value in HEADERS.items()})
+        worker = Worker(app=app, client=test_client, user=dataset.users[index % len(dataset.users)],
+                        rng=random.Random(seed_value + index))
+        if scenario.login:
+            with worker.client.session_transaction() as session:
+                session["_user_id"] = worker.user["id"]
+                session["_fresh"] = True
+
+        own: List[float] = []
+        own_statuses: Dict[str, int] = {}
+        own_errors = 0
+        barrier.wait()
+        for _ in range(quota):
+            started = perf_counter()
+            try:
+                status = str(scenario.run(worker, context))
+            except StopIteration:
+                break
+            except Exception:  # pylint: disable=broad-except
+                status = "exception"
+            own.append(perf_counter() - started)
+            own_statuses[status] = own_statuses.get(status, 0) + 1
+            if status == "exception" or status.startswith("5"):
+                own_errors += 1
+
+        with lock:
+            latencies.extend(own)
+            errors += own_errors
+            for status, hits in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + hits
+
+    threads = [threading.Thread(target=client, args=(i, requests // clients + (i < requests % clients)))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": percentile(latencies, 0.50),
+        "p90_ms": percentile(latencies, 0.90),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    List the scenarios that got slower than the baseline by more than `threshold`.
+    """
+    regressions = []
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+
+        if before.get("p95_ms") and result.get("p95_ms") is not None:
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            if change > threshold:
+                regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms ({change:+.0%})")
+
+        if before.get("requests_per_second") and result.get("requests_per_second") is not None:
+            change = result["requests_per_second"] / before["requests_per_second"] - 1
+            if change < -threshold:
+                regressions.append(f"{name}: {before['requests_per_second']} req/s -> "
+                                   f"{result['requests_per_second']} req/s ({change:+.0%})")
+
+        if result["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: {before.get('errors', 0)} -> {result['errors']} errors")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Users to seed")
+    parser.add_argument("--items", type=int, default=1000, help="Open items to seed")
+    parser.add_argument("--expired-items", type=int, default=200, help="Expired items to seed, for closing")
+    parser.add_argument("--bids-per-item", type=int, default=10, help="Average bids per item")
+    parser.add_argument("--notifications-per-user", type=int, default=5, help="Average unread notifications")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--scenario", action="append", dest="scenarios", choices=SCENARIOS,
+                        help="Scenarios to run (repeatable, default: all)")
+    parser.add_argument("--seed", type=int, default=5901, help="Random seed for the data and the requests")
+    parser.add_argument("--force", action="store_true", help="Drop the database even if it's not named 'bench'")
+    parser.add_argument("--output", help="Write the report to a file instead of stdout")
+    parser.add_argument("--baseline", help="Report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    from tjts5901.app import create_app  # pylint: disable=import-outside-toplevel
+
+    currency_file = os.path.join(tempfile.mkdtemp(prefix="tjts5901-bench-"), "currency.csv")
+    with open(currency_file, "w", encoding="ascii") as file:
+        file.write(CURRENCY_RATES)
+
+    app = create_app({
+        "TESTING": True,
+        "CURRENCY_FILE": currency_file,
+        # Measure the application, not the limiter.
+        "RATELIMIT_ENABLED": False,
+    })
+
+    seeded = perf_counter()
+    dataset = seed(app, args)
+    seeded = perf_counter() - seeded
+
+    report = {
+        "version": REPORT_VERSION,
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "database": os.environ["MONGO_URL"].split("://", 1)[0],
+        "parameters": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "baseline", "threshold", "force")},
+        "seed_seconds": round(seeded, 2),
+        "scenarios": {},
+    }
+
+    for name in args.scenarios or SCENARIOS:
+        scenario = SCENARIOS[name]
+        requests = max(1, int(args.requests * scenario.scale))
+        report["scenarios"][name] = run_scenario(app, dataset, scenario, requests, args.clients, args.seed)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("parameters") != report["parameters"]:
+            print("Warning: baseline was run with different parameters", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Sentry tracing overhead benchmark
+=================================
+
+Compares the request throughput with Sentry tracing disabled, with every
+transaction traced, and with the adaptive :class:`~tjts5901.logging.TracesSampler`.
+
+Transactions are not sent anywhere; a null transport counts the envelopes
+that would have been sent, so the serialization cost is included.
+
+To run the benchmark:
+    $ python benchmarks/sentry_overhead.py --requests 2000
+
+"""
+
+import argparse
+import json
+from time import perf_counter
+
+import sentry_sdk
+from sentry_sdk.integrations.flask import FlaskIntegration
+from sentry_sdk.integrations.pymongo import PyMongoIntegration
+from sentry_sdk.transport import Transport
+
+from tjts5901.app import create_app
+from tjts5901.logging import TracesSampler
+
+DUMMY_DSN = "https://public@sentry.invalid/1"
+
+PATHS = [
+    "/hello",
+    "/hello",
+    "/static/style.css",
+    "/server-info",
+    "/notifications.json",
+]
+"Request mix. Roughly what a page load and a few polls look like."
+
+
+class NullTransport(Transport):
+    """
+    Transport that only counts the envelopes.
+    """
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.envelopes = 0
+
+    def capture_envelope(self, envelope):
+        self.envelopes += 1
+
+
+def run(app, requests: int) -> float:
+    """
+    Run the request mix, and return the requests per second.
+    """
+    client = app.test_client()
+    started = perf_counter()
+    for i in range(requests):
+        client.get(PATHS[i % len(PATHS)])
+    return requests / (perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per mode")
+    args = parser.parse_args()
+
+    app = create_app({"TESTING": True})
+
+    # Warm up, so that the first mode doesn't pay for the lazy initialisation.
+    run(app, 50)
+
+    modes = {
+        "off": {},
+        "full": {"traces_sample_rate": 1.0},
+        "adaptive": {},
+    }
+
+    results = {}
+    for mode, options in modes.items():
+        transport = NullTransport()
+        if mode != "off":
+            if mode == "adaptive":
+                sampler = TracesSampler(app)
+                options = {
+                    "traces_sampler": sampler,
+                    "before_send_transaction": sampler.before_send_transaction,
+                }
+            sentry_sdk.init(dsn=DUMMY_DSN, transport=transport,
+                            integrations=[FlaskIntegration(), PyMongoIntegration()], **options)
+        else:
+            sentry_sdk.init(dsn=None)
+
+        results[mode] = {
+            "requests_per_second": round(run(app, args.requests), 1),
+            "envelopes": transport.envelopes,
+        }
+        sentry_sdk.flush()
+
+    baseline = results["off"]["requests_per_second"]
+    for result in results.values():
+        result["relative_throughput"] = round(result["requests_per_second"] / baseline, 3)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
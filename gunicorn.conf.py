@@ -0,0 +1,115 @@
+"""
+Gunicorn configuration
+======================
+
+Production settings for gunicorn. Gunicorn picks this file up automatically
+from the working directory:
+    $ gunicorn tjts5901.app:flask_app
+
+Settings can be tuned with environment variables:
+
+- `GUNICORN_WORKER_CLASS`: `gthread` (default), `sync` or `gevent`.
+- `WEB_CONCURRENCY`: Number of worker processes. Defaults to one per CPU in
+  the container CPU quota, or `2 * CPUs + 1` for sync workers.
+- `GUNICORN_THREADS`: Threads per `gthread` worker. Defaults to 4.
+- `GUNICORN_WORKER_CONNECTIONS`: Concurrent connections per `gevent` worker.
+- `GUNICORN_MAX_REQUESTS`: Restart a worker after this many requests, with
+  jitter, to contain memory leaks. `0` disables.
+
+Each worker keeps a MongoDB connection pool of its own. `MONGO_MIN_POOL_SIZE`
+defaults to the threads per worker, and the connections are opened when the
+worker starts. See `tjts5901.db` for the other pool settings.
+
+See the benchmark in `benchmarks/gunicorn_modes.py`, and the results in the
+README.
+"""
+
+import math
+import os
+import tempfile
+
+
+def cpu_quota() -> int:
+    """
+    Get the number of CPUs available to the container.
+
+    Reads the cgroup CPU quota, as `os.cpu_count()` returns the CPU count of
+    the host, not the CPU limit of the pod.
+    """
+
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max", encoding="ascii") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", encoding="ascii") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="ascii") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+
+    return os.cpu_count() or 1
+
+
+cpus = cpu_quota()
+
+bind = f"0.0.0.0:{os.environ.get('FLASK_RUN_PORT', '5001')}"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "sync":
+    # Sync workers serve one request at a time, so use more processes.
+    workers = int(os.environ.get("WEB_CONCURRENCY", 2 * cpus + 1))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", cpus))
+
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) if worker_class == "gthread" else 1
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Restart workers periodically. Jitter keeps them from restarting all at once.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+# Gevent needs to patch the standard library before pymongo is imported, which
+# happens in the worker. Other worker classes can share the loaded application
+# between workers. Database connections are not opened until the first query,
+# so no MongoDB sockets are shared across the fork. Threads, like the log queue
+# listener, the task workers and the scheduler, are started in each worker
+# after the fork, as they don't survive it.
+preload_app = worker_class != "gevent"
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+
+# Only one worker per pod runs the scheduler. The worker holding the lock file
+# starts it; when that worker exits, the next worker to serve a request takes over.
+os.environ.setdefault("SCHEDULER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "tjts5901-scheduler.lock"))
+
+# Keep a connection ready for every request thread.
+os.environ.setdefault("MONGO_MIN_POOL_SIZE", str(threads))
+
+
+def on_starting(server):
+    server.log.info("Starting %d %s workers (%d CPUs in quota, %d threads, preload %s)",
+                    workers, worker_class, cpus, threads, preload_app)
+
+
+def post_worker_init(worker):
+    # Open the database connections after the fork, so that the first requests
+    # don't wait for them.
+    from tjts5901.db import warm_pool  # pylint: disable=import-outside-toplevel
+
+    if hasattr(worker.wsgi, "app_context"):
+        warm_pool(worker.wsgi)
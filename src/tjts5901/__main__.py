@@ -10,7 +10,7 @@ To run the application module using this file, run the following command:
 """
 
 from os import environ
-from .app import app
+from .app import flask_app as app
 
 if __name__ == "__main__":
     port = int(environ.get("PORT", "5001"))
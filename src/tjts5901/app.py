@@ -8,21 +8,14 @@ Flask tutorial: https://flask.palletsprojects.com/en/2.2.x/tutorial/
 """
 
 import logging
-from os import environ
 import os
 from typing import Dict, Literal, Optional
 
 from dotenv import load_dotenv
-from flask import (
-    Flask,
-    jsonify,
-    Response,
-    request,
-)
+from flask import Flask
 
 from flask_babel import _
 
-from .utils import get_version
 from .db import init_db
 from .i18n import init_babel
 
@@ -58,15 +51,40 @@ def create_app(config: Optional[Dict] = None) -> Flask:
     except OSError:
         pass
 
+    # Initialize the response compression. After request handlers are run in reverse
+    # order, so registering it first makes it compress the final response.
+    from .compression import init_compression  # pylint: disable=import-outside-toplevel
+    init_compression(flask_app)
+
     # Initialize the Flask-Babel extension.
     init_babel(flask_app)
 
+    # Initialize the metrics. Needs to be done before the database connection, so
+    # that the MongoDB command listener is in place.
+    from .metrics import init_metrics  # pylint: disable=import-outside-toplevel
+    init_metrics(flask_app)
+
     # Initialize the database connection.
     init_db(flask_app)
 
-    # Initialize the scheduler.
-    from .scheduler import init_scheduler  # pylint: disable=import-outside-toplevel
-    init_scheduler(flask_app)
+    # Replace the JSON encoder flask-mongoengine installs with a faster one.
+    from .json_provider import init_json  # pylint: disable=import-outside-toplevel
+    init_json(flask_app)
+
+    # Item rankings, before the scheduler that refreshes them.
+    from .rankings import init_rankings  # pylint: disable=import-outside-toplevel
+    init_rankings(flask_app)
+
+    # Watchlist settings, before the scheduler that notifies of items closing soon.
+    from .watchlist import init_watchlist  # pylint: disable=import-outside-toplevel
+    init_watchlist(flask_app)
+
+    # Initialize the scheduler. It's only imported when enabled, as APScheduler
+    # is relatively heavy to import, and tests don't need it.
+    flask_app.config.setdefault("SCHEDULER_ENABLED", not flask_app.testing)
+    if flask_app.config["SCHEDULER_ENABLED"]:
+        from .scheduler import init_scheduler  # pylint: disable=import-outside-toplevel
+        init_scheduler(flask_app)
 
     @flask_app.route('/debug-sentry')
     def trigger_error():
@@ -86,6 +104,33 @@ def create_app(config: Optional[Dict] = None) -> Flask:
     from .currency import init_currency
     init_currency(flask_app)
 
+    from .health import init_health
+    init_health(flask_app)
+
+    from .assets import init_assets
+    init_assets(flask_app)
+
+    from .export import init_export
+    init_export(flask_app)
+
+    from .tasks import init_tasks
+    init_tasks(flask_app)
+
+    from .ratelimit import init_ratelimit
+    init_ratelimit(flask_app)
+
+    from .search import init_search
+    init_search(flask_app)
+
+    from .archive import init_archive
+    init_archive(flask_app)
+
+    from .images import init_images
+    init_images(flask_app)
+
+    from .stats import init_stats
+    init_stats(flask_app)
+
     from . import items
     flask_app.register_blueprint(items.bp)
     flask_app.register_blueprint(items.api)
@@ -94,52 +139,24 @@ def create_app(config: Optional[Dict] = None) -> Flask:
     return flask_app
 
 
-# Load environment variables from .env file, if present. See the `dotenv` file for a
-# template and how to use it.
-load_dotenv()
-
-# Create the Flask application.
-flask_app = create_app()
-
-@flask_app.route("/server-info")
-def server_info() -> Response:
+def __getattr__(name: str):
     """
-    A simple endpoint for checking the status of the server.
+    Create the default application on first access of `flask_app`.
 
-    This is useful for monitoring the server, and for checking that the server is
-    running correctly.
+    Creating the application on import would make every import of this module,
+    like tests and `python -m tjts5901`, pay for initialising all the subsystems.
+    Gunicorn and Flask CLI look up `tjts5901.app:flask_app` as an attribute, and
+    end up here.
     """
+    global flask_app  # pylint: disable=global-variable-undefined,invalid-name
 
-    # Test for database connection
-    database_ping = False
-    try:
-        from .db import db  # pylint: disable=import-outside-toplevel
-        database_ping = db.connection.admin.command('ping').get("ok", False) and True
-    except Exception as exc:  # pylint: disable=broad-except
-        logger.warning("Error querying mongodb server: %r", exc,
-                       exc_info=True,
-                       extra=flask_app.config.get_namespace("MONGODB"))
-
-    # Check for sentry
-    sentry_available = False
-    try:
-        from sentry_sdk import Hub
-        sentry_available = True if Hub.current.client else False
-    except ImportError:
-        logger.warning("Sentry package is not installed")
-    except TypeError:
-        logger.info("Sentry is not integrated")
-
-    response = {
-        "database_connectable": database_ping,
-        'sentry_available': sentry_available,
-        "version": get_version(),
-        "build_date": environ.get("BUILD_DATE", None)
-    }
-
-    # Response with pong if ping is provided.
-    ping = request.args.get("ping", None)
-    if ping is not None:
-        response["pong"] = f"{ping}"
-
-    return jsonify(response)
+    if name != "flask_app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    # Load environment variables from .env file, if present. See the `dotenv` file for a
+    # template and how to use it.
+    load_dotenv()
+
+    # Create the Flask application.
+    flask_app = create_app()
+    return flask_app
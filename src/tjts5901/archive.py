@@ -0,0 +1,153 @@
+"""
+Auction archive.
+
+Closed auctions are moved out of the `item` and `bid` collections into
+`item_archive` and `bid_archive`, once they have been closed for
+`ARCHIVE_AFTER_DAYS`. This keeps the hot collections, and their indexes, sized
+by the live auctions instead of growing forever. The archive collections are
+only indexed by id, and by item for the bids.
+
+Items are archived in batches of `ARCHIVE_BATCH_SIZE`. A batch is first
+copied into the archive, and then deleted from the hot collections. Copies are
+upserts, so a batch interrupted in between is copied again on the next run.
+
+Archived items still have their page, see :func:`get_archived_item`. The
+archival runs daily from the scheduler, and can be run by hand:
+    $ flask archive-items --older-than-days 30
+"""
+
+from datetime import datetime, timedelta
+import logging
+from os import environ
+from typing import Optional
+
+import click
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from pymongo import ReplaceOne, WriteConcern
+
+from .db import db, write_concern
+from .models import Bid, Item, Watch
+from .search import unindex_items
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = "_archive"
+"Suffix of the archive collection names."
+
+
+def init_archive(app: Flask):
+    """
+    Initialize the auction archive.
+    """
+    app.config.setdefault("ARCHIVE_AFTER_DAYS", int(environ.get("ARCHIVE_AFTER_DAYS", 30)))
+    app.config.setdefault("ARCHIVE_BATCH_SIZE", int(environ.get("ARCHIVE_BATCH_SIZE", 500)))
+    app.cli.add_command(archive_items_command)
+
+
+def archive_collection(document_class):
+    """
+    Return the archive collection for a document class, eg. `item_archive` for :class:`Item`.
+    """
+    name = document_class._get_collection_name() + ARCHIVE_SUFFIX  # pylint: disable=protected-access
+    return db.get_db()[name]
+
+
+def archive_items(older_than: Optional[timedelta] = None, batch_size: Optional[int] = None) -> int:
+    """
+    Move closed items, and their bids, into the archive collections.
+
+    :param older_than: Archive items that closed longer ago than this.
+                       Defaults to `ARCHIVE_AFTER_DAYS`.
+    :param batch_size: Items per batch. Defaults to `ARCHIVE_BATCH_SIZE`.
+    :return: Number of items archived.
+    """
+    if older_than is None:
+        older_than = timedelta(days=current_app.config["ARCHIVE_AFTER_DAYS"])
+    if batch_size is None:
+        batch_size = current_app.config["ARCHIVE_BATCH_SIZE"]
+
+    cutoff = datetime.utcnow() - older_than
+
+    items = Item._get_collection()  # pylint: disable=protected-access
+    bids = Bid._get_collection()  # pylint: disable=protected-access
+    watches = Watch._get_collection()  # pylint: disable=protected-access
+
+    # Documents are only deleted after the copies have been acknowledged by
+    # a majority, so that a failover can't lose them.
+    concern = WriteConcern(**write_concern())
+    item_archive = archive_collection(Item).with_options(write_concern=concern)
+    bid_archive = archive_collection(Bid).with_options(write_concern=concern)
+    bid_archive.create_index("item")
+
+    archived = 0
+    while True:
+        batch = list(items.find({"closed": True, "closes_at": {"$lt": cutoff}}).limit(batch_size))
+        if not batch:
+            break
+
+        item_ids = [item["_id"] for item in batch]
+        archived_at = datetime.utcnow()
+
+        if item_bids := list(bids.find({"item": {"$in": item_ids}})):
+            bid_archive.bulk_write([ReplaceOne({"_id": bid["_id"]}, bid, upsert=True) for bid in item_bids],
+                                   ordered=False)
+        item_archive.bulk_write([
+            ReplaceOne({"_id": item["_id"]}, {**item, "archived_at": archived_at}, upsert=True) for item in batch
+        ], ordered=False)
+
+        bids.delete_many({"item": {"$in": item_ids}})
+        # Closed items have nothing left to watch.
+        watches.delete_many({"item": {"$in": item_ids}})
+        items.delete_many({"_id": {"$in": item_ids}})
+        unindex_items(item_ids)
+
+        archived += len(batch)
+        logger.debug("Archived %d items and %d bids", len(batch), len(item_bids))
+
+    logger.info("Archived %d items closed before %s", archived, cutoff.isoformat(),
+                extra={"archived": archived, "cutoff": cutoff})
+    return archived
+
+
+def get_archived_item(item_id) -> Optional[Item]:
+    """
+    Get an item from the archive.
+
+    The winning bid is fetched from the bid archive too, so the item can be
+    rendered like a live one.
+
+    :param item_id: Id of the item.
+    :return: The item, or `None` if it's not in the archive.
+    """
+    try:
+        item_id = ObjectId(item_id)
+    except (InvalidId, TypeError):
+        return None
+
+    if (document := archive_collection(Item).find_one({"_id": item_id})) is None:
+        return None
+
+    document.pop("archived_at", None)
+    winning_bid_id = document.pop("winning_bid", None)
+
+    item = Item._from_son(document)  # pylint: disable=protected-access
+    if winning_bid_id and (bid := archive_collection(Bid).find_one({"_id": winning_bid_id})):
+        item.winning_bid = Bid._from_son(bid)  # pylint: disable=protected-access
+    return item
+
+
+@click.command("archive-items")
+@with_appcontext
+@click.option("--older-than-days", type=int, default=None,
+              help="Archive items closed longer ago than this. Defaults to ARCHIVE_AFTER_DAYS.")
+@click.option("--batch-size", type=int, default=None, help="Items per batch. Defaults to ARCHIVE_BATCH_SIZE.")
+def archive_items_command(older_than_days: Optional[int], batch_size: Optional[int]):
+    """
+    Move closed items and their bids into the archive collections.
+    """
+    older_than = timedelta(days=older_than_days) if older_than_days is not None else None
+    count = archive_items(older_than, batch_size)
+    click.echo(f"Archived {count} items.")
@@ -0,0 +1,389 @@
+"""
+ASGI application
+================
+
+Serves the item bid API asynchronously with the Motor MongoDB driver, and
+passes everything else to the Flask application. While a request waits on
+MongoDB, the event loop serves other requests, so one process can hold
+thousands of concurrent API connections.
+
+To run it, install the async extras and start an ASGI server:
+    $ pip install -e .[async]
+    $ uvicorn tjts5901.asgi:application --port 5001
+
+Async endpoints mirror the ``/api/items`` ones, under ``/api/async/items``:
+
+- ``GET /api/async/items/<id>/bids`` lists the bids for an item.
+- ``POST /api/async/items/<id>/bids`` places a bid. Accepts the ``amount`` as
+  form data or JSON.
+
+They authenticate with the API access tokens (``Authorization: Bearer <token>``)
+only. Validation is shared with the sync API, see :func:`tjts5901.items.validate_bid`.
+Bids go through the same `bid` rate limit and admission control as the sync
+API, see :mod:`tjts5901.ratelimit`, and notify the outbid bidder the same way.
+The notifications are enqueued from a thread, as enqueuing can block.
+
+The item price is updated with a compare-and-set on the price the bid was
+validated against. If another bid got in between, the bid is validated again
+against the new price.
+"""
+
+import asyncio
+from datetime import datetime
+from math import ceil
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from bson import ObjectId
+from flask import Flask
+from flask_babel import force_locale
+from mongoengine.connection import DEFAULT_DATABASE_NAME
+from pymongo import WriteConcern
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header
+
+from .db import POOL_OPTIONS, read_preference, write_concern
+from .i18n import SupportedLocales
+from .items import BidError, minimum_bid, parse_bid_amount, send_outbid_notification, validate_bid
+from .ratelimit import RATELIMIT_HITS, RateLimiter
+from .models import AccessToken, Bid, Item, SellerStats, User
+from .stats import increments
+from .watchlist import notify_watchers
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # pragma: no cover
+    WsgiToAsgi = AsyncIOMotorClient = None
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/async/items/"
+"Path prefix for the async API."
+
+MAX_BODY_SIZE = 64 * 1024
+"Maximum request body size, in bytes."
+
+MAX_PRICE_ATTEMPTS = 3
+"How many times a bid is validated again when other bids change the price in between."
+
+_BIDS_PATH = re.compile(r"^/api/async/items/(?P<id>[0-9a-fA-F]{24})/bids$")
+
+
+def _jsonable(document: Dict) -> Dict:
+    """
+    Convert a MongoDB document into JSON serializable dictionary.
+    """
+    data = {}
+    for key, value in document.items():
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        data[key] = value
+    return data
+
+
+class AsyncBidAPI:
+    """
+    ASGI application for the async item bid API.
+
+    :param flask_app: Flask application, used for configuration and translations.
+    :param database: Motor database to use.
+    """
+
+    def __init__(self, flask_app: Flask, database):
+        self.flask_app = flask_app
+        self.database = database
+
+        self.items = database[Item._get_collection_name()]  # pylint: disable=protected-access
+        self.bids = database[Bid._get_collection_name()]  # pylint: disable=protected-access
+        self.tokens = database[AccessToken._get_collection_name()]  # pylint: disable=protected-access
+        self.users = database[User._get_collection_name()]  # pylint: disable=protected-access
+        self.seller_stats = database[SellerStats._get_collection_name()]  # pylint: disable=protected-access
+
+        # Reads and writes are routed like in the sync API, see `tjts5901.db`.
+        with flask_app.app_context():
+            concern = WriteConcern(**write_concern())
+            self.bid_writes = database.get_collection(self.bids.name, write_concern=concern)
+            self.item_writes = database.get_collection(self.items.name, write_concern=concern)
+            self.bid_reads = database.get_collection(
+                self.bids.name, read_preference=read_preference("api_items.api_item_bids"))
+
+        self.locales = [locale.value for locale in SupportedLocales]
+
+    async def __call__(self, scope, receive, send):
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+
+        match = _BIDS_PATH.match(scope["path"])
+        if match is None:
+            return await self.respond(send, 404, {"success": False, "error": "Not found"})
+
+        if scope["method"] == "POST" and self.flask_app.config["RATELIMIT_ENABLED"]:
+            limiter: RateLimiter = self.flask_app.extensions['ratelimit']
+            # Like the sync API, checked before any database work.
+            if not limiter.admit(wait=False):
+                RATELIMIT_HITS.labels("bid", "rejected").inc()
+                logger.warning("Too many concurrent requests for %s", "bid", extra={"limit": "bid"})
+                return await self.respond(send, 503, {"success": False, "error": "Service Unavailable"},
+                                          retry_after=self.flask_app.config["RATELIMIT_RETRY_AFTER"])
+            try:
+                limited = await self.check_rate_limit(limiter, headers)
+                if limited is not None:
+                    return await self.respond(send, 429, {"success": False, "error": "Too Many Requests"},
+                                              retry_after=limited.retry_after)
+                return await self.handle(scope, receive, send, headers, match["id"])
+            finally:
+                limiter.release()
+
+        return await self.handle(scope, receive, send, headers, match["id"])
+
+    async def handle(self, scope, receive, send, headers: Dict[str, str], item_id: str):
+        user = await self.authenticate(headers)
+        if user is None:
+            return await self.respond(send, 401, {"success": False, "error": "Unauthorized"})
+
+        locale = user.get("locale") or self.best_locale(headers)
+
+        # Translations need an application context.
+        with self.flask_app.app_context(), force_locale(locale):
+            if scope["method"] == "GET":
+                status, data = await self.item_bids(item_id)
+            elif scope["method"] == "POST":
+                body = await self.read_body(receive)
+                if body is None:
+                    status, data = 413, {"success": False, "error": "Request too large"}
+                else:
+                    status, data = await self.place_bid(item_id, user, self.parse_body(headers, body))
+            else:
+                status, data = 405, {"success": False, "error": "Method not allowed"}
+
+            return await self.respond(send, status, data)
+
+    @staticmethod
+    async def check_rate_limit(limiter: RateLimiter, headers: Dict[str, str]):
+        """
+        Check the `bid` rate limit of the client, sharing the buckets with the sync API.
+
+        :return: Exception with the `retry_after` if the request is limited.
+        """
+        key = limiter.token_key(headers.get("authorization", ""))
+        if limiter.backend.blocking:
+            return await asyncio.to_thread(limiter.check, "bid", key)
+        return limiter.check("bid", key)
+
+    def best_locale(self, headers: Dict[str, str]) -> str:
+        accept = parse_accept_header(headers.get("accept-language", ""), LanguageAccept)
+        return accept.best_match(self.locales) or SupportedLocales.EN.value
+
+    async def authenticate(self, headers: Dict[str, str]) -> Optional[Dict]:
+        """
+        Get the user for the API token in the `Authorization` header.
+        """
+        api_key = headers.get("authorization")
+        if not api_key:
+            return None
+
+        api_key = api_key.replace("Bearer ", "", 1)
+        token = await self.tokens.find_one({"token": api_key})
+        if token is None:
+            logger.error("Token not found: %s", api_key)
+            return None
+
+        now = datetime.utcnow()
+        if token.get("expires") and token["expires"] < now:
+            logger.warning("Token expired: %s", api_key)
+            return None
+
+        user = await self.users.find_one({"_id": token["user"]})
+        if user is None or user.get("is_disabled"):
+            return None
+
+        await self.tokens.update_one({"_id": token["_id"]}, {"$set": {"last_used_at": now}})
+        return user
+
+    @staticmethod
+    async def read_body(receive) -> Optional[bytes]:
+        """
+        Read the request body. Returns `None` if it's larger than :data:`MAX_BODY_SIZE`.
+        """
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > MAX_BODY_SIZE:
+                return None
+        return body
+
+    @staticmethod
+    def parse_body(headers: Dict[str, str], body: bytes) -> Dict:
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                return {}
+            return data if isinstance(data, dict) else {}
+
+        return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+    async def get_item(self, item_id: str) -> Optional[Dict]:
+        return await self.items.find_one({"_id": ObjectId(item_id)})
+
+    async def get_winning_bid(self, item: Dict) -> Optional[Dict]:
+        """
+        Get the highest bid placed before the item closes.
+        """
+        return await self.bids.find_one(
+            {"item": item["_id"], "created_at": {"$lt": item["closes_at"]}},
+            sort=[("amount", -1)],
+        )
+
+    async def item_bids(self, item_id: str) -> Tuple[int, Dict]:
+        item = await self.get_item(item_id)
+        if item is None:
+            return 404, {"success": False, "error": "Not found"}
+
+        bids: List[Dict] = []
+        async for bid in self.bid_reads.find({"item": item["_id"]}).sort("amount", -1):
+            bids.append(_jsonable(bid))
+
+        return 200, {"success": True, "bids": bids}
+
+    async def place_bid(self, item_id: str, user: Dict, data: Dict) -> Tuple[int, Dict]:
+        for _attempt in range(MAX_PRICE_ATTEMPTS):
+            item = await self.get_item(item_id)
+            if item is None:
+                return 404, {"success": False, "error": "Not found"}
+
+            winning_bid = await self.get_winning_bid(item)
+            min_amount = minimum_bid(item["starting_bid"], winning_bid["amount"] if winning_bid else None)
+
+            try:
+                amount = parse_bid_amount(data.get("amount"))
+                validate_bid(amount, min_amount, item["closes_at"])
+            except BidError as exc:
+                return 200, {"success": False, "error": str(exc)}
+
+            # Only take the price if no other bid has changed it since it was read,
+            # so that the item read is the one this bid displaced.
+            claimed = await self.item_writes.update_one({"_id": item["_id"], "price": item.get("price")},
+                                                        {"$set": {"price": amount, "top_bidder": user["_id"]}})
+            if claimed.matched_count:
+                break
+        else:
+            return 409, {"success": False, "error": "Too many concurrent bids, try again"}
+
+        bid = {
+            "amount": amount,
+            "bidder": user["_id"],
+            "item": item["_id"],
+            "created_at": datetime.utcnow(),
+        }
+        try:
+            result = await self.bid_writes.insert_one(bid)
+        except Exception:
+            await self.item_writes.update_one({"_id": item["_id"], "price": amount},
+                                              {"$set": {"price": item.get("price"),
+                                                        "top_bidder": item.get("top_bidder")}})
+            raise
+        bid["_id"] = result.inserted_id
+        await self.seller_stats.update_one(*increments(item["seller"], bids_received=1), upsert=True)
+
+        # Items priced before the top bidder was kept have it in the bids only.
+        outbid = item.get("top_bidder") or (winning_bid and winning_bid["bidder"])
+        if outbid == user["_id"]:
+            outbid = None
+        if outbid or item.get("watchers"):
+            await asyncio.to_thread(self.notify_bid, item, user["_id"], outbid, amount)
+
+        return 200, {"success": True, "bid": _jsonable(bid)}
+
+    @staticmethod
+    def notify_bid(item: Dict, bidder_id: ObjectId, outbid_id: Optional[ObjectId], amount: int):
+        """
+        Notify the outbid bidder and the watchers of the item of a new bid.
+
+        Run in a thread, as enqueuing the tasks can block: a durable task is
+        saved with pymongo, and a task is run right away when the queue is full.
+        """
+        if outbid_id:
+            send_outbid_notification(outbid_id, item["title"], amount)
+        if item.get("watchers"):
+            notify_watchers.delay(str(item["_id"]), "bid", exclude=str(bidder_id))
+
+    @staticmethod
+    async def respond(send, status: int, data: Dict, retry_after: Optional[float] = None):
+        body = json.dumps(data).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(max(1, ceil(retry_after))).encode("ascii")))
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None, database=None):
+    """
+    Create an ASGI application serving the async API, and the Flask application.
+
+    :param flask_app: Flask application. Defaults to :data:`tjts5901.app.flask_app`.
+    :param database: Motor database. Defaults to one connected to `MONGO_URL`.
+    :return: The ASGI application.
+    """
+    if AsyncIOMotorClient is None:
+        raise RuntimeError("Async API requires motor and asgiref. Install them with: pip install -e .[async]")
+
+    if flask_app is None:
+        from .app import flask_app  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    if database is None:
+        settings = flask_app.config.get("MONGODB_SETTINGS") or {}
+        # Pool settings as in the sync client, see `tjts5901.db`.
+        pool = {option: flask_app.config[key] for key, option in POOL_OPTIONS.items()
+                if flask_app.config.get(key) is not None}
+        client = AsyncIOMotorClient(settings.get("host", "mongodb://localhost"), **pool)
+        database = client.get_default_database(default=DEFAULT_DATABASE_NAME)
+
+    api = AsyncBidAPI(flask_app, database)
+    wsgi = WsgiToAsgi(flask_app)
+
+    async def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] == "http" and scope["path"].startswith(API_PREFIX):
+            return await api(scope, receive, send)
+
+        return await wsgi(scope, receive, send)
+
+    return application
+
+
+def __getattr__(name: str):
+    """
+    Create the default ASGI application on first access of `application`.
+    """
+    global application  # pylint: disable=global-variable-undefined,invalid-name
+
+    if name != "application":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    application = create_asgi_app()
+    return application
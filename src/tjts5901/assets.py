@@ -0,0 +1,280 @@
+"""
+Static assets module.
+
+Fingerprints the files in the static folder, so that they can be served with
+long-lived, immutable caching headers. When a file changes, its fingerprint
+changes, and so does the URL the templates render for it.
+
+To build the fingerprinted assets and the manifest, run the following command:
+    $ flask build-assets
+
+Templates don't need changes; ``url_for('static', filename='style.css')`` emits
+the fingerprinted URL automatically when a manifest is available. Without a
+manifest, static files are served as before.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+import click
+from flask import (
+    Flask,
+    current_app,
+    request,
+    send_from_directory,
+)
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+"Name of the manifest file in the build directory."
+
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".ttf", ".json", ".xml", ".webmanifest", ".ico", ".txt"}
+"File types that benefit from precompression. Images and woff files are already compressed."
+
+PRECOMPRESSED = (
+    # (Content-Encoding, file suffix)
+    ("br", ".br"),
+    ("gzip", ".gz"),
+)
+
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'"()]+)\1\s*\)""")
+
+
+class AssetManifest:
+    """
+    Mapping between static files and their fingerprinted counterparts.
+
+    The manifest is loaded from the build directory. If it's missing, the
+    manifest is empty and static files are served unchanged.
+    """
+
+    def __init__(self, build_dir: str):
+        self.build_dir = build_dir
+        self.assets: Dict[str, str] = {}
+        self.reverse: Dict[str, str] = {}
+
+    def load(self) -> "AssetManifest":
+        """
+        Load the manifest from the build directory, if one exists.
+        """
+        manifest_file = os.path.join(self.build_dir, MANIFEST_NAME)
+        try:
+            with open(manifest_file, encoding="utf-8") as f:
+                self.update(json.load(f))
+        except FileNotFoundError:
+            logger.debug("No asset manifest found at %s, serving static files as is.", manifest_file)
+        except ValueError as exc:
+            logger.warning("Asset manifest %s is corrupted: %s", manifest_file, exc)
+        return self
+
+    def update(self, assets: Dict[str, str]):
+        """
+        Replace the manifest contents.
+        """
+        self.assets = dict(assets)
+        self.reverse = {hashed: original for original, hashed in self.assets.items()}
+
+    def __bool__(self) -> bool:
+        return bool(self.assets)
+
+
+def init_assets(app: Flask):
+    """
+    Initialize the static assets module.
+
+    Replaces the static file view with one that serves fingerprinted files with
+    immutable caching, and registers an url default to emit fingerprinted urls.
+
+    :param app: The Flask application.
+    :return: The asset manifest.
+    """
+
+    app.config.setdefault("ASSETS_BUILD_DIR", os.path.join(app.instance_path, "assets"))
+    app.config.setdefault("ASSETS_MAX_AGE", 31536000)
+
+    manifest = AssetManifest(app.config["ASSETS_BUILD_DIR"]).load()
+    app.extensions["assets"] = manifest
+
+    if app.has_static_folder:
+        app.url_defaults(_fingerprint_static_url)
+        app.view_functions["static"] = send_static_asset
+
+    app.cli.add_command(build_assets)
+
+    return manifest
+
+
+def _fingerprint_static_url(endpoint: str, values: Dict):
+    """
+    Url default callback to swap static filenames for the fingerprinted ones.
+    """
+    if endpoint != "static" or "filename" not in values:
+        return
+
+    manifest: AssetManifest = current_app.extensions["assets"]
+    if hashed := manifest.assets.get(values["filename"]):
+        values["filename"] = hashed
+
+
+def send_static_asset(filename: str):
+    """
+    Serve a static file.
+
+    Fingerprinted files are served from the build directory with immutable
+    caching, and with a precompressed variant if the client accepts one.
+    Other files fall back to the default Flask static file handling.
+    """
+
+    manifest: AssetManifest = current_app.extensions["assets"]
+    original = manifest.reverse.get(filename)
+    if original is None:
+        return current_app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(original)[0] or "application/octet-stream"
+    max_age = current_app.config["ASSETS_MAX_AGE"]
+
+    path = filename
+    encoding = None
+    for content_encoding, suffix in PRECOMPRESSED:
+        if request.accept_encodings[content_encoding] and \
+                os.path.isfile(os.path.join(manifest.build_dir, filename + suffix)):
+            path = filename + suffix
+            encoding = content_encoding
+            break
+
+    response = send_from_directory(manifest.build_dir, path, mimetype=mimetype, max_age=max_age)
+
+    response.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+def fingerprint(content: bytes) -> str:
+    """
+    Return a short content hash used in the fingerprinted filenames.
+    """
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def _hashed_name(filename: str, digest: str) -> str:
+    root, ext = posixpath.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+
+def _rewrite_css_urls(filename: str, content: bytes, assets: Dict[str, str]) -> bytes:
+    """
+    Point relative ``url()`` references in a stylesheet to the fingerprinted files.
+    """
+    base = posixpath.dirname(filename)
+
+    def replace(match: re.Match) -> str:
+        quote, url = match.groups()
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+
+        # Keep query strings and fragments, eg. font files with `#iefix`.
+        path, suffix = re.match(r"([^?#]*)(.*)", url).groups()
+        target = posixpath.normpath(posixpath.join(base, path))
+        if hashed := assets.get(target):
+            url = posixpath.relpath(hashed, base or ".") + suffix
+        return f"url({quote}{url}{quote})"
+
+    return _CSS_URL_RE.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+
+def _write_precompressed(path: Path, content: bytes):
+    """
+    Write gzip and brotli variants of the file, if they are smaller.
+    """
+    variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(content, quality=11)
+
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+def build_manifest(static_folder: str, build_dir: str, compress: bool = True) -> Dict[str, str]:
+    """
+    Fingerprint the static files into the build directory.
+
+    Stylesheets are processed last, so that their ``url()`` references can be
+    rewritten to the fingerprinted fonts and images, before they are hashed
+    themselves.
+
+    :param static_folder: Folder to read the static files from.
+    :param build_dir: Folder to write the fingerprinted files and the manifest into.
+    :param compress: Whether to write precompressed variants.
+    :return: The manifest, mapping the original filenames to fingerprinted ones.
+    """
+
+    static_root = Path(static_folder).resolve()
+    build_root = Path(build_dir).resolve()
+
+    files = []
+    for path in sorted(static_root.rglob("*")):
+        if not path.is_file() or build_root in path.parents:
+            continue
+        files.append(path.relative_to(static_root).as_posix())
+
+    # Stylesheets are sorted last, as they refer to other assets.
+    files.sort(key=lambda name: name.endswith(".css"))
+
+    assets: Dict[str, str] = {}
+    for filename in files:
+        content = (static_root / filename).read_bytes()
+        if filename.endswith(".css"):
+            content = _rewrite_css_urls(filename, content, assets)
+
+        hashed = _hashed_name(filename, fingerprint(content))
+        target = build_root / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+
+        if compress and target.suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            _write_precompressed(target, content)
+
+        assets[filename] = hashed
+
+    with open(build_root / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(assets, f, indent=2, sort_keys=True)
+
+    return assets
+
+
+@click.command()
+@click.option("--no-compress", is_flag=True, help="Skip writing precompressed variants.")
+def build_assets(no_compress: bool = False):
+    """
+    Fingerprint static files, and write the asset manifest.
+
+    This command is meant to be run on build, before the application is started:
+        $ flask build-assets
+    """
+
+    build_dir = current_app.config["ASSETS_BUILD_DIR"]
+    click.echo(f"Building static assets into {build_dir}...")
+
+    assets = build_manifest(current_app.static_folder, build_dir, compress=not no_compress)
+    current_app.extensions["assets"].update(assets)
+
+    click.echo(f"Done. Fingerprinted {len(assets)} files.")
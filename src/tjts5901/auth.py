@@ -15,9 +15,11 @@ from flask_login import (
 from flask_babel import _
 from babel.dates import get_timezone
 from werkzeug.security import check_password_hash, generate_password_hash
-from sentry_sdk import set_user
 
+from .db import routed
 from .models import AccessToken, Bid, User, Item
+from .stats import get_seller_stats
+from .tasks import task
 
 from mongoengine import DoesNotExist
 from mongoengine.queryset.visitor import Q
@@ -61,8 +63,8 @@ def load_user_from_request(request):
                 return None
             # User is authenticated
 
-            token.last_used_at = datetime.utcnow()
-            token.save()
+            # Update the usage time in the background, it's not needed for the response.
+            touch_access_token.delay(str(token.id), datetime.utcnow())
             logger.debug("User authenticated via token: %r", token.user.email, extra={
                 "user": token.user.email,
                 "user_id": str(token.user.id),
@@ -75,10 +77,20 @@ def load_user_from_request(request):
     return None
 
 
+@task
+def touch_access_token(token_id: str, used_at: datetime):
+    """
+    Task to update the last usage time of the access token.
+    """
+    AccessToken.objects(id=token_id).update_one(set__last_used_at=used_at)
+
+
 def load_logged_in_user(user_id):
     """
     Load a user from the database, given the user's id.
     """
+    from sentry_sdk import set_user  # pylint: disable=import-outside-toplevel
+
     try:
         user = User.objects.get(id=user_id)
         set_user({"id": str(user.id), "email": user.email})
@@ -227,15 +239,20 @@ def profile(email):
 
     user: User = get_user_by_email(email)
 
-    # List the items user has created
-    items = Item.objects(seller=user).all()
+    # List the items user has created. References are fetched in one query per
+    # collection, instead of one per item when the template accesses them.
+    # The lists may lag behind a little, as they are read from the secondaries.
+    items = routed(Item.objects(seller=user)).select_related()
 
     # List the items user has won
     # TODO: Could be done smarter with a join
-    bids = Bid.objects(bidder=user).only("id").all()
-    won_items = Item.objects(winning_bid__in=bids).all()
+    bids = routed(Bid.objects(bidder=user)).only("id").all()
+    won_items = routed(Item.objects(winning_bid__in=bids)).select_related()
+
+    # The seller dashboard is only shown to the seller.
+    stats = get_seller_stats(user) if user == current_user else None
 
-    return render_template('auth/profile.html', user=user, items=items, won_items=won_items)
+    return render_template('auth/profile.html', user=user, items=items, won_items=won_items, stats=stats)
 
 
 @bp.route('/profile/<email>/token', methods=('GET', 'POST'), defaults={'email': 'me'})
@@ -296,4 +313,5 @@ def delete_user_access_token(email, id):
     token.delete()
 
     flash(f"Deleted token {token.name}")
-    return redirect(url_for('auth.user_access_tokens', email=token.user.email))
+    # The tokens page can only be built for the current user, see the route defaults.
+    return redirect(url_for('auth.user_access_tokens'))
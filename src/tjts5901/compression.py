@@ -0,0 +1,208 @@
+"""
+Response compression module.
+
+Compresses the responses with gzip, or with brotli if the package is installed
+and the client accepts it. Small responses and already compressed content types
+are passed as is. Streamed responses are compressed as they are generated, so
+that they stay streamed. The compressed stream is flushed out once at least
+`COMPRESS_STREAM_FLUSH_SIZE` bytes have been generated, instead of after every
+chunk: exports yield a row per chunk, and flushing each row would leave the
+compressor little to work with.
+
+Compression can be tuned per blueprint with the `COMPRESS_BLUEPRINTS` config
+variable, mapping blueprint names to option overrides, or to `False` to
+disable compression for the blueprint::
+
+    COMPRESS_BLUEPRINTS = {
+        "api_items": {"COMPRESS_MIN_SIZE": 200},
+        "notification": False,
+    }
+
+"""
+
+import gzip
+import logging
+import zlib
+from typing import Dict, Iterable, Iterator, Optional
+
+from flask import Flask, Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIMETYPES = [
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "text/csv",
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "image/svg+xml",
+]
+"Content types to compress. Images, fonts and archives are already compressed."
+
+
+def init_compression(app: Flask):
+    """
+    Initialize the response compression.
+
+    :param app: The Flask application.
+    """
+
+    app.config.setdefault("COMPRESS_ENABLED", True)
+    app.config.setdefault("COMPRESS_ALGORITHMS", ["br", "gzip"])
+    app.config.setdefault("COMPRESS_MIMETYPES", DEFAULT_MIMETYPES)
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    app.config.setdefault("COMPRESS_LEVEL", 6)
+    app.config.setdefault("COMPRESS_BR_LEVEL", 4)
+    app.config.setdefault("COMPRESS_STREAMS", True)
+    app.config.setdefault("COMPRESS_STREAM_FLUSH_SIZE", 32 * 1024)
+    app.config.setdefault("COMPRESS_BLUEPRINTS", {})
+
+    app.after_request(compress_response)
+
+    logger.debug("Initialized response compression.", extra={
+        "brotli_available": brotli is not None,
+    })
+
+
+def compression_options(blueprint: Optional[str] = None) -> Optional[Dict]:
+    """
+    Get the compression options for the blueprint.
+
+    :param blueprint: Name of the blueprint. Defaults to the current request blueprint.
+    :return: The options, or `None` if the compression is disabled.
+    """
+    config = current_app.config
+    if not config["COMPRESS_ENABLED"]:
+        return None
+
+    if blueprint is None:
+        blueprint = request.blueprint
+
+    options = config.get_namespace("COMPRESS_", lowercase=False, trim_namespace=False)
+    overrides = config["COMPRESS_BLUEPRINTS"].get(blueprint, {})
+    if overrides is False:
+        return None
+
+    options.update(overrides)
+    return options
+
+
+def select_encoding(algorithms: Iterable[str]) -> Optional[str]:
+    """
+    Select the first content encoding from the `algorithms` the client accepts.
+    """
+    for algorithm in algorithms:
+        if algorithm == "br" and brotli is None:
+            continue
+        if request.accept_encodings[algorithm]:
+            return algorithm
+    return None
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress the response, if the client accepts it, and it's worth it.
+
+    This function is registered as `after_request` handler.
+    """
+
+    # File responses are passed through, static files have their own precompressed variants.
+    if response.direct_passthrough \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or "Content-Encoding" in response.headers \
+            or request.method == "HEAD":
+        return response
+
+    options = compression_options()
+    if options is None or response.mimetype not in options["COMPRESS_MIMETYPES"]:
+        return response
+
+    if response.is_streamed and not options["COMPRESS_STREAMS"]:
+        return response
+
+    # Response content depends on the request header from now on.
+    response.vary.add("Accept-Encoding")
+
+    if not response.is_streamed and response.calculate_content_length() < options["COMPRESS_MIN_SIZE"]:
+        return response
+
+    encoding = select_encoding(options["COMPRESS_ALGORITHMS"])
+    if encoding is None:
+        return response
+
+    if encoding == "br":
+        level = options["COMPRESS_BR_LEVEL"]
+    else:
+        level = options["COMPRESS_LEVEL"]
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), encoding, level, response.response,
+                                             flush_size=options["COMPRESS_STREAM_FLUSH_SIZE"])
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding, level))
+
+    response.headers["Content-Encoding"] = encoding
+
+    # Compressed body is not byte-for-byte the same as the original.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """
+    Compress the data in one go.
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: str, level: int, original=None,
+                     flush_size: int = 32 * 1024) -> Iterator[bytes]:
+    """
+    Compress the chunks as they are generated.
+
+    The compressed data is flushed out after every `flush_size` bytes of
+    input, so that the client receives the data while the application
+    generates it, and the compression ratio stays close to compressing the
+    whole response at once.
+    """
+    try:
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=level)
+            process, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            process, finish = compressor.compress, compressor.flush
+
+            def flush():
+                return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        pending = 0
+        for chunk in chunks:
+            data = process(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+
+    finally:
+        # Let the original iterable clean up, eg. close the database cursor.
+        if hasattr(original, "close"):
+            original.close()
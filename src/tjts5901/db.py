@@ -1,11 +1,67 @@
+"""
+Database
+========
+
+Connects to MongoDB with the connection string in `MONGO_URL`.
+
+Reads and writes are routed per query. Read-only listing traffic, the
+endpoints in `MONGO_SECONDARY_READS`, can read from the replica set
+secondaries with :func:`routed`, at most `MONGO_MAX_STALENESS` seconds behind
+the primary. Everything else reads from the primary. Writes that decide an
+auction, bids and closing items, use :func:`write_concern` to wait for a
+majority of the replica set:
+
+    >>> items = routed(Item.objects(closes_at__gt=now))
+    >>> bid.save(write_concern=write_concern())
+
+The routing decisions are made from the configuration only, so they can be
+tested without a replica set, see `tests/test_db.py`.
+
+The connection pool is sized with the `MONGO_*_POOL_SIZE` settings, see
+:data:`POOL_OPTIONS`. Pool usage and checkout waits are published by
+:mod:`tjts5901.metrics`. Gunicorn workers open the first connections at start
+with :func:`warm_pool`, so the first requests don't pay for them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from os import environ
+from typing import Any, Dict, Optional
 
+from flask import current_app, has_request_context, request
 from flask_mongoengine import MongoEngine
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 
 db = MongoEngine()
 logger = logging.getLogger(__name__)
 
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+"Read preference modes, by their MongoDB name."
+
+SECONDARY_READS = (
+    "items.index",
+    "items.ranking",
+    "auth.profile",
+    "api_items.api_item_bids",
+    "api_items.api_item_bids_export",
+    "api_items.api_ranking",
+)
+"Default endpoints whose reads may go to the secondaries."
+
+POOL_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+}
+"Connection pool settings, and the pymongo options they set. Unset ones use the pymongo defaults."
+
 
 def init_db(app):
     """
@@ -22,6 +78,10 @@ def init_db(app):
     if mongodb_url is not None:
         app.config["MONGODB_SETTINGS"] = {
             "host": mongodb_url,
+            # Don't connect until the first query. With gunicorn `preload_app`
+            # the app is created before the workers are forked, and pymongo
+            # clients are not fork-safe once connected.
+            "connect": False,
         }
         logger.info("Database connection string found, using it.",
                     # You can use the `extra` parameter to add extra information to the log message.
@@ -32,5 +92,137 @@ def init_db(app):
         logger.warning("No database connection string found in env, using defaults.",
                        extra={"MONGODB_SETTINGS": app.config.get("MONGODB_SETTINGS")} if app.debug else {})
 
+    for key in POOL_OPTIONS:
+        value = environ.get(key)
+        app.config.setdefault(key, int(value) if value else None)
+    _apply_pool_options(app.config)
+
+    app.config.setdefault("MONGO_READ_PREFERENCE", environ.get("MONGO_READ_PREFERENCE", "secondaryPreferred"))
+    app.config.setdefault("MONGO_MAX_STALENESS", int(environ.get("MONGO_MAX_STALENESS", 90)))
+    app.config.setdefault("MONGO_SECONDARY_READS", [
+        endpoint.strip() for endpoint in environ.get("MONGO_SECONDARY_READS", ",".join(SECONDARY_READS)).split(",")
+        if endpoint.strip()
+    ])
+    app.config.setdefault("MONGO_WRITE_CONCERN", environ.get("MONGO_WRITE_CONCERN", "majority"))
+    app.config.setdefault("MONGO_WRITE_TIMEOUT", int(environ.get("MONGO_WRITE_TIMEOUT", 5000)))
+
+    mode = app.config["MONGO_READ_PREFERENCE"]
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {mode!r}")
+
     db.init_app(app)
 
+
+def _apply_pool_options(config):
+    """
+    Add the pool settings to `MONGODB_SETTINGS`, unless set there already.
+
+    Without `MONGO_URL` the settings may be missing, or a list of connections.
+    Missing settings are created from the `MONGODB_` prefixed variables, which
+    flask-mongoengine would otherwise read, so that the pool settings aren't
+    dropped.
+    """
+    options = {option: config[key] for key, option in POOL_OPTIONS.items() if config[key] is not None}
+    if not options:
+        return
+
+    settings = config.get("MONGODB_SETTINGS")
+    if settings is None:
+        settings = config["MONGODB_SETTINGS"] = {
+            key: value for key, value in config.items() if key.startswith("MONGODB_")
+        }
+
+    for connection in settings if isinstance(settings, list) else [settings]:
+        for option, value in options.items():
+            connection.setdefault(option, value)
+
+
+def warm_pool(app, connections: Optional[int] = None):
+    """
+    Open connections to the database ahead of the first requests.
+
+    Runs pings from parallel threads, so each checks out a connection of its
+    own. Meant to be called in a gunicorn worker after the fork, see
+    `gunicorn.conf.py`. Failures are logged, as the worker can still serve
+    requests, connecting on demand.
+
+    :param app: Flask application.
+    :param connections: Number of connections to open. Defaults to
+                        `MONGO_MIN_POOL_SIZE`, or one.
+    """
+    if connections is None:
+        connections = app.config.get("MONGO_MIN_POOL_SIZE") or 1
+
+    def ping():
+        with app.app_context():
+            db.get_db().client.admin.command("ping")
+
+    try:
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="warm-pool") as executor:
+            for future in [executor.submit(ping) for _ in range(connections)]:
+                future.result()
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.warning("Could not warm the database connection pool: %s", exc)
+    else:
+        logger.info("Warmed the database connection pool", extra={"connections": connections})
+
+
+def read_preference(endpoint: Optional[str] = None):
+    """
+    Return the read preference for the reads of an endpoint.
+
+    Endpoints in `MONGO_SECONDARY_READS` get the `MONGO_READ_PREFERENCE` mode,
+    with `MONGO_MAX_STALENESS`. Other endpoints, and reads outside of a
+    request, eg. in background tasks, read from the primary.
+
+    :param endpoint: Endpoint name, eg. `items.index`. Defaults to the endpoint
+                     of the current request.
+    :return: A pymongo read preference.
+    """
+    if endpoint is None and has_request_context():
+        endpoint = request.endpoint
+
+    if endpoint not in current_app.config["MONGO_SECONDARY_READS"]:
+        return Primary()
+    return secondary_read_preference()
+
+
+def secondary_read_preference():
+    """
+    Return the configured read preference for reads that can be stale.
+
+    The `MONGO_READ_PREFERENCE` mode, with `MONGO_MAX_STALENESS`. Used for the
+    endpoints in `MONGO_SECONDARY_READS`, and for bulk reads outside of a
+    request, eg. the `flask export-bids` command.
+
+    :return: A pymongo read preference.
+    """
+    config = current_app.config
+    mode = READ_PREFERENCES[config["MONGO_READ_PREFERENCE"]]
+    if mode is Primary:
+        return Primary()
+    return mode(max_staleness=config["MONGO_MAX_STALENESS"])
+
+
+def routed(queryset):
+    """
+    Route the reads of a queryset by the current endpoint, see :func:`read_preference`.
+
+    :param queryset: Mongoengine queryset.
+    :return: The queryset, with the read preference set.
+    """
+    return queryset.read_preference(read_preference())
+
+
+def write_concern() -> Dict[str, Any]:
+    """
+    Return the write concern for writes deciding an auction, like bids and closing items.
+
+    :return: Write concern as keyword arguments, for mongoengine `write_concern`
+             or pymongo :class:`~pymongo.write_concern.WriteConcern`.
+    """
+    w = current_app.config["MONGO_WRITE_CONCERN"]
+    if isinstance(w, str) and w.isdigit():
+        w = int(w)
+    return {"w": w, "wtimeout": current_app.config["MONGO_WRITE_TIMEOUT"]}
+
@@ -0,0 +1,200 @@
+"""
+Bid export module.
+
+Streams bids as NDJSON or CSV straight from a MongoDB cursor. Documents are
+fetched in batches with only the exported fields, and each row is written out
+as soon as it's read, so memory use doesn't grow with the number of bids.
+
+Exports are available per item from the API at `/api/items/<id>/bids/export`,
+and for the whole collection from the command line:
+    $ flask export-bids --format csv --output bids.csv
+"""
+
+import csv
+from datetime import datetime
+import io
+import json
+import logging
+from os import environ
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+
+import click
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+
+from .db import read_preference, secondary_read_preference
+from .models import Bid
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = ("amount", "created_at", "bidder")
+"Default fields to export."
+
+EXPORTABLE_FIELDS = ("id", "item", "bidder", "amount", "created_at")
+"Fields that can be exported."
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+"Export formats and their mimetypes."
+
+
+def init_export(app: Flask):
+    """
+    Initialize the bid export.
+    """
+    app.config.setdefault("EXPORT_BATCH_SIZE", int(environ.get("EXPORT_BATCH_SIZE", 1000)))
+    app.cli.add_command(export_bids)
+
+
+def parse_fields(value: Optional[str]) -> Sequence[str]:
+    """
+    Parse a comma separated list of field names.
+
+    :param value: Field names, eg. `amount,created_at`. Defaults to :data:`EXPORT_FIELDS`.
+    :raises ValueError: If a field can't be exported.
+    :return: The field names.
+    """
+    if not value:
+        return EXPORT_FIELDS
+
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    if unknown := set(fields) - set(EXPORTABLE_FIELDS):
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def _field_value(document: Dict, field: str):
+    value = document.get("_id" if field == "id" else field)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_bids(query: Dict, fields: Sequence[str], batch_size: Optional[int] = None,
+              preference=None) -> Iterator[Dict]:
+    """
+    Iterate the bid documents matching the query.
+
+    Reads raw documents from the collection with a projection, skipping the
+    document class and reference dereferencing. The cursor is set up right
+    away, so the returned iterator can be consumed outside the app context,
+    eg. in a streamed response.
+
+    :param query: MongoDB query, eg. `{"item": item.id}`.
+    :param fields: Fields to fetch.
+    :param batch_size: Documents per cursor batch. Defaults to `EXPORT_BATCH_SIZE`.
+    :param preference: Read preference. Defaults to the one of the current
+                       endpoint, see :func:`~tjts5901.db.read_preference`.
+    """
+    if batch_size is None:
+        batch_size = current_app.config["EXPORT_BATCH_SIZE"]
+    if preference is None:
+        preference = read_preference()
+
+    projection = {"_id" if field == "id" else field: 1 for field in fields}
+    if "id" not in fields:
+        projection["_id"] = 0
+
+    collection = Bid._get_collection()  # pylint: disable=protected-access
+    collection = collection.with_options(read_preference=preference)
+    cursor = collection.find(query, projection, batch_size=batch_size)
+
+    def documents():
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    return documents()
+
+
+def ndjson_rows(documents: Iterable[Dict], fields: Sequence[str]) -> Iterator[str]:
+    """
+    Format documents as newline delimited JSON.
+    """
+    for document in documents:
+        yield json.dumps({field: _field_value(document, field) for field in fields}) + "\n"
+
+
+def csv_rows(documents: Iterable[Dict], fields: Sequence[str]) -> Iterator[str]:
+    """
+    Format documents as CSV, with a header row.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        row = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return row
+
+    writer.writerow(fields)
+    yield flush()
+
+    for document in documents:
+        writer.writerow([_field_value(document, field) for field in fields])
+        yield flush()
+
+
+def export_rows(query: Dict, fmt: str, fields: Sequence[str], batch_size: Optional[int] = None,
+                preference=None) -> Iterator[str]:
+    """
+    Stream the bids matching the query in the given format.
+
+    :param query: MongoDB query.
+    :param fmt: One of :data:`FORMATS`.
+    :param fields: Fields to export.
+    :param batch_size: Documents per cursor batch.
+    :param preference: Read preference, see :func:`iter_bids`.
+    """
+    documents = iter_bids(query, fields, batch_size, preference)
+    if fmt == "csv":
+        return csv_rows(documents, fields)
+    return ndjson_rows(documents, fields)
+
+
+@click.command()
+@with_appcontext
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="ndjson", show_default=True)
+@click.option("--fields", default=",".join(EXPORT_FIELDS), show_default=True,
+              help=f"Comma separated fields, from: {', '.join(EXPORTABLE_FIELDS)}.")
+@click.option("--item", "item_id", default=None, help="Export only the bids of this item.")
+@click.option("--batch-size", type=int, default=None, help="Documents per cursor batch.")
+@click.option("--output", type=click.File("w", encoding="utf-8"), default="-", help="Output file.")
+def export_bids(fmt: str, fields: str, item_id: Optional[str], batch_size: Optional[int], output):
+    """
+    Export bids as NDJSON or CSV.
+
+    Example:
+        $ flask export-bids --format csv --output bids.csv
+    """
+    try:
+        field_names = parse_fields(fields)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--fields") from exc
+
+    query = {}
+    if item_id:
+        try:
+            query["item"] = ObjectId(item_id)
+        except InvalidId as exc:
+            raise click.BadParameter(f"Not an item id: {item_id}", param_hint="--item") from exc
+
+    # Outside of a request there's no endpoint to route by, and a whole
+    # collection export shouldn't load the primary.
+    count = 0
+    for row in export_rows(query, fmt, field_names, batch_size, secondary_read_preference()):
+        output.write(row)
+        count += 1
+
+    if fmt == "csv":
+        count -= 1
+
+    logger.info("Exported %d bids", count, extra={"format": fmt, "item_id": item_id})
@@ -0,0 +1,236 @@
+"""
+Health check module.
+
+Provides the `/server-info`, `/livez` and `/readyz` endpoints for monitoring
+and Kubernetes probes.
+
+Database and Sentry status is checked by a background thread on an interval,
+and the endpoints answer from the latest cached result. This keeps the probes
+cheap, no matter how often they are called.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import dataclasses
+from datetime import datetime
+import logging
+from os import environ
+import threading
+from time import perf_counter
+from typing import Optional
+
+from flask import (
+    Blueprint,
+    Flask,
+    current_app,
+    jsonify,
+    request,
+)
+
+from .utils import get_version
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('health', __name__)
+
+
+@dataclasses.dataclass
+class HealthStatus:
+    """
+    Result of a health check round.
+    """
+
+    database_connectable: bool = False
+    database_ping_ms: Optional[float] = None
+    sentry_available: bool = False
+    checked_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+def ping_database() -> bool:
+    """
+    Ping the database server.
+    """
+    from .db import db  # pylint: disable=import-outside-toplevel
+    return bool(db.connection.admin.command('ping').get("ok", False))
+
+
+def check_sentry() -> bool:
+    """
+    Check whether Sentry is integrated.
+    """
+    try:
+        from sentry_sdk import Hub  # pylint: disable=import-outside-toplevel
+        return True if Hub.current.client else False
+    except ImportError:
+        logger.warning("Sentry package is not installed")
+    except TypeError:
+        logger.info("Sentry is not integrated")
+    return False
+
+
+class HealthProber:
+    """
+    Refreshes the health status in a background thread.
+
+    The thread is started on the first access to :attr:`status`, so that it's
+    not started before gunicorn forks the workers. The first access waits for
+    the first check round, at most for the check timeout.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.interval = app.config["HEALTH_CHECK_INTERVAL"]
+        self.timeout = app.config["HEALTH_CHECK_TIMEOUT"]
+
+        self._status = HealthStatus()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Pings run in their own thread, so that a hanging ping can be timed out.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="health-ping")
+        self._pending = None
+
+    @property
+    def status(self) -> HealthStatus:
+        """
+        The latest health status.
+        """
+        if self._thread is None:
+            self.start()
+        return self._status
+
+    def start(self):
+        """
+        Run the first check, and start the background thread.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self.refresh()
+            self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception("Error refreshing health status: %s", exc)
+
+    def _ping(self) -> float:
+        with self.app.app_context():
+            started = perf_counter()
+            if not ping_database():
+                raise RuntimeError("Database ping was not ok")
+            return (perf_counter() - started) * 1000
+
+    def refresh(self) -> HealthStatus:
+        """
+        Check the database and Sentry status, and update the cached status.
+        """
+        status = HealthStatus(checked_at=datetime.utcnow())
+
+        # Don't pile up pings behind a hanging one.
+        if self._pending is None or self._pending.done():
+            self._pending = self._executor.submit(self._ping)
+
+        try:
+            status.database_ping_ms = round(self._pending.result(timeout=self.timeout), 3)
+            status.database_connectable = True
+        except FutureTimeoutError:
+            status.error = f"Database ping timed out after {self.timeout}s"
+            logger.warning("Database ping timed out", extra={"timeout": self.timeout})
+        except Exception as exc:  # pylint: disable=broad-except
+            status.error = f"Error querying mongodb server: {exc!r}"
+            logger.warning("Error querying mongodb server: %r", exc,
+                           exc_info=True,
+                           extra=self.app.config.get_namespace("MONGODB"))
+
+        status.sentry_available = check_sentry()
+
+        self._status = status
+        return status
+
+    def is_fresh(self) -> bool:
+        """
+        Whether the status has been refreshed recently.
+        """
+        checked_at = self._status.checked_at
+        if checked_at is None:
+            return False
+        return (datetime.utcnow() - checked_at).total_seconds() < self.interval * 3 + self.timeout
+
+
+def init_health(app: Flask) -> HealthProber:
+    """
+    Initialize the health check endpoints.
+    """
+    app.config.setdefault("HEALTH_CHECK_INTERVAL", float(environ.get("HEALTH_CHECK_INTERVAL", 10)))
+    app.config.setdefault("HEALTH_CHECK_TIMEOUT", float(environ.get("HEALTH_CHECK_TIMEOUT", 2)))
+
+    prober = HealthProber(app)
+    app.extensions['health'] = prober
+    app.register_blueprint(bp)
+
+    return prober
+
+
+@bp.route("/server-info")
+def server_info():
+    """
+    A simple endpoint for checking the status of the server.
+
+    This is useful for monitoring the server, and for checking that the server is
+    running correctly.
+    """
+
+    status = current_app.extensions['health'].status
+
+    response = {
+        "database_connectable": status.database_connectable,
+        "database_ping_ms": status.database_ping_ms,
+        'sentry_available': status.sentry_available,
+        "checked_at": status.checked_at.isoformat() if status.checked_at else None,
+        "version": get_version(),
+        "build_date": environ.get("BUILD_DATE", None)
+    }
+
+    # Response with pong if ping is provided.
+    ping = request.args.get("ping", None)
+    if ping is not None:
+        response["pong"] = f"{ping}"
+
+    return jsonify(response)
+
+
+@bp.route("/livez")
+def livez():
+    """
+    Liveness probe. The process is able to serve requests.
+    """
+    return jsonify({"status": "ok"})
+
+
+@bp.route("/readyz")
+def readyz():
+    """
+    Readiness probe. The database is reachable, according to a recent check.
+    """
+    prober: HealthProber = current_app.extensions['health']
+    status = prober.status
+
+    ready = status.database_connectable and prober.is_fresh()
+    return jsonify({
+        "status": "ok" if ready else "unavailable",
+        "database_connectable": status.database_connectable,
+        "database_ping_ms": status.database_ping_ms,
+        "error": status.error,
+    }), 200 if ready else 503
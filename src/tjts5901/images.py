@@ -0,0 +1,306 @@
+"""
+Item images.
+
+Images uploaded on the sell and update pages are stored in GridFS, in the
+`item_images` bucket. The upload is copied into GridFS one chunk at a time,
+so a large image is never held in memory as a whole. Uploads are limited to
+`IMAGE_MAX_SIZE` bytes, and only JPEG, PNG, GIF and WebP images are accepted,
+recognized from their first bytes rather than the name or the browser given
+content type. Larger requests than `MAX_CONTENT_LENGTH` are refused before
+the form is read.
+
+An item's previous image is deleted only after the item is saved with the
+new one, see :func:`replace_item_image`.
+
+Thumbnails in :data:`THUMBNAIL_SIZES` are made by a background task after the
+upload. They need Pillow, from the `images` extras:
+    $ pip install -e .[images]
+
+Without Pillow, the pages show the original image, and the listing none.
+
+Images and thumbnails are served from `/images/<id>`. A GridFS file is never
+changed, a new upload gets a new id, so the responses have the file id as the
+ETag, and can be cached for a year. Range requests are supported.
+"""
+
+from contextlib import contextmanager
+from io import BytesIO
+import logging
+from os import environ
+from typing import Dict, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, Flask, Response, abort, request, url_for
+from flask_babel import lazy_gettext
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+from mongoengine import signals
+from werkzeug.datastructures import FileStorage
+from werkzeug.wsgi import wrap_file
+
+from .db import db
+from .models import Item
+from .tasks import task
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("images", __name__)
+
+BUCKET = "item_images"
+"GridFS bucket for the images and thumbnails."
+
+CHUNK_SIZE = 255 * 1024
+"Bytes read from the upload, and stored in GridFS, at a time. Same as the GridFS default chunk size."
+
+THUMBNAIL_SIZES = {
+    "small": (160, 160),
+    "medium": (640, 640),
+}
+"Thumbnail sizes, by name. Thumbnails keep the image aspect ratio, and fit in the size."
+
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+"Seconds the images can be cached."
+
+IMAGE_TYPES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif",
+}
+"Content types by the first bytes of the file. WebP is checked separately, see :func:`sniff_content_type`."
+
+
+class ImageError(ValueError):
+    """
+    Raised when an uploaded image is not accepted.
+
+    The message is a lazy string, translated when it's converted to a string.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+def init_images(app: Flask):
+    """
+    Initialize the item images.
+    """
+    app.config.setdefault("IMAGE_MAX_SIZE", int(environ.get("IMAGE_MAX_SIZE", 10 * 1024 * 1024)))
+
+    # Refuse larger requests before the form is parsed, with some room for the other fields.
+    # Flask has the key with `None` by default, so `setdefault` wouldn't do.
+    if app.config.get("MAX_CONTENT_LENGTH") is None:
+        app.config["MAX_CONTENT_LENGTH"] = app.config["IMAGE_MAX_SIZE"] + 1024 * 1024
+
+    # Mongomock needs to be told to work with gridfs.
+    settings = app.config.get("MONGODB_SETTINGS")
+    if isinstance(settings, dict) and str(settings.get("host", "")).startswith("mongomock://"):
+        from mongomock.gridfs import enable_gridfs_integration  # pylint: disable=import-outside-toplevel
+        enable_gridfs_integration()
+
+    if Image is None:
+        logger.warning("Pillow is not installed, item image thumbnails are disabled.")
+
+    signals.post_delete.connect(_delete_item_images, sender=Item)
+    app.jinja_env.globals["item_image_url"] = item_image_url
+    app.register_blueprint(bp)
+
+
+def get_bucket() -> GridFSBucket:
+    return GridFSBucket(db.get_db(), bucket_name=BUCKET)
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """
+    Recognize the image type from the first bytes of the file.
+
+    :return: The content type, or `None` if it's not an accepted image.
+    """
+    for magic, content_type in IMAGE_TYPES.items():
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def store_image(upload: FileStorage, max_size: int, metadata: Optional[Dict] = None) -> ObjectId:
+    """
+    Stream an uploaded image into GridFS.
+
+    :param upload: Uploaded file.
+    :param max_size: Maximum size of the image, in bytes.
+    :param metadata: Extra metadata to store with the file.
+    :raises ImageError: If the file is not an accepted image, or is too large.
+    :return: The GridFS file id.
+    """
+    chunk = upload.stream.read(CHUNK_SIZE)
+    content_type = sniff_content_type(chunk)
+    if content_type is None:
+        raise ImageError(lazy_gettext("Image must be a JPEG, PNG, GIF or WebP file."))
+
+    grid_in = get_bucket().open_upload_stream(
+        upload.filename or "image", chunk_size_bytes=CHUNK_SIZE,
+        metadata={**(metadata or {}), "content_type": content_type})
+
+    size = 0
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise ImageError(lazy_gettext("Image can be at most %(size)s MB.", size=max_size // (1024 * 1024)))
+            grid_in.write(chunk)
+            chunk = upload.stream.read(CHUNK_SIZE)
+    except BaseException:
+        grid_in.abort()
+        raise
+
+    grid_in.close()
+    return grid_in._id  # pylint: disable=protected-access
+
+
+def delete_images(*file_ids: Optional[ObjectId]):
+    """
+    Delete images from GridFS. Missing ones are skipped.
+    """
+    bucket = get_bucket()
+    for file_id in filter(None, file_ids):
+        try:
+            bucket.delete(file_id)
+        except NoFile:
+            pass
+
+
+@contextmanager
+def replace_item_image(item: Item, upload: Optional[FileStorage], max_size: int):
+    """
+    Store the uploaded image for the item, while the item is saved.
+
+    The previous image, and its thumbnails, are deleted only once the block
+    succeeds. If it fails, the new image is deleted, and the item keeps the
+    previous one. Once saved, make the thumbnails with :func:`make_thumbnails`.
+
+    Usage:
+        >>> with replace_item_image(item, request.files.get('image'), max_size) as new_image:
+        ...     item.save()
+
+    :param upload: Uploaded file. Without one, or without a file name, the image is kept.
+    :raises ImageError: If the file is not an accepted image, or is too large.
+    :return: Context manager giving the new image id, or `None`.
+    """
+    if not upload or not upload.filename:
+        yield None
+        return
+
+    old_image, old_thumbnails = item.image, item.thumbnails
+    item.image = store_image(upload, max_size, {"item": item.id} if item.id else None)
+    item.thumbnails = {}
+
+    try:
+        yield item.image
+    except BaseException:
+        delete_images(item.image)
+        item.image, item.thumbnails = old_image, old_thumbnails
+        raise
+
+    delete_images(old_image, *(old_thumbnails or {}).values())
+
+
+def item_image_url(item: Item, size: Optional[str] = None) -> Optional[str]:
+    """
+    Return the URL of the item image, or of one of its thumbnails.
+
+    Falls back to the original image if the thumbnail is not there, except
+    for the small thumbnails of the listings, so that they stay light.
+
+    :param size: Thumbnail size name from :data:`THUMBNAIL_SIZES`, or `None` for the original.
+    :return: The URL, or `None` if there's no image.
+    """
+    if size and (thumbnail := (item.thumbnails or {}).get(size)):
+        return url_for("images.image", file_id=str(thumbnail))
+    if item.image and size != "small":
+        return url_for("images.image", file_id=str(item.image))
+    return None
+
+
+@task(retries=2, backoff=10)
+def make_thumbnails(item_id: str, file_id: str):
+    """
+    Task to make the thumbnails of an item image.
+    """
+    if Image is None:
+        return
+
+    bucket = get_bucket()
+    file_id = ObjectId(file_id)
+    try:
+        grid_out = bucket.open_download_stream(file_id)
+    except NoFile:
+        logger.debug("Image %s was replaced before the thumbnails were made", file_id)
+        return
+
+    with Image.open(grid_out) as image:
+        image = image.convert("RGB")
+        thumbnails = {}
+        for name, size in THUMBNAIL_SIZES.items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail(size)
+            data = BytesIO()
+            thumbnail.save(data, "JPEG", quality=85, optimize=True)
+            data.seek(0)
+            thumbnails[name] = bucket.upload_from_stream(
+                f"{name}-{grid_out.filename}", data,
+                metadata={"item": ObjectId(item_id), "content_type": "image/jpeg", "thumbnail_of": file_id})
+
+    # The image might have been replaced meanwhile.
+    if not Item.objects(id=item_id, image=file_id).update_one(set__thumbnails=thumbnails):
+        delete_images(*thumbnails.values())
+
+
+def _delete_item_images(sender, document, **kwargs):  # pylint: disable=unused-argument
+    delete_images(document.image, *(document.thumbnails or {}).values())
+
+
+def _parse_id(file_id: str) -> ObjectId:
+    try:
+        return ObjectId(file_id)
+    except (InvalidId, TypeError):
+        abort(404)
+
+
+@bp.route("/images/<file_id>")
+def image(file_id: str):
+    """
+    Serve an image, or a thumbnail, from GridFS.
+    """
+    try:
+        grid_out = get_bucket().open_download_stream(_parse_id(file_id))
+    except NoFile:
+        abort(404)
+
+    metadata = grid_out.metadata or {}
+    response = Response(wrap_file(request.environ, grid_out, CHUNK_SIZE),
+                        mimetype=metadata.get("content_type", "application/octet-stream"),
+                        direct_passthrough=True)
+    response.content_length = grid_out.length
+    response.last_modified = grid_out.upload_date
+    # Advertise ranges on full responses too, so that clients know to resume.
+    response.accept_ranges = "bytes"
+
+    # Files are never changed, so the id is a strong ETag.
+    response.set_etag(file_id)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.cache_control.immutable = True
+
+    return response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
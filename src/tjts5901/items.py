@@ -1,16 +1,23 @@
+from collections import Counter
 from datetime import datetime, timedelta
 import logging
-from typing import Optional
+from typing import Dict, Optional
 from flask import (
-    Blueprint, flash, redirect, render_template, request, url_for, jsonify, current_app
+    Blueprint, Response, flash, redirect, render_template, request, url_for, jsonify, current_app
 )
 from flask_babel import _, get_locale, lazy_gettext
-from werkzeug.exceptions import abort
+from werkzeug.exceptions import NotFound, abort
 
 from markupsafe import Markup
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import InsertOne, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
 
+from .archive import get_archived_item
 from .auth import login_required, current_user
-from .models import Bid, Item
+from .db import routed, write_concern
+from .models import Bid, Item, SellerStats
 from .currency import (
     convert_currency,
     format_converted_currency,
@@ -19,7 +26,14 @@ from .currency import (
     get_preferred_currency,
     REF_CURRENCY,
 )
-from .notification import send_notification
+from .notification import send_notification, send_notification_task
+from .export import FORMATS, export_rows, parse_fields
+from .images import ImageError, make_thumbnails, replace_item_image
+from .rankings import RANKING_TITLES, get_ranking
+from .search import SearchError, parse_search_args, search_items
+from .stats import increments, record_bids, record_item_closed, record_item_deleted, record_item_listed, seller_id
+from .ratelimit import rate_limited
+from .watchlist import is_watching, notify_new_bid, notify_watchers, unwatch_item, watch_item
 
 bp = Blueprint('items', __name__)
 api = Blueprint('api_items', __name__, url_prefix='/api/items')
@@ -28,6 +42,25 @@ logger = logging.getLogger(__name__)
 
 MIN_BID_INCREMENT = 1
 
+FRONT_PAGE_RANKING_SIZE = 5
+"Number of items ending soon shown on the front page."
+
+BID_BATCH_MAX_SIZE = 100
+"Default maximum number of bids in one batch request."
+
+SALE_LENGTH = timedelta(days=1)
+"How long items are on sale."
+
+FLASH_SALE_LENGTH = timedelta(seconds=20)
+"How long flash sales are, available in debug mode for trying out the closing."
+
+
+def shortest_sale_length(app) -> timedelta:
+    """
+    Return the shortest time an item listed in the application can be on sale.
+    """
+    return FLASH_SALE_LENGTH if app.config['DEBUG'] else SALE_LENGTH
+
 
 def get_item(id):
     try:
@@ -86,10 +119,104 @@ def get_item_price(item: Item) -> int:
     """
 
     winning_bid = get_winning_bid(item)
-    if winning_bid:
-        return winning_bid.amount + MIN_BID_INCREMENT
-    else:
-        return item.starting_bid
+    return minimum_bid(item.starting_bid, winning_bid.amount if winning_bid else None)
+
+
+def raise_item_price(item_id, amount: int, bidder_id) -> Optional[Dict]:
+    """
+    Make the bid the top bid of the item, unless a higher bid got there first.
+
+    Sets the denormalized price and the top bidder in one atomic update,
+    guarded by the price, and returns the item as it was before. Of
+    concurrent bids, each gets the top bidder it displaced, so every outbid
+    bidder is notified once.
+
+    :param item_id: Id of the item the bid was placed on.
+    :param amount: Amount of the bid.
+    :param bidder_id: Id of the bidder.
+    :return: The `price` and `top_bidder` of the item before the bid, or
+             `None` if the bid was outbid already.
+    """
+    # Converted amounts are decimals, which the field would cast to an int on save.
+    amount = int(amount)
+    items = Item._get_collection().with_options(  # pylint: disable=protected-access
+        write_concern=WriteConcern(**write_concern()))
+    return items.find_one_and_update(
+        {'_id': item_id, '$or': [
+            {'price': {'$lt': amount}},
+            # Without bids the price is the starting bid, which is a valid first bid.
+            {'price': {'$lte': amount}, 'top_bidder': None},
+            {'price': None},
+        ]},
+        {'$set': {'price': amount, 'top_bidder': bidder_id}},
+        projection={'_id': 0, 'price': 1, 'top_bidder': 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+def minimum_bid(starting_bid: int, winning_amount: Optional[int] = None) -> int:
+    """
+    Return the minimum amount for the next bid.
+
+    :param starting_bid: Starting bid of the item.
+    :param winning_amount: Amount of the current winning bid, if there is one.
+    :return: The minimum amount.
+    """
+    if winning_amount is not None:
+        return winning_amount + MIN_BID_INCREMENT
+    return starting_bid
+
+
+class BidError(ValueError):
+    """
+    Raised when a bid is not valid.
+
+    The message is a lazy string, translated when it's converted to a string.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+def parse_bid_amount(value) -> int:
+    """
+    Parse the bid amount from an API request argument.
+
+    Only accepts `REF_CURRENCY` amounts, as integers.
+
+    :param value: The argument value, or `None` if it's missing.
+    :raises BidError: If the value is missing or invalid.
+    :return: The amount.
+    """
+    if value is None:
+        raise BidError(lazy_gettext("Missing required argument %(argname)s", argname='amount'))
+
+    try:
+        return int(value)
+    except (TypeError, ValueError) as exc:
+        raise BidError(lazy_gettext("Invalid value for argument %(argname)s", argname='amount')) from exc
+
+
+def validate_bid(amount: int, min_amount: int, closes_at: datetime):
+    """
+    Check that the bid is valid for the item.
+
+    Shared by the form, API and async API bid paths.
+
+    :param amount: Bid amount.
+    :param min_amount: Minimum amount for the bid, see :func:`minimum_bid`.
+    :param closes_at: When the item closes.
+    :raises BidError: If the bid is not valid.
+    """
+    if amount < min_amount:
+        raise BidError(lazy_gettext("Bid must be at least %(min_amount)s", min_amount=min_amount))
+
+    if closes_at < datetime.utcnow():
+        raise BidError(lazy_gettext("This item is no longer on sale."))
 
 
 def handle_item_closing(item):
@@ -142,9 +269,17 @@ def handle_item_closing(item):
                                      title=Markup.escape(item.title)),
             )
 
-        # Close the item
+        # Close the item. The update is conditional, so that an item closed
+        # concurrently, eg. by the scheduler and a page view, is counted once.
         item.closed = True
-        item.save()
+        changes = {'set__winning_bid': winning_bid} if winning_bid else {}
+        if Item.objects(id=item.id, closed__ne=True).update_one(
+                set__closed=True, write_concern=write_concern(), **changes):
+            record_item_closed(item, winning_bid)
+            if item.watchers:
+                # The winner is notified of the win instead.
+                notify_watchers.delay(str(item.id), "closed",
+                                      exclude=str(winning_bid.bidder.id) if winning_bid else None)
 
 
 @bp.route("/", defaults={'page': 1})
@@ -161,12 +296,58 @@ def index(page=1):
 
     # Fetch items that are on sale currently, and paginate
     # See: http://docs.mongoengine.org/projects/flask-mongoengine/en/latest/custom_queryset.html
-    items = Item.objects.filter(closes_at__gt=datetime.utcnow()) \
+    items = routed(Item.objects.filter(closes_at__gt=datetime.utcnow())) \
         .order_by('-closes_at') \
         .paginate(page=page, per_page=10)
 
+    # Precomputed, see `tjts5901.rankings`.
+    ending_soon = get_ranking('ending-soon', limit=FRONT_PAGE_RANKING_SIZE) if page == 1 else []
+
     return render_template('items/index.html',
-                           items=items)
+                           items=items,
+                           ending_soon=ending_soon)
+
+
+@bp.route("/rankings/<name>")
+def ranking(name):
+    """
+    List the items of a ranking, eg. the ones ending soon.
+
+    :param name: Name of the ranking, see :data:`tjts5901.rankings.RANKINGS`.
+    """
+
+    if name not in RANKING_TITLES:
+        abort(404)
+
+    return render_template('items/ranking.html',
+                           name=name,
+                           rankings=RANKING_TITLES,
+                           items=get_ranking(name))
+
+
+@bp.route("/search")
+def search():
+    """
+    Search page for items.
+
+    Searches the item titles and descriptions, with filters for the status
+    and price range. See :mod:`tjts5901.search`.
+    """
+
+    items, next_cursor = [], None
+    query = None
+    try:
+        query = parse_search_args(request.args)
+        items, next_cursor = search_items(query)
+    except SearchError as exc:
+        flash(str(exc), category='error')
+
+    # Link to the next page with the same search.
+    next_url = None
+    if next_cursor:
+        next_url = url_for('items.search', **{**request.args.to_dict(), 'cursor': next_cursor})
+
+    return render_template('items/search.html', items=items, query=query, next_url=next_url)
 
 
 @bp.route('/sell', methods=('GET', 'POST'))
@@ -188,9 +369,9 @@ def sell():
 
         if error is None:
             try:
-                sale_length = timedelta(days=1)
+                sale_length = SALE_LENGTH
                 if current_app.config['DEBUG'] and request.form.get("flash-sale"):
-                    sale_length = timedelta(seconds=20)
+                    sale_length = FLASH_SALE_LENGTH
 
                 item = Item(
                     title=title,
@@ -199,9 +380,16 @@ def sell():
                     seller=current_user,
                     closes_at=datetime.utcnow() + sale_length,
                 )
-                item.save()
+                with replace_item_image(item, request.files.get('image'), current_app.config['IMAGE_MAX_SIZE']):
+                    item.save()
+                record_item_listed(item)
                 flash(_('Item listed successfully!'))
 
+                if item.image:
+                    make_thumbnails.delay(str(item.id), str(item.image))
+
+            except ImageError as exc:
+                error = str(exc)
             except Exception as exc:
                 error = _("Error creating item: %(exc)s", exc=exc)
                 logger.warning("Error creating item: %s", exc, exc_info=True, extra={
@@ -232,7 +420,12 @@ def view(id):
     Displays the item details, and a form to place a bid.
     """
 
-    item = Item.objects.get_or_404(id=id)
+    try:
+        item = Item.objects.get_or_404(id=id)
+    except NotFound:
+        # Closed auctions are moved into the archive after a while.
+        if (item := get_archived_item(id)) is None:
+            raise
 
     # !!! This is disabled as it might cause race conditions
     # !!! if multiple users are accessing the same item at the same time
@@ -258,7 +451,34 @@ def view(id):
     return render_template('items/view.html',
                            item=item, min_bid=min_bid,
                            local_min_bid=local_min_bid,
-                           local_currency=local_currency)
+                           local_currency=local_currency,
+                           watching=item.is_open and is_watching(item, current_user))
+
+
+@bp.route('/item/<id>/watch', methods=('POST',))
+@login_required
+def watch(id):
+    """
+    Add the item to the user's watchlist, to be notified of its bids and closing.
+    """
+    item = Item.objects.only('closes_at', 'closed').get_or_404(id=id)
+    if not item.is_open:
+        flash(_("This item is no longer on sale."))
+    elif watch_item(item, current_user):
+        flash(_("You are now watching this item."))
+    return redirect(url_for('items.view', id=id))
+
+
+@bp.route('/item/<id>/unwatch', methods=('POST',))
+@login_required
+def unwatch(id):
+    """
+    Remove the item from the user's watchlist.
+    """
+    item = Item.objects.only('id').get_or_404(id=id)
+    if unwatch_item(item, current_user):
+        flash(_("You are no longer watching this item."))
+    return redirect(url_for('items.view', id=id))
 
 
 @bp.route('/item/<id>/update', methods=('GET', 'POST'))
@@ -277,13 +497,19 @@ def update(id):
         try:
             item.title = title
             item.description = description
-            item.save()
+            with replace_item_image(item, request.files.get('image'),
+                                    current_app.config['IMAGE_MAX_SIZE']) as new_image:
+                item.save()
+        except ImageError as exc:
+            error = str(exc)
         except Exception as exc:
             error = _("Error updating item: %(exc)s", exc=exc)
             logger.warning("Error updating item: %s", exc, exc_info=True, extra={
                 'item_id': item.id,
             })
         else:
+            if new_image:
+                make_thumbnails.delay(str(item.id), str(item.image))
             flash(_("Item updated successfully!"))
             return redirect(url_for('items.index'))
 
@@ -305,11 +531,13 @@ def delete(id):
         })
         flash(_("Error deleting item: %(exc)s", exc=exc), category='error')
     else:
+        record_item_deleted(item)
         flash(_("Item deleted successfully!"))
     return redirect(url_for('items.index'))
 
 
 @bp.route('/item/<id>/bid', methods=('POST',))
+@rate_limited("bid")
 @login_required
 def bid(id):
     """
@@ -323,7 +551,8 @@ def bid(id):
     """
 
     item = Item.objects.get_or_404(id=id)
-    min_amount = get_item_price(item)
+    winning_bid = get_winning_bid(item)
+    min_amount = minimum_bid(item.starting_bid, winning_bid.amount if winning_bid else None)
 
     local_amount = request.form['amount']
     currency = request.form.get('currency', REF_CURRENCY)
@@ -346,15 +575,71 @@ def bid(id):
             bidder=current_user,
             amount=amount,
         )
-        bid.save()
+        bid.save(write_concern=write_concern())
     except Exception as exc:
         flash(_("Error placing bid: %(exc)s", exc=exc))
     else:
         flash(_("Bid placed successfully!"))
+        previous = raise_item_price(item.id, amount, current_user.id)
+        record_bids(item)
+        notify_outbid(previous, bid)
+        notify_new_bid(item, current_user.id)
 
     return redirect(url_for('items.view', id=id))
 
 
+@api.route('search', methods=('GET',))
+def api_search():
+    """
+    Search the items.
+
+    Accepts the search words as `q`, `status` as `open` or `closed`, the price
+    range as `min_price` and `max_price` in `REF_CURRENCY`, and the page size
+    as `limit`. Pass the `next_cursor` of the response as `cursor` to get the
+    next page.
+
+    :return: A JSON response with the items, and the cursor for the next
+             page, or `null` on the last page.
+    """
+
+    try:
+        items, next_cursor = search_items(parse_search_args(request.args))
+    except SearchError as exc:
+        return jsonify({
+            'success': False,
+            'error': str(exc)
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'items': items,
+        'next_cursor': next_cursor,
+    })
+
+
+@api.route('rankings/<name>', methods=('GET',))
+def api_ranking(name):
+    """
+    List the items of a ranking, eg. the ones ending soon.
+
+    :param name: Name of the ranking, see :data:`tjts5901.rankings.RANKINGS`.
+    :return: A JSON response with the items in order. Each has the `id`,
+             `title`, `price`, `closes_at` and `thumbnail` image id, and the
+             trending ones the number of recent `bids`.
+    """
+
+    if name not in RANKING_TITLES:
+        return jsonify({
+            'success': False,
+            'error': _("Invalid value for argument %(argname)s", argname='name')
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'items': get_ranking(name),
+    })
+
+
 @api.route('<id>/bids', methods=('GET',))
 @login_required
 def api_item_bids(id):
@@ -365,17 +650,57 @@ def api_item_bids(id):
     :return: A JSON response containing the bids.
     """
 
-    item = Item.objects.get_or_404(id=id)
-    bids = []
-    for bid in Bid.objects(item=item).order_by('-amount'):
-        bids.append(bid.to_json())
+    item = routed(Item.objects).get_or_404(id=id)
+    bids = routed(Bid.objects(item=item)).order_by('-amount')
 
+    # Documents are encoded by the JSON provider, see `json_provider.py`.
     return jsonify({
         'success': True,
         'bids': bids
     })
 
+@api.route('<id>/bids/export', methods=('GET',))
+@login_required
+def api_item_bids_export(id):
+    """
+    Export the bids for an item.
+
+    Streams the bids from the database one batch at a time, so large exports
+    don't need to fit in memory.
+
+    Query arguments:
+    - `format`: `ndjson` (default) or `csv`.
+    - `fields`: Comma separated fields to export. Defaults to `amount,created_at,bidder`.
+
+    :param id: The id of the item to export bids for.
+    :return: A streamed NDJSON or CSV response.
+    """
+
+    item = routed(Item.objects).get_or_404(id=id)
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({
+            'success': False,
+            'error': _("Invalid value for argument %(argname)s", argname='format')
+        }), 400
+
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': _("Invalid value for argument %(argname)s", argname='fields')
+        }), 400
+
+    response = Response(export_rows({'item': item.id}, fmt, fields), mimetype=FORMATS[fmt])
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = f'attachment; filename="bids-{item.id}.csv"'
+    return response
+
+
 @api.route('<id>/bids', methods=('POST',))
+@rate_limited("bid")
 @login_required
 def api_item_place_bid(id):
     """
@@ -391,36 +716,16 @@ def api_item_place_bid(id):
     """
 
     item = Item.objects.get_or_404(id=id)
-    min_amount = get_item_price(item)
+    winning_bid = get_winning_bid(item)
+    min_amount = minimum_bid(item.starting_bid, winning_bid.amount if winning_bid else None)
 
     try:
-        amount = int(request.form['amount'])
-    except KeyError:
+        amount = parse_bid_amount(request.form.get('amount'))
+        validate_bid(amount, min_amount, item.closes_at)
+    except BidError as exc:
         return jsonify({
             'success': False,
-            'error': _("Missing required argument %(argname)s", argname='amount')
-        })
-    except ValueError:
-        return jsonify({
-            'success': False,
-            'error': _("Invalid value for argument %(argname)s", argname='amount')
-        })
-    except Exception as exc:
-        return jsonify({
-            'success': False,
-            'error': _("Error parsing argument %(argname)s: %(exc)s", argname='amount', exc=exc)
-        })
-
-    if amount < min_amount:
-        return jsonify({
-            'success': False,
-            'error': _("Bid must be at least %(min_amount)s", min_amount=min_amount)
-        })
-
-    if item.closes_at < datetime.utcnow():
-        return jsonify({
-            'success': False,
-            'error': _("This item is no longer on sale.")
+            'error': str(exc)
         })
 
     try:
@@ -429,7 +734,7 @@ def api_item_place_bid(id):
             bidder=current_user,
             amount=amount,
         )
-        bid.save()
+        bid.save(write_concern=write_concern())
     except Exception as exc:
         logger.error("Error placing bid: %s", exc, exc_info=True, extra={
             'item_id': item.id,
@@ -442,7 +747,201 @@ def api_item_place_bid(id):
             'error': _("Error placing bid: %(exc)s", exc=exc)
         })
 
+    previous = raise_item_price(item.id, amount, current_user.id)
+    record_bids(item)
+    notify_outbid(previous, bid)
+    notify_new_bid(item, current_user.id)
+
     return jsonify({
         'success': True,
-        'bid': bid.to_mongo().to_dict()
+        'bid': bid
     })
+
+
+def get_top_bids(items) -> dict:
+    """
+    Return the highest bids of open items, with one aggregation.
+
+    Bids of an open item are all placed before it closes, so the highest bid
+    is the winning one.
+
+    :param items: Open items to get the bids for.
+    :return: Mapping from item id to the highest bid, as a dict with `amount`
+             and `bidder` id. Items without bids are left out.
+    """
+
+    if not items:
+        return {}
+
+    pipeline = [
+        {'$match': {'item': {'$in': [item.id for item in items]}}},
+        {'$sort': {'amount': -1}},
+        {'$group': {'_id': '$item', 'amount': {'$first': '$amount'}, 'bidder': {'$first': '$bidder'}}},
+    ]
+    return {row['_id']: row for row in Bid.objects.aggregate(pipeline)}
+
+
+@api.route('bids:batch', methods=('POST',))
+@rate_limited("bid")
+@login_required
+def api_place_bids_batch():
+    """
+    Place many bids at once.
+
+    Accepts a JSON body with a list of bids, as in::
+
+        {"bids": [{"item": "<item id>", "amount": 10}, ...]}
+
+    Items and their current prices are fetched once for the whole batch, and
+    the accepted bids are inserted with one bulk write. Bids are validated in
+    order, so a later bid on the same item has to outbid the earlier one.
+
+    Only accepts `REF_CURRENCY` bids.
+
+    :return: A JSON response with a result for each bid, in the same order.
+    """
+
+    data = request.get_json(silent=True)
+    entries = data.get('bids') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return jsonify({
+            'success': False,
+            'error': _("Missing required argument %(argname)s", argname='bids')
+        }), 400
+
+    max_size = current_app.config.get('BID_BATCH_MAX_SIZE', BID_BATCH_MAX_SIZE)
+    if len(entries) > max_size:
+        return jsonify({
+            'success': False,
+            'error': _("Invalid value for argument %(argname)s", argname='bids')
+        }), 413
+
+    item_ids = []
+    for entry in entries:
+        try:
+            item_ids.append(ObjectId(entry['item']))
+        except (InvalidId, KeyError, TypeError):
+            item_ids.append(None)
+
+    items = {item.id: item for item in Item.objects(id__in=list(set(filter(None, item_ids))))}
+    open_items = [item for item in items.values() if item.closes_at > datetime.utcnow()]
+    top_bids = get_top_bids(open_items)
+    prices = {
+        item.id: minimum_bid(item.starting_bid, top_bids[item.id]['amount'] if item.id in top_bids else None)
+        for item in open_items
+    }
+
+    results = []
+    bids = []
+    for entry, item_id in zip(entries, item_ids):
+        item = items.get(item_id)
+        try:
+            if item is None:
+                raise BidError(lazy_gettext("Invalid value for argument %(argname)s", argname='item'))
+
+            amount = parse_bid_amount(entry.get('amount'))
+            validate_bid(amount, prices.get(item.id, amount), item.closes_at)
+        except BidError as exc:
+            results.append({'success': False, 'error': str(exc)})
+            continue
+
+        # Following bids on the same item need to outbid this one.
+        prices[item.id] = minimum_bid(item.starting_bid, amount)
+
+        bid = Bid(item=item, bidder=current_user, amount=amount)
+        bid.validate()
+        bids.append((len(results), bid.to_mongo()))
+        results.append({'success': True})
+
+    if bids:
+        try:
+            Bid._get_collection().with_options(  # pylint: disable=protected-access
+                write_concern=WriteConcern(**write_concern())
+            ).bulk_write(
+                [InsertOne(document) for _index, document in bids], ordered=False)
+        except BulkWriteError as exc:
+            logger.error("Error placing bids: %s", exc, extra={
+                'bidder_id': current_user.id,
+                'errors': exc.details.get('writeErrors'),
+            })
+            for error in exc.details.get('writeErrors', []):
+                index, _bid = bids[error['index']]
+                results[index] = {
+                    'success': False,
+                    'error': _("Error placing bid: %(exc)s", exc=error.get('errmsg')),
+                }
+
+    placed = [document for index, document in bids if results[index]['success']]
+    if placed:
+        sellers = Counter(seller_id(items[document['item']]) for document in placed)
+        SellerStats._get_collection().bulk_write([  # pylint: disable=protected-access
+            UpdateOne(*increments(seller, bids_received=count), upsert=True) for seller, count in sellers.items()
+        ], ordered=False)
+
+    # Only the bids that were saved, the highest one of each item.
+    new_top_bids = {}
+    for document in placed:
+        if document['item'] not in new_top_bids or document['amount'] > new_top_bids[document['item']]['amount']:
+            new_top_bids[document['item']] = document
+
+    # One update per item, as the displaced top bidder is read from each.
+    for item_id, document in new_top_bids.items():
+        previous = raise_item_price(item_id, document['amount'], current_user.id)
+        notify_outbid(previous, Bid(item=items[item_id], amount=document['amount']))
+        notify_new_bid(items[item_id], current_user.id)
+
+    for index, document in bids:
+        if results[index]['success']:
+            results[index]['bid'] = {
+                'id': str(document['_id']),
+                'item': str(document['item']),
+                'amount': document['amount'],
+                'created_at': document['created_at'],
+            }
+
+    return jsonify({
+        'success': True,
+        'results': results,
+    })
+
+
+def notify_outbid(previous: Optional[Dict], bid: Bid):
+    """
+    Notify the bidder displaced by the bid that they were outbid.
+
+    The notification is sent by a background task, so that the bid request
+    doesn't wait for it.
+
+    :param previous: The item before the bid, as returned by
+                     :func:`raise_item_price`. If `None`, a concurrent higher
+                     bid got in first, and the bidder of `bid` is notified.
+    :param bid: The new bid, by the current user.
+    """
+
+    if previous is None:
+        price = Item.objects(id=bid.item.id).scalar('price').first()
+        send_outbid_notification(current_user.id, bid.item.title, price)
+        return
+
+    bidder_id = previous.get('top_bidder')
+    if bidder_id is None or bidder_id == current_user.id:
+        return
+
+    send_outbid_notification(bidder_id, bid.item.title, bid.amount)
+
+
+def send_outbid_notification(bidder_id, title: str, amount: int):
+    """
+    Send the notification that the bidder was outbid, in the background.
+
+    :param bidder_id: Id of the bidder who was outbid.
+    :param title: Title of the item.
+    :param amount: The new highest bid.
+    """
+    send_notification_task.delay(
+        str(bidder_id),
+        title=lazy_gettext("You were outbid"),
+        message=lazy_gettext("Your bid on <em>%(title)s</em> was outbid. The highest bid is now %(price)s.",
+                             title=Markup.escape(title),
+                             price=Markup.escape(amount)),
+    )
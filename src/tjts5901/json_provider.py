@@ -0,0 +1,234 @@
+"""
+JSON provider
+=============
+
+Fast JSON serialization for the API responses. Uses `orjson`_ when it's
+installed, and the standard library :mod:`json` otherwise. Both encode the
+same types in the same way:
+
+- :class:`~bson.ObjectId` and :class:`~bson.DBRef` as the id string.
+- :class:`~datetime.datetime` as ISO 8601. Naive datetimes are taken as UTC.
+- :class:`~decimal.Decimal` as a string, to not lose precision.
+- Lazy translation strings as the translated text.
+- Mongoengine documents and querysets as objects with the field names as
+  keys. References are encoded as the referenced id, without fetching the
+  referenced document.
+
+Document encoders are built once per model class, from the model fields.
+
+Install orjson with the speedups extras:
+    $ pip install -e .[speedups]
+
+See `benchmarks/json_provider.py` for a comparison with the flask-mongoengine
+encoder.
+
+.. _orjson: https://github.com/ijl/orjson
+"""
+
+import dataclasses
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from bson import DBRef, ObjectId
+from flask import Flask
+from flask.json.provider import JSONProvider
+from flask_babel.speaklater import LazyString
+from mongoengine.base import BaseDocument
+from mongoengine.fields import (
+    GenericReferenceField,
+    LazyReferenceField,
+    ListField,
+    ReferenceField,
+)
+from mongoengine.queryset import QuerySet
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_document_encoders: Dict[type, Callable[[BaseDocument], Dict[str, Any]]] = {}
+
+
+def _reference_id(value) -> Optional[str]:
+    """
+    Get the id of a reference field value, without dereferencing it.
+    """
+    if value is None:
+        return None
+    if isinstance(value, BaseDocument):
+        return str(value.pk)
+    if isinstance(value, DBRef):
+        return str(value.id)
+    if isinstance(value, dict) and "_ref" in value:
+        # Unresolved generic reference.
+        return str(value["_ref"].id)
+    return str(value)
+
+
+def _field_encoder(field) -> Optional[Callable]:
+    if isinstance(field, (ReferenceField, LazyReferenceField, GenericReferenceField)):
+        return _reference_id
+
+    if isinstance(field, ListField) and field.field is not None:
+        if (item_encoder := _field_encoder(field.field)) is not None:
+            return lambda values: None if values is None else [item_encoder(value) for value in values]
+
+    return None
+
+
+def document_encoder(cls) -> Callable[[BaseDocument], Dict[str, Any]]:
+    """
+    Get the encoder for the document class.
+
+    The encoder reads the raw field values, so referenced documents are not
+    fetched from the database.
+
+    :param cls: Document or embedded document class.
+    :return: Function converting a document into a dictionary.
+    """
+    if (encoder := _document_encoders.get(cls)) is not None:
+        return encoder
+
+    fields: Tuple[Tuple[str, Optional[Callable]], ...] = tuple(
+        (name, _field_encoder(cls._fields[name])) for name in cls._fields_ordered  # pylint: disable=protected-access
+    )
+
+    def encoder(document: BaseDocument) -> Dict[str, Any]:
+        data = document._data  # pylint: disable=protected-access
+        encoded = {}
+        for name, field_encoder in fields:
+            value = data.get(name)
+            encoded[name] = field_encoder(value) if field_encoder is not None else value
+        return encoded
+
+    return _document_encoders.setdefault(cls, encoder)
+
+
+def default(o: Any) -> Any:  # pylint: disable=too-many-return-statements
+    """
+    Convert objects that are not natively JSON serializable.
+    """
+    if isinstance(o, BaseDocument):
+        return document_encoder(type(o))(o)
+    if isinstance(o, QuerySet):
+        return [document_encoder(type(document))(document) for document in o]
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, DBRef):
+        return str(o.id)
+    if isinstance(o, datetime):
+        if o.tzinfo is None:
+            o = o.replace(tzinfo=timezone.utc)
+        return o.isoformat()
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (Decimal, UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return {field.name: getattr(o, field.name) for field in dataclasses.fields(o)}
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    if isinstance(o, LazyString):
+        return str(o)
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(JSONProvider):
+    """
+    JSON provider using orjson when it's available.
+
+    Falls back to the standard library for arguments orjson doesn't support,
+    like `cls`, or indents other than two spaces.
+    """
+
+    sort_keys = False
+    "Sort keys in the output. Disabled, as it's slower."
+
+    compact: Optional[bool] = None
+    "Same as in :class:`flask.json.provider.DefaultJSONProvider`."
+
+    mimetype = "application/json"
+
+    def __init__(self, app: Flask, use_orjson: bool = True):
+        super().__init__(app)
+        self.use_orjson = use_orjson and orjson is not None
+
+    def _orjson_options(self, kwargs) -> Optional[int]:
+        """
+        Get orjson options matching the `json.dumps` arguments, or `None` if
+        they can't be matched.
+        """
+        if not self.use_orjson:
+            return None
+
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        for key, value in kwargs.items():
+            if key == "indent":
+                if value == 2:
+                    option |= orjson.OPT_INDENT_2
+                elif value:
+                    return None
+            elif key == "sort_keys":
+                if value:
+                    option |= orjson.OPT_SORT_KEYS
+            elif key not in ("separators", "ensure_ascii"):
+                # orjson output is always compact and UTF-8, but can't take
+                # eg. a custom `cls` or `default`.
+                return None
+        return option
+
+    def dumps_bytes(self, obj: Any, **kwargs: Any) -> bytes:
+        """
+        Serialize data as UTF-8 encoded JSON.
+        """
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        option = self._orjson_options(kwargs)
+        if option is not None:
+            return orjson.dumps(obj, default=default, option=option)
+
+        kwargs.setdefault("default", default)
+        kwargs.setdefault("ensure_ascii", False)
+        return json.dumps(obj, **kwargs).encode("utf-8")
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.dumps_bytes(obj, **kwargs).decode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            body = self.dumps_bytes(obj, indent=2)
+        else:
+            body = self.dumps_bytes(obj, separators=(",", ":"))
+
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def init_json(app: Flask):
+    """
+    Use :class:`FastJSONProvider` for the application, and for the `tojson` template filter.
+
+    Set `JSON_USE_ORJSON` to `False` to use the standard library even when
+    orjson is installed.
+    """
+    app.config.setdefault("JSON_USE_ORJSON", True)
+
+    app.json = FastJSONProvider(app, use_orjson=app.config["JSON_USE_ORJSON"])
+    # The Jinja environment may already be created, eg. by Flask-Babel, with
+    # the `tojson` filter bound to the previous provider.
+    app.jinja_env.policies["json.dumps_function"] = app.json.dumps
+
+    logger.debug("Initialized JSON provider.", extra={"orjson": app.json.use_orjson})
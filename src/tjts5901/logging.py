@@ -18,17 +18,277 @@ To use logging in your application, import the logger instance, and use it as fo
 """
 
 
+import atexit
+import copy
+from datetime import datetime, timezone
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
 from os import environ
+import queue
+import random
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
 
-import sentry_sdk
 from flask import Flask
 from flask.logging import default_handler as flask_handler
-from sentry_sdk.integrations.flask import FlaskIntegration
-from sentry_sdk.integrations.pymongo import PyMongoIntegration
 
+from .metrics import registry
 from .utils import get_version
 
+LOG_RECORDS_DROPPED = registry.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full.", ["level"])
+
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+"Standard log record attributes. Anything else is passed in with `extra`."
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records instead of blocking, if the queue is full.
+
+    Records are only merged with their arguments on the calling thread. The
+    formatting is left for the :class:`~QueueListener` thread.
+
+    The listener thread, writing the records to the `targets`, is started on
+    the first record of each process. With gunicorn `preload_app` the handler
+    is created in the master process, and threads don't survive the fork into
+    the workers. Without targets, the records are left in the queue.
+    """
+
+    def __init__(self, log_queue: queue.Queue, *targets: logging.Handler):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.targets = targets
+        self.listener: Optional[QueueListener] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the listener thread, if it's not running in this process.
+        """
+        pid = os.getpid()
+        if self._pid == pid or not self.targets:
+            return
+
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked. The records in the inherited queue are written by the
+                # parent, and its listener thread may have held the queue lock.
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self.listener.start()
+            self._pid = pid
+
+    def stop(self):
+        """
+        Write the remaining records, and stop the listener thread of this process.
+        """
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue is in-process, so the record doesn't need to be pickleable,
+        # and exception info can be formatted by the listener. Arguments are
+        # merged here, as they might change after the call returns.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.labels(record.levelname).inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as single line JSON objects.
+
+    Values passed with `extra` are included as fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "lineno": record.lineno,
+        }
+
+        for key, value in vars(record).items():
+            if key not in _LOG_RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+
+        return json.dumps(data, default=str)
+
+
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def _init_log_queue(app: Flask) -> QueueHandler:
+    """
+    Create the log queue handler.
+
+    The handler is process wide, and created only once. Its listener thread is
+    started on the first record, see :class:`DroppingQueueHandler`.
+    """
+    global _queue_handler  # pylint: disable=global-statement
+
+    if _queue_handler is not None:
+        return _queue_handler
+
+    if app.config["LOG_FORMAT"] == "json":
+        target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(JsonFormatter())
+    else:
+        target = flask_handler
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=app.config["LOG_QUEUE_SIZE"]), target)
+
+    # Flush the remaining records on exit.
+    atexit.register(_queue_handler.stop)
+
+    return _queue_handler
+
+
+DEFAULT_TRACES_SAMPLE_RULES = {
+    # Static files are served by the thousands, and are not interesting.
+    "/static/": 0.001,
+    # Health checks and metrics are polled constantly by kubernetes and monitoring.
+    "/server-info": 0.001,
+    "/livez": 0.001,
+    "/readyz": 0.001,
+    "/metrics": 0.001,
+    # Notifications are polled by every open browser tab.
+    "/notifications.json": 0.01,
+}
+"Default per path prefix trace sample rates. Longest matching prefix wins."
+
+ERROR_STATUSES = {
+    "internal_error",
+    "unknown_error",
+    "unknown",
+    "unavailable",
+    "deadline_exceeded",
+    "data_loss",
+    "unimplemented",
+}
+"Transaction statuses that are always kept."
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """
+    Parse an event timestamp, as serialized by Sentry, eg. `2026-10-19T01:52:35.175407Z`.
+
+    :return: The timestamp, or `None` if it's missing or not valid.
+    """
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        # Python before 3.11 doesn't parse the `Z` suffix.
+        return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+
+
+class TracesSampler:
+    """
+    Adaptive trace sampling for Sentry.
+
+    Sampling is done in two stages:
+
+    1. When a request starts, :meth:`__call__` decides whether to record the
+       transaction at all, using the rate of the longest matching path prefix
+       in `SENTRY_TRACES_SAMPLE_RULES`, or `SENTRY_TRACES_SAMPLE_RATE` for other
+       paths.
+    2. When the transaction finishes, :meth:`before_send_transaction` always
+       keeps errors and transactions slower than `SENTRY_TRACES_SLOW_THRESHOLD`
+       seconds, and keeps `SENTRY_TRACES_KEEP_RATE` of the rest. Dropped
+       transactions are not sent. They have been serialized already, so the
+       timestamps are read from their ISO 8601 strings.
+
+    Rules are read from the app config on each call, so changing the config
+    takes effect without restarting.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self._rules_source: Optional[Dict[str, float]] = None
+        self._rules: List[Tuple[str, float]] = []
+
+    def rules(self) -> List[Tuple[str, float]]:
+        """
+        Get the sample rules, sorted longest prefix first.
+        """
+        source = self.app.config.get("SENTRY_TRACES_SAMPLE_RULES") or {}
+        if source != self._rules_source:
+            self._rules = sorted(((prefix, float(rate)) for prefix, rate in source.items()),
+                                 key=lambda rule: len(rule[0]), reverse=True)
+            self._rules_source = dict(source)
+        return self._rules
+
+    def sample_rate(self, path: str) -> float:
+        """
+        Get the sample rate for the request path.
+        """
+        for prefix, rate in self.rules():
+            if path.startswith(prefix):
+                return rate
+        return float(self.app.config.get("SENTRY_TRACES_SAMPLE_RATE", 1.0))
+
+    def __call__(self, sampling_context: Dict) -> float:
+        # Follow the decision of the upstream service, if there is one.
+        if (parent_sampled := sampling_context.get("parent_sampled")) is not None:
+            return float(parent_sampled)
+
+        environ = sampling_context.get("wsgi_environ") or {}
+        path = environ.get("PATH_INFO")
+        if path is None:
+            # Not a request, eg. scheduled task.
+            return float(self.app.config.get("SENTRY_TRACES_SAMPLE_RATE", 1.0))
+
+        return self.sample_rate(path)
+
+    def before_send_transaction(self, event: Dict, hint: Dict) -> Optional[Dict]:  # pylint: disable=unused-argument
+        """
+        Keep error and slow transactions, and sample the rest.
+        """
+        status = event.get("contexts", {}).get("trace", {}).get("status")
+        if status in ERROR_STATUSES:
+            return event
+
+        start, end = _parse_timestamp(event.get("start_timestamp")), _parse_timestamp(event.get("timestamp"))
+        if start is not None and end is not None:
+            if (end - start).total_seconds() >= float(self.app.config.get("SENTRY_TRACES_SLOW_THRESHOLD", 1.0)):
+                return event
+
+        if random.random() < float(self.app.config.get("SENTRY_TRACES_KEEP_RATE", 1.0)):
+            return event
+
+        return None
+
+
 def init_logging(app: Flask):
     """
     Integrate our own logging interface into application.
@@ -52,11 +312,28 @@ def init_logging(app: Flask):
     if app.config.get("DEBUG"):
         logger.setLevel(level=logging.DEBUG)
 
-    # Add flask default logging handler as one of our target handlers.
-    # When changes to flask logging handler is made, our logging handler
-    # adapts automatically. Logging pipeline:
-    # our appcode -> our logger -> flask handler -> ????
-    logger.addHandler(flask_handler)
+    # Log records are written from a background thread, so that the log I/O
+    # doesn't block the requests. When the queue is full, records are dropped.
+    # Testing logs synchronously, so that the output is in order.
+    app.config.setdefault("LOG_QUEUE_ENABLED", not app.testing)
+    app.config.setdefault("LOG_QUEUE_SIZE", int(environ.get("LOG_QUEUE_SIZE", 10000)))
+    app.config.setdefault("LOG_FORMAT", environ.get("LOG_FORMAT", "text"))
+
+    if app.config["LOG_QUEUE_ENABLED"]:
+        # Logging pipeline:
+        # our appcode -> our logger -> queue -> listener thread -> flask handler
+        logger.addHandler(_init_log_queue(app))
+        logger.removeHandler(flask_handler)
+    else:
+        # Add flask default logging handler as one of our target handlers.
+        # When changes to flask logging handler is made, our logging handler
+        # adapts automatically. Logging pipeline:
+        # our appcode -> our logger -> flask handler -> ????
+        if app.config["LOG_FORMAT"] == "json":
+            flask_handler.setFormatter(JsonFormatter())
+        logger.addHandler(flask_handler)
+        if _queue_handler is not None:
+            logger.removeHandler(_queue_handler)
 
     logger.debug("TJTS5901 Logger initialised.")
 
@@ -73,12 +350,29 @@ def init_logging(app: Flask):
     app.config.setdefault('SENTRY_ENVIRONMENT', enviroment)
     app.config.setdefault('CI_COMMIT_SHA', environ.get('CI_COMMIT_SHA'))
 
+    # Trace sampling rules. See :class:`TracesSampler` for details.
+    app.config.setdefault('SENTRY_TRACES_SAMPLE_RATE', float(environ.get('SENTRY_TRACES_SAMPLE_RATE', 1.0)))
+    app.config.setdefault('SENTRY_TRACES_KEEP_RATE', float(environ.get('SENTRY_TRACES_KEEP_RATE', 0.1)))
+    app.config.setdefault('SENTRY_TRACES_SLOW_THRESHOLD', float(environ.get('SENTRY_TRACES_SLOW_THRESHOLD', 1.0)))
+    if rules := environ.get('SENTRY_TRACES_SAMPLE_RULES'):
+        app.config.setdefault('SENTRY_TRACES_SAMPLE_RULES', json.loads(rules))
+    app.config.setdefault('SENTRY_TRACES_SAMPLE_RULES', DEFAULT_TRACES_SAMPLE_RULES)
+
     # Setup sentry logging
     sentry_dsn = app.config.get("SENTRY_DSN")
     release = app.config.get("CI_COMMIT_SHA", get_version() or "dev")
     enviroment = app.config.get("SENTRY_ENVIRONMENT", "production")
 
     if sentry_dsn:
+        # Sentry is imported only when it's used, as it's slow to import.
+        # pylint: disable=import-outside-toplevel
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+        from sentry_sdk.integrations.pymongo import PyMongoIntegration
+
+        sampler = TracesSampler(app)
+        app.extensions['sentry_traces_sampler'] = sampler
+
         sentry = sentry_sdk.init(
             dsn=sentry_dsn,
             integrations=[
@@ -93,10 +387,10 @@ def init_logging(app: Flask):
                 #LoggingIntegration(level=logging.INFO, event_level=logging.ERROR),
             ],
 
-            # Set traces_sample_rate to 1.0 to capture 100%
-            # of transactions for performance monitoring.
-            # We recommend adjusting this value in production.
-            traces_sample_rate=1.0,
+            # Sample transactions by the request path, and keep errors and
+            # slow transactions. See :class:`TracesSampler`.
+            traces_sampler=sampler,
+            before_send_transaction=sampler.before_send_transaction,
 
             # Set sentry debug mode to true if flask is running in debug mode.
             #debug=bool(app.debug),
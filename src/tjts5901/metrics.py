@@ -0,0 +1,508 @@
+"""
+Performance metrics module.
+
+Collects request latency, MongoDB command and connection pool, template
+rendering and scheduled job metrics, and exposes them in Prometheus text
+format at `/metrics`.
+
+Metrics are kept in process memory, so each gunicorn worker reports its own
+numbers. Prometheus is expected to scrape each pod, and sum the results.
+
+Updating a metric doesn't take a lock. Histograms are pre-bucketed, so an
+observation is one bisect and two additions. Under the GIL a concurrent update
+might be lost on rare occasions, which is acceptable for monitoring purposes.
+
+To record your own metrics:
+    >>> from tjts5901.metrics import registry
+    >>> bids_placed = registry.counter("bids_placed_total", "Bids placed.", ["source"])
+    >>> bids_placed.labels(source="api").inc()
+
+"""
+
+from bisect import bisect_left
+import logging
+import threading
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    before_render_template,
+    g,
+    has_app_context,
+    request,
+    template_rendered,
+)
+from pymongo import common, monitoring
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('metrics', __name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+"Default histogram buckets, in seconds."
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+"Buckets for the per-request MongoDB command counts."
+
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"Buckets for the connection pool checkout waits, in seconds. Most checkouts don't wait at all."
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"Prometheus text exposition format."
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    Base class for metric families.
+
+    A family has a name and label names. Each combination of label values has
+    its own child, which holds the actual values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """
+        Get the child metric for the label values.
+        """
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+
+        child = self._children.get(values)
+        if child is None:
+            # dict.setdefault() is atomic, so racing threads get the same child.
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self) -> Iterable[Tuple[str, List[Tuple[str, str]], float]]:
+        """
+        Yield (name suffix, labels, value) tuples of the metric.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """
+        Render the metric family in Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing counter.
+    """
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1):
+        """
+        Increment counter without labels.
+        """
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", list(zip(self.labelnames, values)), child.value
+
+
+class _GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+    """
+
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float):
+        """
+        Set gauge without labels.
+        """
+        self.labels().set(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", list(zip(self.labelnames, values)), child.value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Last slot is for the +Inf bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """
+    Histogram with pre-defined buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        """
+        Observe value without labels.
+        """
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = list(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), list(child.counts)):
+                cumulative += count
+                yield "_bucket", labels + [("le", _format_value(bound))], cumulative
+            yield "_count", labels, cumulative
+            yield "_sum", labels, child.sum
+
+
+class MetricsRegistry:
+    """
+    Collection of metric families.
+
+    Asking for an already registered metric returns the existing one, so
+    modules can declare their metrics on import.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        if (metric := self._metrics.get(name)) is None:
+            metric = self._metrics.setdefault(name, metric_class(name, *args, **kwargs))
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Render all the metrics in Prometheus text format.
+        """
+        return "\n".join(metric.render() for metric in list(self._metrics.values())) + "\n"
+
+
+# Metrics are process wide, as are the pymongo listeners.
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Request latency by endpoint.", ["endpoint", "method", "status"])
+REQUEST_DB_COMMANDS = registry.histogram(
+    "http_request_mongodb_commands", "MongoDB commands run per request.", ["endpoint"],
+    buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = registry.histogram(
+    "http_request_mongodb_duration_seconds", "Time spent in MongoDB commands per request.", ["endpoint"])
+REQUEST_DB_POOL_WAIT = registry.histogram(
+    "http_request_mongodb_pool_wait_seconds", "Time waited for MongoDB connections per request.", ["endpoint"],
+    buckets=POOL_WAIT_BUCKETS)
+MONGODB_COMMANDS = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency.", ["command", "status"])
+MONGODB_POOL_CHECKOUT_WAIT = registry.histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time waited for a connection from the MongoDB pool.",
+    ["address", "status"], buckets=POOL_WAIT_BUCKETS)
+MONGODB_POOL_CONNECTIONS = registry.gauge(
+    "mongodb_pool_connections", "MongoDB pool connections, open or checked out.", ["address", "state"])
+MONGODB_POOL_MAX_SIZE = registry.gauge(
+    "mongodb_pool_max_size", "Maximum size of the MongoDB pool, 0 for unlimited.", ["address"])
+MONGODB_POOL_UTILIZATION = registry.gauge(
+    "mongodb_pool_utilization", "Share of the maximum MongoDB pool size checked out.", ["address"])
+TEMPLATE_RENDER = registry.histogram(
+    "template_render_duration_seconds", "Template rendering time.", ["template"])
+SCHEDULER_JOBS = registry.histogram(
+    "scheduler_job_duration_seconds", "Scheduled job duration.", ["job", "status"],
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0, 300.0))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Pymongo command listener to record the command durations.
+
+    Inside a request, the command count and time are also added into the
+    request totals.
+    """
+
+    def started(self, event):
+        pass
+
+    def _record(self, event, status: str):
+        duration = event.duration_micros / 1e6
+        MONGODB_COMMANDS.labels(event.command_name, status).observe(duration)
+
+        # Pymongo runs the listener in the thread running the command.
+        if has_app_context() and "metrics_db_commands" in g:
+            g.metrics_db_commands += 1
+            g.metrics_db_time += duration
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Pymongo connection pool listener to record the pool usage and checkout waits.
+
+    The checkout events are published in the thread checking out the
+    connection, so the wait is timed from a thread local start time. Inside a
+    request, the wait is also added into the request totals. A long wait means
+    that all the connections were in use, see `MONGO_MAX_POOL_SIZE`.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._max_sizes: Dict[str, int] = {}
+        self._checked_out: Dict[str, int] = {}
+
+    def pool_created(self, event):
+        address = _address(event)
+        # Only the options differing from the defaults are included.
+        max_size = event.options.get("maxPoolSize", common.MAX_POOL_SIZE) or 0
+        self._max_sizes[address] = max_size
+        MONGODB_POOL_MAX_SIZE.labels(address).set(max_size)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGODB_POOL_CONNECTIONS.labels(_address(event), "open").inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGODB_POOL_CONNECTIONS.labels(_address(event), "open").dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started = perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._record_wait(event, str(event.reason))
+
+    def connection_checked_out(self, event):
+        self._record_wait(event, "ok")
+        self._update_checked_out(_address(event), 1)
+
+    def connection_checked_in(self, event):
+        self._update_checked_out(_address(event), -1)
+
+    def _record_wait(self, event, status: str):
+        if (started := getattr(self._local, "started", None)) is None:
+            return
+        self._local.started = None
+
+        wait = perf_counter() - started
+        MONGODB_POOL_CHECKOUT_WAIT.labels(_address(event), status).observe(wait)
+        if has_app_context() and "metrics_db_pool_wait" in g:
+            g.metrics_db_pool_wait += wait
+
+    def _update_checked_out(self, address: str, change: int):
+        # Checkouts and checkins come from many threads, so count them under a lock.
+        with self._lock:
+            checked_out = self._checked_out[address] = self._checked_out.get(address, 0) + change
+            MONGODB_POOL_CONNECTIONS.labels(address, "checked_out").set(checked_out)
+            if max_size := self._max_sizes.get(address):
+                MONGODB_POOL_UTILIZATION.labels(address).set(checked_out / max_size)
+
+
+_listener: Optional[CommandMetricsListener] = None
+_pool_listener: Optional[PoolMetricsListener] = None
+
+
+def init_metrics(app: Flask):
+    """
+    Initialize the metrics collection.
+
+    This needs to be called before the database connection is made, as pymongo
+    only picks up listeners registered before a client is created.
+    """
+    global _listener, _pool_listener  # pylint: disable=global-statement
+
+    app.config.setdefault("METRICS_ENABLED", True)
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    if _listener is None:
+        _listener = CommandMetricsListener()
+        monitoring.register(_listener)
+
+    if _pool_listener is None:
+        _pool_listener = PoolMetricsListener()
+        monitoring.register(_pool_listener)
+
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
+
+    before_render_template.connect(_start_template_timer, app)
+    template_rendered.connect(_record_template, app)
+
+    app.register_blueprint(bp)
+    logger.debug("Initialized metrics.")
+
+
+def _start_request_timer():
+    g.metrics_started = perf_counter()
+    g.metrics_db_commands = 0
+    g.metrics_db_time = 0.0
+    g.metrics_db_pool_wait = 0.0
+
+
+def _record_request(response: Response) -> Response:
+    if (started := g.pop("metrics_started", None)) is None:
+        return response
+
+    endpoint = request.endpoint or "<unmatched>"
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(perf_counter() - started)
+    REQUEST_DB_COMMANDS.labels(endpoint).observe(g.pop("metrics_db_commands", 0))
+    REQUEST_DB_TIME.labels(endpoint).observe(g.pop("metrics_db_time", 0.0))
+    REQUEST_DB_POOL_WAIT.labels(endpoint).observe(g.pop("metrics_db_pool_wait", 0.0))
+    return response
+
+
+def _start_template_timer(sender, template, context, **extra):  # pylint: disable=unused-argument
+    # Templates can be nested with render_template() calls, eg. the currency filter.
+    g.setdefault("metrics_templates", []).append(perf_counter())
+
+
+def _record_template(sender, template, context, **extra):  # pylint: disable=unused-argument
+    if timers := g.get("metrics_templates"):
+        TEMPLATE_RENDER.labels(template.name or "<string>").observe(perf_counter() - timers.pop())
+
+
+_job_started: Dict[str, float] = {}
+
+
+def scheduler_job_listener(event):
+    """
+    APScheduler listener to record the job durations.
+
+    Register for the submitted, executed and error events.
+    """
+    from apscheduler.events import EVENT_JOB_SUBMITTED  # pylint: disable=import-outside-toplevel
+
+    if event.code == EVENT_JOB_SUBMITTED:
+        _job_started[event.job_id] = perf_counter()
+        return
+
+    if (started := _job_started.pop(event.job_id, None)) is None:
+        return
+
+    # Item closing jobs are one per item, so group them under one label.
+    job = event.job_id
+    if job.startswith("close-item-"):
+        job = "close-item"
+
+    status = "error" if getattr(event, "exception", None) else "ok"
+    SCHEDULER_JOBS.labels(job, status).observe(perf_counter() - started)
+
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Metrics in Prometheus text format.
+    """
+    return Response(registry.render(), content_type=CONTENT_TYPE)
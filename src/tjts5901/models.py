@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from secrets import token_urlsafe
+from typing import Optional
 from urllib.parse import urlencode
 from flask import url_for
 from markupsafe import Markup
@@ -14,6 +15,9 @@ from mongoengine import (
     EmailField,
     BooleanField,
     EnumField,
+    DictField,
+    ListField,
+    ObjectIdField,
 )
 
 from mongoengine.queryset import CASCADE
@@ -23,6 +27,9 @@ from bson import ObjectId
 
 from .i18n import SupportedLocales
 
+READ_NOTIFICATION_TTL = timedelta(days=30)
+"How long read notifications are kept, before MongoDB removes them."
+
 
 class User(UserMixin, db.Document):
     """
@@ -90,11 +97,23 @@ class Item(db.Document):
     A model for items that are listed on the auction site.
     """
 
-    # Create index for sorting items by closing date
+    # Create index for sorting items by closing date, and a text index for
+    # searching. Matches in the title weigh more than in the description.
+    # The price index is for the highest price ranking.
     meta = {"indexes": [
         {"fields": [
             "closes_at",
-        ]}
+        ]},
+        {"fields": [
+            "-price",
+        ]},
+        {"fields": [
+            "$title",
+            "$description",
+        ],
+            "default_language": "english",
+            "weights": {"title": 10, "description": 2},
+        },
     ]}
 
     title = StringField(max_length=100, required=True)
@@ -102,14 +121,44 @@ class Item(db.Document):
 
     starting_bid = IntField(required=True, min_value=0)
 
+    price = IntField(min_value=0)
+    """
+    Current price: the highest bid, or the starting bid if there are no bids.
+
+    Denormalized from the bids for searching by price, and kept up to date
+    with :func:`tjts5901.items.raise_item_price` when bids are placed.
+    """
+
+    top_bidder = ReferenceField(User)
+    "Bidder of the highest bid, updated together with the `price`."
+
+    image = ObjectIdField()
+    "GridFS id of the item image, see :mod:`tjts5901.images`."
+
+    thumbnails = DictField()
+    "GridFS ids of the image thumbnails, by size name."
+
     seller = ReferenceField(User, required=True)
     winning_bid = ReferenceField("Bid")
     closed = BooleanField(default=False)
     "Whether the item has been closed."
 
+    watchers = IntField(default=0)
+    "Number of users watching the item, see :mod:`tjts5901.watchlist`."
+
+    watchers_notified_at = DateTimeField()
+    "When the watchers were last notified of a new bid."
+
+    closing_soon_notified = BooleanField(default=False)
+    "Whether the watchers have been notified that the item closes soon."
+
     created_at = DateTimeField(required=True, default=datetime.utcnow)
     closes_at = DateTimeField()
 
+    def clean(self):
+        if self.price is None:
+            self.price = self.starting_bid
+
     @property
     def is_open(self) -> bool:
         """
@@ -125,12 +174,21 @@ class Bid(db.Document):
     A model for bids on items.
     """
 
+    # The item index is used to join the bids of items, eg. when rebuilding
+    # the seller statistics, and the created_at index to find the recent
+    # bids for the trending ranking.
     meta = {"indexes": [
         {"fields": [
             "amount",
             "item",
             "created_at",
-        ]}
+        ]},
+        {"fields": [
+            "item",
+        ]},
+        {"fields": [
+            "created_at",
+        ]},
     ]}
 
     amount = IntField(required=True, min_value=0)
@@ -146,6 +204,83 @@ class Bid(db.Document):
     "Date and time that the bid was placed."
 
 
+class Watch(db.Document):
+    """
+    A user watching an item, to be notified of its bids and closing.
+
+    See :mod:`tjts5901.watchlist`.
+    """
+
+    # The notifications are sent to the watchers of an item in batches,
+    # paging through the item and user index.
+    meta = {"indexes": [
+        {"fields": [
+            "item",
+            "user",
+        ],
+            "unique": True,
+        },
+        {"fields": [
+            "user",
+        ]},
+    ]}
+
+    item = ReferenceField(Item, required=True, reverse_delete_rule=CASCADE)
+    user = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+
+    created_at = DateTimeField(required=True, default=datetime.utcnow)
+
+
+class SellerStats(db.Document):
+    """
+    Statistics of a seller's auctions, for the dashboard on their profile page.
+
+    Updated incrementally when items are listed, bid on, closed and deleted,
+    and rebuilt from the items and bids with `flask rebuild-seller-stats`. See
+    :mod:`tjts5901.stats`.
+    """
+
+    seller = ReferenceField(User, primary_key=True)
+
+    items_listed = IntField(default=0)
+    items_open = IntField(default=0)
+    "Listed items that have not been closed yet."
+
+    items_sold = IntField(default=0)
+    "Closed items with a winning bid."
+
+    revenue = IntField(default=0)
+    "Sum of the final prices of the sold items."
+
+    bids_received = IntField(default=0)
+
+    updated_at = DateTimeField()
+
+    @property
+    def average_price(self) -> Optional[float]:
+        """
+        Average final price of the sold items, or `None` if nothing has been sold.
+        """
+        if not self.items_sold:
+            return None
+        return self.revenue / self.items_sold
+
+
+class Ranking(db.Document):
+    """
+    A precomputed list of items, eg. the ones ending soon.
+
+    See :mod:`tjts5901.rankings`.
+    """
+
+    name = StringField(primary_key=True)
+
+    items = ListField(DictField())
+    "The ranked items, with the fields needed to list them."
+
+    refreshed_at = DateTimeField()
+
+
 class AccessToken(db.Document):
     """
     Access token for a user.
@@ -186,12 +321,19 @@ class Notification(db.Document):
     the system.
     """
 
+    # Read notifications are removed by a TTL index. Unread ones don't have
+    # `read_at`, so they are kept until read.
     meta = {"indexes": [
         {"fields": [
             "user",
             "read_at",
             "created_at",
-        ]}
+        ]},
+        {"fields": [
+            "read_at",
+        ],
+            "expireAfterSeconds": int(READ_NOTIFICATION_TTL.total_seconds()),
+        },
     ]}
 
     id: ObjectId
@@ -204,3 +346,42 @@ class Notification(db.Document):
 
     created_at = DateTimeField(required=True, default=datetime.utcnow)
     read_at = DateTimeField(required=False)
+
+
+class QueuedTask(db.Document):
+    """
+    A background task waiting in the durable task queue.
+
+    See :mod:`tjts5901.tasks`.
+    """
+
+    meta = {"indexes": [
+        {"fields": [
+            "status",
+            "run_at",
+        ]}
+    ]}
+
+    id: ObjectId
+
+    name = StringField(required=True)
+    "Import path of the task function, eg. `tjts5901.scheduler.close_item`."
+
+    args = ListField()
+    kwargs = DictField()
+
+    status = StringField(required=True, default="queued", choices=("queued", "running", "failed"))
+    "Succeeded tasks are removed from the queue."
+
+    attempts = IntField(default=0)
+    "How many times the task has been started."
+
+    run_at = DateTimeField(required=True, default=datetime.utcnow)
+    "Don't run the task before this time. Used for retry backoff."
+
+    locked_until = DateTimeField()
+    "A running task is given to another worker after this, if it's still running."
+
+    last_error = StringField()
+
+    created_at = DateTimeField(required=True, default=datetime.utcnow)
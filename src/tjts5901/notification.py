@@ -2,15 +2,18 @@
 This module provides a way to send notifications to users.
 """
 
+from collections import defaultdict
 import dataclasses
 from datetime import datetime
 import logging
+from typing import Iterable
 
 from flask import get_flashed_messages, jsonify, Blueprint
 from flask_login import current_user, login_required
 from flask_babel import force_locale, lazy_gettext
 
 from .models import Notification, User
+from .tasks import task
 
 bp = Blueprint('notification', __name__, url_prefix='/')
 
@@ -58,6 +61,63 @@ def send_notification(user, message, category="message", title=None):
         notification.save()
 
 
+def send_notifications(user_ids: Iterable, message, category="message", title=None) -> int:
+    """
+    Send the same notification to many users, with one bulk insert.
+
+    Lazy strings are translated once per locale, instead of once per user, and
+    only the locales of the users are read.
+
+    :param user_ids: Ids of the users to send the message to.
+    :param message: The message to send.
+    :param title: The title of the message.
+    :return: Number of notifications sent.
+    """
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+
+    users = User._get_collection().find({"_id": {"$in": user_ids}}, {"locale": 1})  # pylint: disable=protected-access
+    by_locale = defaultdict(list)
+    for user in users:
+        by_locale[user.get("locale")].append(user["_id"])
+
+    created_at = datetime.utcnow()
+    documents = []
+    for locale, recipients in by_locale.items():
+        with force_locale(locale or User.locale.default):
+            text, subject = str(message), str(title) if title is not None else None
+        documents.extend({
+            "user": user_id,
+            "category": category,
+            "message": text,
+            "title": subject,
+            "created_at": created_at,
+        } for user_id in recipients)
+
+    if documents:
+        Notification._get_collection().insert_many(documents, ordered=False)  # pylint: disable=protected-access
+    return len(documents)
+
+
+@task(retries=3)
+def send_notification_task(user_id: str, message, category="message", title=None):
+    """
+    Task to send a notification to the user with the given id.
+
+    Lazy strings are translated in the task, into the recipient's locale.
+    See :func:`send_notification`.
+    """
+
+    user = User.objects(id=user_id).first()
+    if user is None:
+        logger.warning("Not sending notification, user %s not found", user_id)
+        return
+
+    send_notification(user, message, category=category, title=title)
+
+
 def get_notifications(user: User = current_user) -> list[Message]:
     """
     Get the messages for the given user.
@@ -0,0 +1,170 @@
+"""
+Item rankings.
+
+Lists of open items for the front page and the ranking pages:
+
+- `ending-soon`: closing first.
+- `trending`: most bids in the last `TRENDING_WINDOW_MINUTES`.
+- `highest-price`: highest current price.
+
+Building them on request would sort the open items, or aggregate over the
+recent bids, for every page view. Instead the scheduler refreshes them every
+`RANKING_REFRESH_SECONDS`, and stores each as one :class:`Ranking` document
+with the top `RANKING_SIZE` items embedded. A page reads a ranking with one
+fetch, and renders it without touching the items.
+
+The rankings are rebuilt in full on every refresh, rather than updated on
+each bid, listing and closing. This is a deliberate simplification: an
+incremental update would have to expire bids out of the trending window, and
+would race with the refresh. The full rebuild is bounded instead. Per refresh
+interval, `ending-soon` and `highest-price` each read at most `RANKING_SIZE`
+items through an index, and `trending` aggregates the bids of the last
+`TRENDING_WINDOW_MINUTES` and reads at most `2 * RANKING_SIZE` items by id.
+The cost grows with the recent bids, but not with the number of items
+listed. Between refreshes a ranking can be up to `RANKING_REFRESH_SECONDS`
+out of date. Items that have closed since are left out when read.
+
+The rankings can also be refreshed by hand:
+    $ flask refresh-rankings
+"""
+
+from datetime import datetime, timedelta
+import logging
+from os import environ
+from typing import Callable, Dict, List, Optional
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from flask_babel import lazy_gettext
+
+from .db import routed
+from .models import Bid, Item, Ranking
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FIELDS = ("title", "starting_bid", "price", "closes_at", "thumbnails")
+"Item fields read for the ranking entries."
+
+RANKING_TITLES = {
+    "ending-soon": lazy_gettext("Ending soon"),
+    "trending": lazy_gettext("Trending"),
+    "highest-price": lazy_gettext("Highest price"),
+}
+"Titles of the rankings, by name."
+
+
+def init_rankings(app: Flask):
+    """
+    Initialize the item rankings.
+    """
+    app.config.setdefault("RANKING_SIZE", int(environ.get("RANKING_SIZE", 20)))
+    app.config.setdefault("RANKING_REFRESH_SECONDS", int(environ.get("RANKING_REFRESH_SECONDS", 60)))
+    app.config.setdefault("TRENDING_WINDOW_MINUTES", int(environ.get("TRENDING_WINDOW_MINUTES", 60)))
+    app.cli.add_command(refresh_rankings_command)
+
+
+def _open_items(now: datetime) -> Dict:
+    return {"closed": {"$ne": True}, "closes_at": {"$gt": now}}
+
+
+def _entry(item: Dict, **extra) -> Dict:
+    """
+    Return the ranking entry of an item document.
+    """
+    return {
+        "id": item["_id"],
+        "title": item["title"],
+        "price": item.get("price") or item["starting_bid"],
+        "closes_at": item["closes_at"],
+        "thumbnail": (item.get("thumbnails") or {}).get("small"),
+        **extra,
+    }
+
+
+def _top_items(now: datetime, size: int, sort: List) -> List[Dict]:
+    items = Item._get_collection()  # pylint: disable=protected-access
+    projection = dict.fromkeys(ENTRY_FIELDS, 1)
+    return [_entry(item) for item in items.find(_open_items(now), projection).sort(sort).limit(size)]
+
+
+def ending_soon(now: datetime, size: int) -> List[Dict]:
+    return _top_items(now, size, [("closes_at", 1)])
+
+
+def highest_price(now: datetime, size: int) -> List[Dict]:
+    return _top_items(now, size, [("price", -1), ("closes_at", 1)])
+
+
+def trending(now: datetime, size: int) -> List[Dict]:
+    """
+    Return the open items with the most bids in the trending window.
+    """
+    since = now - timedelta(minutes=current_app.config["TRENDING_WINDOW_MINUTES"])
+    # Some of the items may have closed, so take a few extra.
+    counts = list(Bid.objects(created_at__gte=since).aggregate([
+        {"$group": {"_id": "$item", "bids": {"$sum": 1}, "last_bid_at": {"$max": "$created_at"}}},
+        {"$sort": {"bids": -1, "last_bid_at": -1}},
+        {"$limit": size * 2},
+    ], allowDiskUse=True))
+
+    items = Item._get_collection()  # pylint: disable=protected-access
+    query = {**_open_items(now), "_id": {"$in": [row["_id"] for row in counts]}}
+    found = {item["_id"]: item for item in items.find(query, dict.fromkeys(ENTRY_FIELDS, 1))}
+    return [_entry(found[row["_id"]], bids=row["bids"]) for row in counts if row["_id"] in found][:size]
+
+
+RANKINGS: Dict[str, Callable[[datetime, int], List[Dict]]] = {
+    "ending-soon": ending_soon,
+    "trending": trending,
+    "highest-price": highest_price,
+}
+"Functions building the rankings, by name."
+
+
+def refresh_rankings(names: Optional[List[str]] = None):
+    """
+    Rebuild rankings, and store them.
+
+    :param names: Rankings to refresh. Defaults to all of them.
+    """
+    now = datetime.utcnow()
+    size = current_app.config["RANKING_SIZE"]
+    collection = Ranking._get_collection()  # pylint: disable=protected-access
+
+    for name in names or RANKINGS:
+        entries = RANKINGS[name](now, size)
+        collection.replace_one({"_id": name}, {"items": entries, "refreshed_at": now}, upsert=True)
+        logger.debug("Refreshed ranking %s with %d items", name, len(entries))
+
+
+def get_ranking(name: str, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Get the items of a ranking, as stored by the last refresh.
+
+    Items that have closed since are left out.
+
+    :param name: Name of the ranking, from :data:`RANKINGS`.
+    :param limit: Return at most this many items.
+    :return: Entries with the item `id`, `title`, `price`, `closes_at`, and
+             the id of the small `thumbnail`. Trending ones have the number
+             of `bids` too.
+    """
+    ranking = routed(Ranking.objects(name=name)).as_pymongo().first()
+    if ranking is None:
+        return []
+
+    now = datetime.utcnow()
+    entries = [entry for entry in ranking["items"] if entry["closes_at"] > now]
+    return entries[:limit]
+
+
+@click.command("refresh-rankings")
+@with_appcontext
+@click.argument("names", nargs=-1, type=click.Choice(list(RANKINGS)))
+def refresh_rankings_command(names):
+    """
+    Refresh the item rankings.
+    """
+    refresh_rankings(list(names))
+    click.echo(f"Refreshed {', '.join(names or RANKINGS)}.")
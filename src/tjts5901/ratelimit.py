@@ -0,0 +1,337 @@
+"""
+Rate limiting and admission control.
+
+Protects the bid endpoints from clients sending requests faster than the
+workers and the database can handle, which is most likely to happen right
+when auctions are closing.
+
+Two checks are done before the view runs, and before any database work:
+
+1. Admission control: a process wide limit for concurrent requests to the
+   limited endpoints. When all slots are taken, the request is answered with
+   `503 Service Unavailable`.
+2. Rate limit: a token bucket per client, answering with
+   `429 Too Many Requests` when the client's bucket is empty.
+
+Both responses carry a `Retry-After` header.
+
+Clients are identified by the logged in user, the API token, or the IP
+address, in that order. If the app runs behind a proxy, wrap it in
+:class:`werkzeug.middleware.proxy_fix.ProxyFix` so that the client IP is
+correct.
+
+The buckets are kept either in process memory (`RATELIMIT_BACKEND=memory`),
+so each worker has its own, or in MongoDB (`RATELIMIT_BACKEND=mongo`), shared
+by all the workers and pods.
+
+Usage:
+    >>> @api.route('<id>/bids', methods=('POST',))
+    >>> @rate_limited("bid")
+    >>> @login_required
+    >>> def api_item_place_bid(id):
+    ...     ...
+
+Limits are configured per name, eg. for the `bid` limit with `RATELIMIT_BID`
+(eg. `"60/minute"`) and `RATELIMIT_BID_BURST`.
+"""
+
+from datetime import datetime
+from functools import wraps
+import hashlib
+import logging
+from math import ceil
+from os import environ
+import threading
+from time import monotonic, time
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, Response, current_app, jsonify, request, session
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_HITS = registry.counter(
+    "ratelimit_requests_total", "Requests checked by the rate limiter, by result.", ["limit", "result"])
+
+PERIODS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+
+
+def parse_rate(value: str) -> float:
+    """
+    Parse rate like `60/minute` into requests per second.
+
+    :raises ValueError: If the rate is not valid.
+    """
+    count, _, period = value.partition("/")
+    period = period.strip().rstrip("s")
+    if period not in PERIODS:
+        raise ValueError(f"Unknown rate period in {value!r}, use one of: {', '.join(PERIODS)}")
+    return float(count) / PERIODS[period]
+
+
+class MemoryBackend:
+    """
+    Token buckets in process memory.
+
+    Buckets are stored as the time when the bucket will be full again (the
+    "theoretical arrival time" of GCRA), which is equivalent to a token bucket
+    but needs only one number per client.
+    """
+
+    blocking = False
+    "Whether :meth:`consume` does I/O. The async API runs blocking backends in a thread."
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Take a token from the bucket.
+
+        :param key: Client key.
+        :param rate: Tokens added per second.
+        :param burst: Bucket size.
+        :return: Whether the request is allowed, and seconds until it would be.
+        """
+        if now is None:
+            now = monotonic()
+        interval = 1 / rate
+
+        with self._lock:
+            # Compared as a difference, so that an empty bucket doesn't get
+            # limited by the rounding of `now + interval - interval`.
+            full_at = max(self._buckets.get(key, now), now)
+            wait = full_at - now - (burst - 1) * interval
+            if wait > 0:
+                return False, wait
+
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            self._buckets[key] = full_at + interval
+
+        return True, 0.0
+
+    def _prune(self, now: float):
+        # Full buckets are the same as missing ones.
+        for key in [key for key, full_at in self._buckets.items() if full_at <= now]:
+            del self._buckets[key]
+
+
+class MongoBackend:
+    """
+    Token buckets in a MongoDB collection, shared by all the processes.
+
+    Uses the same algorithm as :class:`MemoryBackend`, with optimistic updates.
+    Full buckets are removed by a TTL index. If the database is not available,
+    requests are allowed.
+    """
+
+    max_attempts = 5
+    blocking = True
+
+    def __init__(self, collection_name: str = "rate_limit"):
+        self.collection_name = collection_name
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from .db import db  # pylint: disable=import-outside-toplevel
+            collection = db.get_db()[self.collection_name]
+            collection.create_index("expires_at", expireAfterSeconds=0)
+            self._collection = collection
+        return self._collection
+
+    def consume(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Take a token from the bucket. See :meth:`MemoryBackend.consume`.
+        """
+        interval = 1 / rate
+
+        try:
+            for _attempt in range(self.max_attempts):
+                current = time() if now is None else now
+                document = self.collection.find_one({"_id": key})
+                previous = document["full_at"] if document else None
+
+                full_at = max(previous or current, current)
+                wait = full_at - current - (burst - 1) * interval
+                if wait > 0:
+                    return False, wait
+
+                full_at += interval
+                update = {"full_at": full_at, "expires_at": datetime.utcfromtimestamp(full_at)}
+                if document is None:
+                    try:
+                        self.collection.insert_one({"_id": key, **update})
+                        return True, 0.0
+                    except DuplicateKeyError:
+                        continue
+
+                result = self.collection.update_one({"_id": key, "full_at": previous}, {"$set": update})
+                if result.modified_count:
+                    return True, 0.0
+
+            logger.warning("Rate limit bucket is contended, allowing request", extra={"key": key})
+        except PyMongoError as exc:
+            logger.warning("Rate limit backend failed, allowing request: %s", exc)
+
+        return True, 0.0
+
+
+class RateLimiter:
+    """
+    Rate limiter and admission control for the application.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+
+        backend = app.config["RATELIMIT_BACKEND"]
+        if backend == "mongo":
+            self.backend = MongoBackend()
+        elif backend == "memory":
+            self.backend = MemoryBackend()
+        else:
+            raise ValueError(f"Unknown RATELIMIT_BACKEND: {backend!r}")
+
+        max_concurrent = app.config["RATELIMIT_MAX_CONCURRENT"]
+        self.admission = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def get_limit(self, name: str) -> Tuple[float, int]:
+        """
+        Get the rate, in requests per second, and burst size of the limit.
+        """
+        config = self.app.config
+        rate = config.get(f"RATELIMIT_{name.upper()}", "60/minute")
+        burst = config.get(f"RATELIMIT_{name.upper()}_BURST", 10)
+        return parse_rate(rate), int(burst)
+
+    @staticmethod
+    def token_key(authorization: str) -> str:
+        """
+        Identify an API client by its `Authorization` header.
+        """
+        return "token:" + hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:32]
+
+    @classmethod
+    def client_key(cls) -> str:
+        """
+        Identify the client without touching the database.
+        """
+        if user_id := session.get("_user_id"):
+            return f"user:{user_id}"
+
+        if api_key := request.headers.get("Authorization"):
+            return cls.token_key(api_key)
+
+        return f"ip:{request.remote_addr}"
+
+    def check(self, name: str, key: Optional[str] = None) -> Optional[TooManyRequests]:
+        """
+        Check the rate limit for the current request.
+
+        :param key: Client key. Defaults to the client of the current request,
+                    see :meth:`client_key`.
+        :return: Exception to respond with if the request is limited.
+        """
+        rate, burst = self.get_limit(name)
+        if key is None:
+            key = self.client_key()
+        allowed, retry_after = self.backend.consume(f"{name}:{key}", rate, burst)
+        if allowed:
+            RATELIMIT_HITS.labels(name, "allowed").inc()
+            return None
+
+        RATELIMIT_HITS.labels(name, "limited").inc()
+        logger.info("Rate limited %s", name, extra={"limit": name, "retry_after": retry_after})
+        return TooManyRequests(retry_after=max(1, ceil(retry_after)))
+
+    def admit(self, wait: bool = True) -> bool:
+        """
+        Take an admission slot.
+
+        :param wait: Wait up to `RATELIMIT_ADMISSION_TIMEOUT` for a free slot.
+                     The async API doesn't, so that it doesn't block the event loop.
+        """
+        if self.admission is None:
+            return True
+        if not wait:
+            return self.admission.acquire(blocking=False)
+        return self.admission.acquire(timeout=self.app.config["RATELIMIT_ADMISSION_TIMEOUT"])
+
+    def release(self):
+        if self.admission is not None:
+            self.admission.release()
+
+
+def init_ratelimit(app: Flask) -> RateLimiter:
+    """
+    Initialize the rate limiter.
+    """
+    app.config.setdefault("RATELIMIT_ENABLED", environ.get("RATELIMIT_ENABLED", "true").lower() == "true")
+    app.config.setdefault("RATELIMIT_BACKEND", environ.get("RATELIMIT_BACKEND", "memory"))
+    app.config.setdefault("RATELIMIT_MAX_CONCURRENT", int(environ.get("RATELIMIT_MAX_CONCURRENT", 16)))
+    app.config.setdefault("RATELIMIT_ADMISSION_TIMEOUT", float(environ.get("RATELIMIT_ADMISSION_TIMEOUT", 0.05)))
+    app.config.setdefault("RATELIMIT_RETRY_AFTER", 1)
+
+    # Limit for placing bids.
+    app.config.setdefault("RATELIMIT_BID", environ.get("RATELIMIT_BID", "60/minute"))
+    app.config.setdefault("RATELIMIT_BID_BURST", int(environ.get("RATELIMIT_BID_BURST", 10)))
+
+    limiter = RateLimiter(app)
+    app.extensions['ratelimit'] = limiter
+    return limiter
+
+
+def _error_response(exc) -> Response:
+    """
+    Respond with JSON for API requests, and with the error page otherwise.
+    """
+    if request.blueprint and request.blueprint.startswith("api"):
+        response = jsonify({'success': False, 'error': exc.description})
+        response.status_code = exc.code
+        response.headers["Retry-After"] = str(exc.retry_after)
+        return response
+    raise exc
+
+
+def rate_limited(name: str):
+    """
+    Decorator to apply the rate limit `name`, and the admission control, to a view.
+
+    Put it above `login_required`, so that limited requests don't load the user.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            limiter: RateLimiter = current_app.extensions['ratelimit']
+            if not current_app.config["RATELIMIT_ENABLED"]:
+                return view(*args, **kwargs)
+
+            if not limiter.admit():
+                RATELIMIT_HITS.labels(name, "rejected").inc()
+                logger.warning("Too many concurrent requests for %s", name, extra={"limit": name})
+                return _error_response(ServiceUnavailable(retry_after=current_app.config["RATELIMIT_RETRY_AFTER"]))
+
+            try:
+                if (exc := limiter.check(name)) is not None:
+                    return _error_response(exc)
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+
+        return wrapped
+
+    return decorator
@@ -6,14 +6,20 @@ This extension is used to schedule background tasks.
 
 from datetime import datetime, timedelta
 import logging
+import os
 from random import randint
+import threading
+from time import monotonic
 
+from flask import current_app
 from flask_apscheduler import APScheduler
-from apscheduler.schedulers import SchedulerAlreadyRunningError
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 from mongoengine import signals, Q
 
 from .models import Item
-from .items import handle_item_closing
+from .items import handle_item_closing, shortest_sale_length
+from .metrics import scheduler_job_listener
+from .tasks import task
 
 logger = logging.getLogger(__name__)
 
@@ -21,14 +27,45 @@ logger = logging.getLogger(__name__)
 # way to make it accessible.
 scheduler = APScheduler()
 
+# Threaded workers might handle the first requests concurrently.
+_start_lock = threading.Lock()
+
+LOCK_RETRY_INTERVAL = 30
+"Seconds to wait before trying to acquire the scheduler lock file again."
+
+CLOSE_ITEMS_INTERVAL = timedelta(minutes=15)
+"""
+How often expired items are closed, and the closing of the next ones is scheduled.
+
+Shortened to the shortest sale length, see :func:`close_items_interval`.
+"""
+
+_lock_file = None
+_lock_retry_at = 0.0
+
 
 def init_scheduler(app):
     """
     Initialize the APScheduler extension.
 
     This function is meant to be called from the create_app() function.
+
+    When to start the scheduler is controlled with `SCHEDULER_AUTOSTART`:
+
+    - ``"lazy"`` (default) starts it on the first request. This way it runs in
+      the process serving requests, and not in a gunicorn master process with
+      ``preload_app``, where the scheduler thread would be lost on fork.
+    - ``"eager"`` starts it right away.
+    - ``False`` doesn't start it. Use :func:`start_scheduler` to start it.
+
+    If `SCHEDULER_LOCK_FILE` is set, only the process holding a lock on the
+    file runs the scheduler. Gunicorn config sets it, so that only one worker
+    per pod runs the scheduled jobs.
     """
 
+    app.config.setdefault('SCHEDULER_AUTOSTART', "lazy")
+    app.config.setdefault('SCHEDULER_LOCK_FILE', os.environ.get('SCHEDULER_LOCK_FILE'))
+
     try:
 
         scheduler.init_app(app)
@@ -42,30 +79,129 @@ def init_scheduler(app):
             # ends.
             signals.post_save.connect(_schedule_item_closing_task, sender=Item)
 
-            # Add a batch task to close expired bids every 15 minutes. This is to ensure
-            # that the bids are closed even if the server is restarted.
-            scheduler.add_job(trigger='interval', minutes=15,
+            # Add a batch task to close expired items every 15 minutes, and to
+            # schedule the closing of the items closing before the next run. This
+            # is to ensure that the items are closed even if the server is
+            # restarted, or the item was saved in a process not running the
+            # scheduler. Run it right away when the scheduler starts.
+            scheduler.add_job(trigger='interval', seconds=close_items_interval(app).total_seconds(),
                             func=_close_items,
-                            id='close-items')
+                            id='close-items',
+                            next_run_time=datetime.now(),
+                            replace_existing=True)
+
+            # Refresh the item rankings of the front page.
+            scheduler.add_job(trigger='interval', seconds=app.config['RANKING_REFRESH_SECONDS'],
+                            func=_refresh_rankings,
+                            id='refresh-rankings',
+                            replace_existing=True)
+
+            # Notify the watchers of the items closing soon.
+            scheduler.add_job(trigger='interval', minutes=1,
+                            func=_notify_closing_soon,
+                            id='notify-closing-soon',
+                            replace_existing=True)
+
+            # Archive old closed auctions every night.
+            scheduler.add_job(trigger='cron', hour=3, minute=randint(0, 59),
+                            func=_archive_items,
+                            id='archive-items',
+                            replace_existing=True)
 
             # Add a task to update the currency rates from the European Central Bank every
             # day at random time between 5:00 and 5:59.
             scheduler.add_job(trigger='cron', hour=5, minute=randint(0, 59),
                             func=_update_currency_rates,
-                            id='update-currency-rates')
-
-            with app.app_context():
-                scheduler.start()
-                logger.debug('APScheduler started')
+                            id='update-currency-rates',
+                            replace_existing=True)
 
-    except SchedulerAlreadyRunningError:
-        logger.debug('APScheduler already running')
+            autostart = app.config['SCHEDULER_AUTOSTART']
+            if autostart == "eager":
+                start_scheduler(app)
+            elif autostart == "lazy":
+                app.before_request(_start_scheduler_on_request)
 
     except Exception as exc:
         logger.exception("Failed to initialize APScheduler: %s", exc)
     return app
 
 
+def close_items_interval(app) -> timedelta:
+    """
+    Return how often the 'close-items' job runs.
+
+    Items listed in a process that doesn't run the scheduler are only
+    scheduled to close by the job. Running it at least as often as the
+    shortest sale means that an item listed right after a run closes after
+    the next run, which then schedules its closing.
+    """
+    return min(CLOSE_ITEMS_INTERVAL, shortest_sale_length(app))
+
+
+def _acquire_lock_file(path: str) -> bool:
+    """
+    Try to take an exclusive lock on the file, without blocking.
+
+    The lock is held until the process exits.
+    """
+    global _lock_file  # pylint: disable=global-statement
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    if _lock_file is not None:
+        return True
+
+    lock_file = open(path, "a", encoding="ascii")  # pylint: disable=consider-using-with
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    _lock_file = lock_file
+    return True
+
+
+def start_scheduler(app) -> bool:
+    """
+    Start the scheduler, if it's not running already.
+
+    :return: Whether the scheduler is running in this process.
+    """
+    global _lock_retry_at  # pylint: disable=global-statement
+
+    with _start_lock:
+        if scheduler.running:
+            logger.debug('APScheduler already running')
+            return True
+
+        if lock_path := app.config.get('SCHEDULER_LOCK_FILE'):
+            if not _acquire_lock_file(lock_path):
+                logger.debug('APScheduler is run by another process, holding %s', lock_path)
+                _lock_retry_at = monotonic() + LOCK_RETRY_INTERVAL
+                return False
+
+        # Record the job durations into metrics.
+        scheduler.add_listener(scheduler_job_listener,
+                               EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+        with app.app_context():
+            scheduler.start()
+            logger.debug('APScheduler started', extra={'pid': os.getpid()})
+
+        return True
+
+
+def _start_scheduler_on_request():
+    """
+    Start the scheduler on the first request.
+
+    If another process holds the scheduler lock, try again after a while, in
+    case that process has exited.
+    """
+    if not scheduler.running and monotonic() >= _lock_retry_at:
+        start_scheduler(current_app._get_current_object())  # pylint: disable=protected-access
+
+
 def _handle_item_closing(item_id):
     """
     Handle the closing of an item.
@@ -100,13 +236,29 @@ def _schedule_item_closing_task(sender, document, **kwargs):  # pylint: disable=
         # close it.
         return
 
-    logger.debug('Scheduling task to close item %s', document.id)
+    if not scheduler.running:
+        # Only one process runs the scheduler, see `SCHEDULER_LOCK_FILE`. Jobs
+        # added in the others would never run. The 'close-items' job of the
+        # running scheduler schedules the closing of the item instead. It runs
+        # at least once before the item closes, see `close_items_interval`.
+        logger.debug("Not scheduling closing of item %s, the scheduler runs in another process", document.id)
+        return
+
+    _schedule_closing(document.id, document.closes_at)
+
+
+def _schedule_closing(item_id, closes_at: datetime):
+    """
+    Schedule a job to close the item when the auction ends.
+    """
+    logger.debug('Scheduling task to close item %s', item_id)
     scheduler.add_job(
         func=_handle_item_closing,
-        args=(document.id,),
+        args=(item_id,),
         trigger='date',
-        run_date=document.closes_at + timedelta(seconds=1),
-        id=f'close-item-{document.id}',
+        run_date=closes_at + timedelta(seconds=1),
+        id=f'close-item-{item_id}',
+        replace_existing=True,
     )
 
 
@@ -121,23 +273,74 @@ def _close_items():
         logger.info("Running scheduled task 'close-items'")
 
         # Get items that are past the closing date, and are not already closed
-        closes_before = datetime.utcnow() + timedelta(seconds=2)
-        items = Item.objects(Q(closed=None) | Q(closed=False), closes_at__lt=closes_before).all()
+        now = datetime.utcnow()
+        items = Item.objects(Q(closed=None) | Q(closed=False), closes_at__lte=now).all()
         logger.debug("Closing %d items", len(items))
 
-        # Close each item
+        # Close each item in a task of its own, so that one failing item is
+        # retried without holding up the others.
         for item in items:
-            try:
-                # Make sure item is not already closed
-                if item.closed:
-                    continue
+            close_item.delay(str(item.id))
+
+        # Schedule the closing of the items closing before the next run. They
+        # may have been listed in a process that doesn't run the scheduler.
+        upcoming = Item.objects(Q(closed=None) | Q(closed=False), closes_at__gt=now,
+                                closes_at__lte=now + close_items_interval(scheduler.app)).only('closes_at')
+        for item in upcoming:
+            _schedule_closing(item.id, item.closes_at)
+
+
+@task(retries=3, backoff=30, durable=True)
+def close_item(item_id: str):
+    """
+    Task to close an item, and notify the seller and the buyer.
+    """
+    item = Item.objects.get(id=item_id)
+
+    # Make sure item is not already closed
+    if item.closed:
+        return
+
+    handle_item_closing(item)
+
+
+def _archive_items():
+    """
+    Move old closed items into the archive, see :mod:`tjts5901.archive`.
+
+    This function is meant to be run by the APScheduler, and is not meant to be
+    called directly.
+    """
+    from .archive import archive_items  # pylint: disable=import-outside-toplevel
+    with scheduler.app.app_context():
+        logger.debug("Running scheduled task 'archive-items'")
+        archive_items()
 
-                handle_item_closing(item)
 
-            except Exception as exc:
-                logger.error("Error closing items: %s", exc, exc_info=True, extra={
-                    'item_id': item.id,
-                })
+def _refresh_rankings():
+    """
+    Refresh the item rankings, see :mod:`tjts5901.rankings`.
+
+    This function is meant to be run by the APScheduler, and is not meant to be
+    called directly.
+    """
+    from .rankings import refresh_rankings  # pylint: disable=import-outside-toplevel
+    with scheduler.app.app_context():
+        logger.debug("Running scheduled task 'refresh-rankings'")
+        refresh_rankings()
+
+
+def _notify_closing_soon():
+    """
+    Notify the watchers of the items closing soon, see :mod:`tjts5901.watchlist`.
+
+    This function is meant to be run by the APScheduler, and is not meant to be
+    called directly.
+    """
+    from .watchlist import notify_closing_soon  # pylint: disable=import-outside-toplevel
+    with scheduler.app.app_context():
+        logger.debug("Running scheduled task 'notify-closing-soon'")
+        notify_closing_soon()
 
 
 def _update_currency_rates():
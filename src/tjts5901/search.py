@@ -0,0 +1,414 @@
+"""
+Item search.
+
+Searches the items by the words in their title and description, with filters
+for open or closed items and for the price range. The price filter uses the
+denormalized :attr:`Item.price <tjts5901.models.Item.price>`, so no bids are
+read.
+
+Results are paginated with an opaque cursor, which holds the sort key of the
+last item on the page. Fetching the next page doesn't need to skip over the
+previous ones, and items added in between don't shift the pages.
+
+Searching is done with the MongoDB text index on the items
+(`SEARCH_BACKEND=text`), with results sorted by relevance. Mongomock doesn't
+support text search, so with it an in-memory inverted index is used instead
+(`SEARCH_BACKEND=memory`). The inverted index is built from the database on
+the first search, and kept up to date with the item signals, so it only sees
+the changes made in the same process. It's meant for tests and development.
+
+Without search words, the items are listed by closing time, like on the
+index page.
+
+To fill in the prices and top bidders of items listed before they were denormalized:
+    $ flask update-item-prices
+"""
+
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+from os import environ
+import re
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import click
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Flask, current_app, has_app_context
+from flask.cli import with_appcontext
+from flask_babel import lazy_gettext
+from mongoengine import signals
+from pymongo import UpdateOne
+
+from .models import Bid, Item
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("open", "closed")
+"Values for the status filter."
+
+WEIGHTS = {"title": 10, "description": 2}
+"Weight of a matching word per field, same as in the text index."
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class SearchError(ValueError):
+    """
+    Raised when the search parameters are not valid.
+
+    The message is a lazy string, translated when it's converted to a string.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self) -> str:
+        return str(self.message)
+
+
+@dataclass
+class SearchQuery:
+    """
+    Search parameters.
+    """
+
+    text: str = ""
+    "Words to search for. Items matching any of the words are returned."
+
+    status: Optional[str] = None
+    "Either `open` or `closed`, or `None` for both."
+
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    limit: int = 20
+    cursor: Optional[str] = None
+
+
+def _parse_int(args, name: str) -> Optional[int]:
+    value = args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as exc:
+        raise SearchError(lazy_gettext("Invalid value for argument %(argname)s", argname=name)) from exc
+    if number < 0:
+        raise SearchError(lazy_gettext("Invalid value for argument %(argname)s", argname=name))
+    return number
+
+
+def parse_search_args(args) -> SearchQuery:
+    """
+    Parse the search parameters from the request arguments.
+
+    :param args: Request arguments, with `q`, `status`, `min_price`,
+                 `max_price`, `limit` and `cursor`.
+    :raises SearchError: If a parameter is not valid.
+    """
+    status = args.get("status") or None
+    if status not in (None, *STATUSES):
+        raise SearchError(lazy_gettext("Invalid value for argument %(argname)s", argname="status"))
+
+    limit = _parse_int(args, "limit") or current_app.config["SEARCH_PAGE_SIZE"]
+
+    return SearchQuery(
+        text=(args.get("q") or "").strip(),
+        status=status,
+        min_price=_parse_int(args, "min_price"),
+        max_price=_parse_int(args, "max_price"),
+        limit=min(limit, current_app.config["SEARCH_MAX_PAGE_SIZE"]),
+        cursor=args.get("cursor") or None,
+    )
+
+
+def encode_cursor(values: List[Any]) -> str:
+    data = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    :raises SearchError: If the cursor is not valid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != 2:
+            raise ValueError(cursor)
+        values[1] = ObjectId(values[1])
+    except (ValueError, TypeError, InvalidId) as exc:
+        raise SearchError(lazy_gettext("Invalid value for argument %(argname)s", argname="cursor")) from exc
+    return values
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Split the text into lowercase words.
+    """
+    return _WORD_RE.findall(text.casefold()) if text else []
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index of the item titles and descriptions.
+
+    Scores items by the summed weights of the matching words, like the text
+    index does, but without stemming.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[ObjectId, int]] = {}
+        self._words: Dict[ObjectId, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.built = False
+
+    def build(self):
+        """
+        Index all the items in the database.
+        """
+        items = Item.objects.only("title", "description")
+        with self._lock:
+            self._postings.clear()
+            self._words.clear()
+            for item in items:
+                self._add(item)
+            self.built = True
+        logger.debug("Built in-memory search index", extra={"items": len(self._words)})
+
+    def _add(self, item: Item):
+        self._remove(item.id)
+        words: Set[str] = set()
+        for field, weight in WEIGHTS.items():
+            for word in tokenize(getattr(item, field)):
+                postings = self._postings.setdefault(word, {})
+                postings[item.id] = postings.get(item.id, 0) + weight
+                words.add(word)
+        self._words[item.id] = words
+
+    def _remove(self, item_id: ObjectId):
+        for word in self._words.pop(item_id, ()):
+            postings = self._postings[word]
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[word]
+
+    def add(self, item: Item):
+        with self._lock:
+            self._add(item)
+
+    def remove(self, item_id: ObjectId):
+        with self._lock:
+            self._remove(item_id)
+
+    def search(self, text: str) -> Dict[ObjectId, float]:
+        """
+        Find the items matching any of the words.
+
+        :return: Scores of the matching items by id.
+        """
+        if not self.built:
+            self.build()
+
+        scores: Dict[ObjectId, float] = {}
+        with self._lock:
+            for word in set(tokenize(text)):
+                for item_id, weight in self._postings.get(word, {}).items():
+                    scores[item_id] = scores.get(item_id, 0) + weight
+        return scores
+
+
+def _conditions(query: SearchQuery) -> List[Dict]:
+    """
+    Build the filters of the query as raw MongoDB conditions.
+    """
+    now = datetime.utcnow()
+    conditions = []
+
+    if query.status == "open":
+        conditions.append({"closed": {"$ne": True}, "closes_at": {"$gt": now}})
+    elif query.status == "closed":
+        conditions.append({"$or": [{"closed": True}, {"closes_at": {"$lte": now}}]})
+
+    price = {}
+    if query.min_price is not None:
+        price["$gte"] = query.min_price
+    if query.max_price is not None:
+        price["$lte"] = query.max_price
+    if price:
+        conditions.append({"price": price})
+
+    return conditions
+
+
+def _combine(conditions: List[Dict]) -> Dict:
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def _page(items: List[Item], limit: int, sort_key) -> Tuple[List[Item], Optional[str]]:
+    """
+    Cut the page, and make the cursor for the next page if there's one.
+    """
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(sort_key(items[-1]))
+
+
+def _browse(query: SearchQuery) -> Tuple[List[Item], Optional[str]]:
+    conditions = _conditions(query)
+    if query.cursor:
+        closes_at, item_id = decode_cursor(query.cursor)
+        closes_at = datetime.fromisoformat(closes_at)
+        conditions.append({"$or": [
+            {"closes_at": {"$lt": closes_at}},
+            {"closes_at": closes_at, "_id": {"$lt": item_id}},
+        ]})
+
+    items = list(Item.objects(__raw__=_combine(conditions)).order_by("-closes_at", "-id").limit(query.limit + 1))
+    return _page(items, query.limit, lambda item: [item.closes_at.isoformat(), str(item.id)])
+
+
+def _text_search(query: SearchQuery) -> Tuple[List[Item], Optional[str]]:
+    conditions = [{"$text": {"$search": query.text}}] + _conditions(query)
+
+    pipeline: List[Dict] = [
+        {"$match": _combine(conditions)},
+        {"$addFields": {"_score": {"$meta": "textScore"}}},
+    ]
+    if query.cursor:
+        score, item_id = decode_cursor(query.cursor)
+        pipeline.append({"$match": {"$or": [
+            {"_score": {"$lt": score}},
+            {"_score": score, "_id": {"$lt": item_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"_score": -1, "_id": -1}},
+        {"$limit": query.limit + 1},
+    ]
+
+    items = []
+    scores = {}
+    for row in Item.objects.aggregate(pipeline):
+        scores[row["_id"]] = row.pop("_score")
+        items.append(Item._from_son(row))  # pylint: disable=protected-access
+    return _page(items, query.limit, lambda item: [scores[item.id], str(item.id)])
+
+
+def _memory_search(query: SearchQuery, index: InvertedIndex) -> Tuple[List[Item], Optional[str]]:
+    scores = index.search(query.text)
+    if not scores:
+        return [], None
+
+    conditions = [{"_id": {"$in": list(scores)}}] + _conditions(query)
+    items = list(Item.objects(__raw__=_combine(conditions)))
+    items.sort(key=lambda item: (scores[item.id], item.id), reverse=True)
+
+    if query.cursor:
+        cursor = tuple(decode_cursor(query.cursor))
+        items = [item for item in items if (scores[item.id], item.id) < cursor]
+
+    return _page(items[:query.limit + 1], query.limit, lambda item: [scores[item.id], str(item.id)])
+
+
+def search_items(query: SearchQuery) -> Tuple[List[Item], Optional[str]]:
+    """
+    Search the items.
+
+    :return: The items on the page, and the cursor for the next page, or
+             `None` if this is the last page.
+    :raises SearchError: If the cursor is not valid.
+    """
+    if not query.text:
+        return _browse(query)
+
+    if (index := _get_index()) is not None:
+        return _memory_search(query, index)
+    return _text_search(query)
+
+
+def _get_index() -> Optional[InvertedIndex]:
+    # Items might be saved outside the app, eg. in scripts.
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("search_index")
+
+
+def _index_item(sender, document, **kwargs):  # pylint: disable=unused-argument
+    index = _get_index()
+    if index is not None and index.built:
+        index.add(document)
+
+
+def _unindex_item(sender, document, **kwargs):  # pylint: disable=unused-argument
+    index = _get_index()
+    if index is not None and index.built:
+        index.remove(document.id)
+
+
+def unindex_items(item_ids: List[ObjectId]):
+    """
+    Remove items deleted without signals, eg. archived ones, from the in-memory index.
+    """
+    index = _get_index()
+    if index is not None and index.built:
+        for item_id in item_ids:
+            index.remove(item_id)
+
+
+def init_search(app: Flask):
+    """
+    Initialize the item search.
+
+    `SEARCH_BACKEND` is either `text`, `memory`, or `auto` (default) to use
+    `memory` with mongomock, and `text` otherwise.
+    """
+    app.config.setdefault("SEARCH_BACKEND", environ.get("SEARCH_BACKEND", "auto"))
+    app.config.setdefault("SEARCH_PAGE_SIZE", int(environ.get("SEARCH_PAGE_SIZE", 20)))
+    app.config.setdefault("SEARCH_MAX_PAGE_SIZE", 100)
+
+    backend = app.config["SEARCH_BACKEND"]
+    if backend == "auto":
+        host = str(app.config.get("MONGODB_SETTINGS", {}).get("host", ""))
+        backend = "memory" if host.startswith("mongomock://") else "text"
+
+    if backend == "memory":
+        app.extensions["search_index"] = InvertedIndex()
+        signals.post_save.connect(_index_item, sender=Item)
+        signals.post_delete.connect(_unindex_item, sender=Item)
+    elif backend != "text":
+        raise ValueError(f"Unknown SEARCH_BACKEND: {backend!r}")
+
+    app.cli.add_command(update_item_prices)
+    logger.debug("Initialized search", extra={"backend": backend})
+
+
+@click.command()
+@with_appcontext
+def update_item_prices():
+    """
+    Set the denormalized price, and top bidder, of all the items from their bids.
+    """
+    pipeline = [
+        {"$sort": {"amount": -1}},
+        {"$group": {"_id": "$item", "amount": {"$first": "$amount"}, "bidder": {"$first": "$bidder"}}},
+    ]
+    top_bids = {row["_id"]: row for row in Bid.objects.aggregate(pipeline)}
+
+    updates = []
+    for item in Item.objects.only("starting_bid").as_pymongo():
+        top_bid = top_bids.get(item["_id"], {})
+        updates.append(UpdateOne({"_id": item["_id"]}, {"$set": {
+            "price": max(item["starting_bid"], top_bid.get("amount", 0)),
+            "top_bidder": top_bid.get("bidder"),
+        }}))
+    if updates:
+        Item._get_collection().bulk_write(updates, ordered=False)  # pylint: disable=protected-access
+    click.echo(f"Updated the prices of {len(updates)} items.")
@@ -0,0 +1,208 @@
+"""
+Seller statistics.
+
+The dashboard on the seller's profile page shows how many items they have
+listed and sold, their revenue and the average final price. Counting those
+from the items and bids on every page load would scan the seller's items, and
+all of their bids, so they are kept in one :class:`SellerStats` document per
+seller instead, and the page reads only that.
+
+The documents are updated with `$inc` as things happen:
+
+- listing an item, see :func:`record_item_listed`
+- placing bids, see :func:`record_bids`
+- closing an item, see :func:`record_item_closed`
+- deleting an item, see :func:`record_item_deleted`
+
+If they drift, eg. after a failed write, or when the statistics are added to
+an existing database, rebuild them from the items and bids:
+    $ flask rebuild-seller-stats
+
+The rebuild is one aggregation pipeline, run over the live and the archived
+auctions, see :func:`seller_stats_pipeline`.
+"""
+
+from datetime import datetime
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import click
+from bson import ObjectId
+from flask import Flask
+from flask.cli import with_appcontext
+from pymongo import ReplaceOne
+
+from .archive import archive_collection
+from .db import routed
+from .models import Bid, Item, SellerStats
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 1000
+"Statistics documents written per bulk write when rebuilding."
+
+
+def init_stats(app: Flask):
+    """
+    Initialize the seller statistics.
+    """
+    app.cli.add_command(rebuild_seller_stats_command)
+
+
+def seller_id(item: Item) -> ObjectId:
+    """
+    Return the id of the item's seller, without fetching the seller.
+    """
+    return item.to_mongo().get("seller")
+
+
+def increments(seller: ObjectId, **counters: int) -> Tuple[Dict, Dict]:
+    """
+    Return the filter and update to increment the counters of a seller.
+
+    For bulk writes and the async API, which don't use the document classes.
+    Use with `upsert=True`, so that the document is created for new sellers.
+
+    :param seller: Id of the seller.
+    :param counters: Amounts to add, by field name.
+    :return: Filter and update documents.
+    """
+    return {"_id": seller}, {"$inc": counters, "$set": {"updated_at": datetime.utcnow()}}
+
+
+def update_seller_stats(seller: ObjectId, **counters: int):
+    """
+    Increment the counters of a seller.
+
+    :param seller: Id of the seller.
+    :param counters: Amounts to add, by field name.
+    """
+    SellerStats._get_collection().update_one(*increments(seller, **counters),  # pylint: disable=protected-access
+                                             upsert=True)
+
+
+def record_item_listed(item: Item):
+    update_seller_stats(seller_id(item), items_listed=1, items_open=1)
+
+
+def record_bids(item: Item, count: int = 1):
+    update_seller_stats(seller_id(item), bids_received=count)
+
+
+def record_item_closed(item: Item, winning_bid: Optional[Bid] = None):
+    """
+    Count the item as closed, and as sold if it has a winning bid.
+    """
+    if winning_bid:
+        update_seller_stats(seller_id(item), items_open=-1, items_sold=1, revenue=winning_bid.amount)
+    else:
+        update_seller_stats(seller_id(item), items_open=-1)
+
+
+def record_item_deleted(item: Item):
+    """
+    Remove the item, and its bids, from the statistics.
+    """
+    counters = {
+        "items_listed": -1,
+        "bids_received": -Bid._get_collection().count_documents({"item": item.id}),  # pylint: disable=protected-access
+    }
+    if not item.closed:
+        counters["items_open"] = -1
+    elif item.winning_bid:
+        counters["items_sold"] = -1
+        counters["revenue"] = -(item.price or 0)
+
+    update_seller_stats(seller_id(item), **counters)
+
+
+def seller_stats_pipeline(bid_collection: str) -> List[Dict]:
+    """
+    Return the aggregation pipeline to count the seller statistics from an item collection.
+
+    :param bid_collection: Name of the collection with the bids of the items.
+    :return: Pipeline yielding one document per seller, with the seller id as
+             `_id`, and the :class:`SellerStats` counters.
+    """
+    sold = {"$and": ["$closed", {"$gt": ["$winning_bid", None]}]}
+    return [
+        # When `$unwind` follows `$lookup`, MongoDB streams the joined bids
+        # instead of collecting them into an array. Items with lots of bids
+        # don't run into the document size limit, and with the `item` index
+        # each item is one index lookup.
+        {"$lookup": {"from": bid_collection, "localField": "_id", "foreignField": "item", "as": "bid"}},
+        {"$unwind": {"path": "$bid", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": "$_id",
+            "seller": {"$first": "$seller"},
+            "closed": {"$first": "$closed"},
+            "sold": {"$first": sold},
+            # The price of a closed item is its winning bid.
+            "price": {"$first": "$price"},
+            "bids": {"$sum": {"$cond": [{"$gt": ["$bid", None]}, 1, 0]}},
+        }},
+        {"$group": {
+            "_id": "$seller",
+            "items_listed": {"$sum": 1},
+            "items_open": {"$sum": {"$cond": ["$closed", 0, 1]}},
+            "items_sold": {"$sum": {"$cond": ["$sold", 1, 0]}},
+            "revenue": {"$sum": {"$cond": ["$sold", "$price", 0]}},
+            "bids_received": {"$sum": "$bids"},
+        }},
+    ]
+
+
+def rebuild_seller_stats() -> int:
+    """
+    Rebuild the statistics of all sellers from the items and bids.
+
+    Counters incremented while the rebuild runs are overwritten, so run it
+    when the site is quiet.
+
+    :return: Number of sellers.
+    """
+    started = datetime.utcnow()
+
+    # Sum the live and archived auctions of each seller.
+    totals: Dict[ObjectId, Dict[str, int]] = {}
+    for items, bids in ((Item._get_collection(), Bid._get_collection_name()),  # pylint: disable=protected-access
+                        (archive_collection(Item), archive_collection(Bid).name)):
+        for row in items.aggregate(seller_stats_pipeline(bids), allowDiskUse=True):
+            seller = row.pop("_id")
+            total = totals.setdefault(seller, dict.fromkeys(row, 0))
+            for key, value in row.items():
+                total[key] += value
+
+    collection = SellerStats._get_collection()  # pylint: disable=protected-access
+    requests = [ReplaceOne({"_id": seller}, {**counters, "updated_at": started}, upsert=True)
+                for seller, counters in totals.items()]
+    for start in range(0, len(requests), REBUILD_BATCH_SIZE):
+        collection.bulk_write(requests[start:start + REBUILD_BATCH_SIZE], ordered=False)
+
+    # Sellers who no longer have any items.
+    collection.delete_many({"$or": [{"updated_at": {"$lt": started}}, {"updated_at": None}]})
+
+    logger.info("Rebuilt the statistics of %d sellers", len(totals), extra={"sellers": len(totals)})
+    return len(totals)
+
+
+def get_seller_stats(seller) -> SellerStats:
+    """
+    Get the statistics of a seller. Sellers without any are given empty statistics.
+
+    Read like the rest of the page, see :func:`tjts5901.db.routed`.
+
+    :param seller: The seller, or their id.
+    """
+    seller = getattr(seller, "id", seller)
+    return routed(SellerStats.objects(seller=seller)).first() or SellerStats(seller=seller)
+
+
+@click.command("rebuild-seller-stats")
+@with_appcontext
+def rebuild_seller_stats_command():
+    """
+    Rebuild the seller statistics from the items and bids.
+    """
+    count = rebuild_seller_stats()
+    click.echo(f"Rebuilt the statistics of {count} sellers.")
@@ -0,0 +1,345 @@
+"""
+Background tasks.
+
+Runs side effects that don't need to finish before the response, like
+sending notifications, outside the request.
+
+Declare a task with the :func:`task` decorator, and run it in the background
+with `.delay()`:
+    >>> @task(retries=3)
+    ... def send_notification_task(user_id, message):
+    ...     ...
+    >>> send_notification_task.delay(str(user.id), "Hello")
+
+Tasks run in an application context. Pass ids rather than documents as
+arguments, and load the documents in the task, so that the task sees the
+current data.
+
+Tasks are queued in process memory, and run by a pool of `TASKS_WORKERS`
+threads. The queue holds at most `TASKS_QUEUE_SIZE` tasks; when it's full, the
+task is run right away in the calling thread, slowing down the caller rather
+than losing the task. Failed tasks are retried with exponential backoff.
+
+Tasks declared with `durable=True` are saved in MongoDB instead when
+`TASKS_DURABLE` is set, and are run by a separate worker process:
+    $ flask worker
+
+Durable task arguments need to be storable in MongoDB.
+
+When `TASKS_EAGER` is set, tasks are run right away in the calling thread.
+It's the default for testing.
+"""
+
+from datetime import datetime, timedelta
+from functools import update_wrapper
+import importlib
+import logging
+from os import environ
+import queue
+import threading
+from time import sleep
+from typing import Callable, Dict, List, Optional
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from mongoengine import Q
+
+from .metrics import registry
+from .models import QueuedTask
+
+logger = logging.getLogger(__name__)
+
+TASKS = registry.counter("tasks_total", "Background tasks run, by result.", ["task", "status"])
+
+_tasks: Dict[str, "Task"] = {}
+"Declared tasks by name."
+
+
+class Task:
+    """
+    A function that can be run in the background.
+
+    Calling the task runs the function directly.
+    """
+
+    def __init__(self, func: Callable, retries: int = 0, backoff: float = 1.0, durable: bool = False):
+        update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.retries = retries
+        self.backoff = backoff
+        self.durable = durable
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """
+        Queue the task to be run in the background, with the current application.
+        """
+        return current_app.extensions['tasks'].enqueue(self, args, kwargs)
+
+    def retry_delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before retrying after the given attempt, starting from 1.
+        """
+        return self.backoff * 2 ** (attempt - 1)
+
+
+def task(func: Optional[Callable] = None, *, retries: int = 0, backoff: float = 1.0, durable: bool = False):
+    """
+    Decorator to declare a background task.
+
+    :param retries: How many times to retry a failed task.
+    :param backoff: Seconds to wait before the first retry. Doubles on each retry.
+    :param durable: Save the task in MongoDB when `TASKS_DURABLE` is set.
+    """
+
+    def decorator(func: Callable) -> Task:
+        declared = Task(func, retries=retries, backoff=backoff, durable=durable)
+        _tasks[declared.name] = declared
+        return declared
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def get_task(name: str) -> Task:
+    """
+    Get a declared task by name, importing its module if needed.
+
+    :raises LookupError: If there's no such task.
+    """
+    if name not in _tasks:
+        module, _, _attr = name.rpartition(".")
+        try:
+            importlib.import_module(module)
+        except ImportError as exc:
+            raise LookupError(f"Unknown task {name!r}") from exc
+
+    if name not in _tasks:
+        raise LookupError(f"Unknown task {name!r}")
+    return _tasks[name]
+
+
+class TaskQueue:
+    """
+    In-process task queue, with a pool of worker threads.
+
+    The threads are started on the first task, so that no threads are started
+    before gunicorn forks the workers.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.queue: queue.Queue = queue.Queue(maxsize=app.config["TASKS_QUEUE_SIZE"])
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.app.config["TASKS_WORKERS"]):
+                thread = threading.Thread(target=self._work, name=f"task-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, func: Callable, args=(), kwargs=None) -> Optional[QueuedTask]:
+        """
+        Run the task in the background.
+
+        :param func: A :class:`Task`, or a plain function to run once.
+        :return: The saved task, for durable tasks.
+        """
+        job = func if isinstance(func, Task) else Task(func)
+        kwargs = kwargs or {}
+
+        if self.app.config["TASKS_EAGER"]:
+            for attempt in range(1, job.retries + 2):
+                if self.execute(job, args, kwargs, attempt):
+                    break
+            return None
+
+        if job.durable and self.app.config["TASKS_DURABLE"]:
+            return QueuedTask(name=job.name, args=list(args), kwargs=kwargs).save()
+
+        self._put(job, args, kwargs, 1)
+        return None
+
+    def _put(self, job: Task, args, kwargs, attempt: int):
+        if not self._threads:
+            self._start()
+
+        try:
+            self.queue.put_nowait((job, args, kwargs, attempt))
+        except queue.Full:
+            TASKS.labels(job.name, "overflow").inc()
+            logger.warning("Task queue is full, running %s inline", job.name, extra={"task": job.name})
+            self._run(job, args, kwargs, attempt)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._run(*item)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job: Task, args, kwargs, attempt: int):
+        if self.execute(job, args, kwargs, attempt) or attempt > job.retries:
+            return
+
+        # Retry later. Timer threads keep the worker threads free for other tasks.
+        timer = threading.Timer(job.retry_delay(attempt), self._put, (job, args, kwargs, attempt + 1))
+        timer.daemon = True
+        timer.start()
+
+    def execute(self, job: Task, args, kwargs, attempt: int) -> bool:
+        """
+        Run the task once in an application context.
+
+        :return: Whether the task succeeded.
+        """
+        with self.app.app_context():
+            try:
+                job.func(*args, **kwargs)
+            except Exception as exc:  # pylint: disable=broad-except
+                final = attempt > job.retries
+                TASKS.labels(job.name, "failed" if final else "retry").inc()
+                logger.log(logging.ERROR if final else logging.WARNING,
+                           "Task %s failed on attempt %d: %s", job.name, attempt, exc,
+                           exc_info=final, extra={"task": job.name, "attempt": attempt})
+                return False
+
+        TASKS.labels(job.name, "ok").inc()
+        return True
+
+    def join(self):
+        """
+        Wait until the queued tasks are done. Retries waiting on a timer are not waited for.
+        """
+        self.queue.join()
+
+    def shutdown(self):
+        """
+        Run the queued tasks, and stop the worker threads.
+        """
+        with self._lock:
+            for _thread in self._threads:
+                self.queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+
+class DurableWorker:
+    """
+    Runs the tasks saved in MongoDB.
+
+    Tasks are claimed one at a time with an atomic update. A claimed task is
+    locked for `TASKS_LEASE` seconds; if the worker dies, another worker picks
+    the task up after that.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.lease = timedelta(seconds=app.config["TASKS_LEASE"])
+        self.queue: TaskQueue = app.extensions['tasks']
+
+    def claim(self) -> Optional[QueuedTask]:
+        """
+        Take the next task that is due.
+        """
+        now = datetime.utcnow()
+        return QueuedTask.objects(
+            Q(status="queued", run_at__lte=now) | Q(status="running", locked_until__lt=now)
+        ).order_by("run_at").modify(
+            set__status="running",
+            set__locked_until=now + self.lease,
+            inc__attempts=1,
+            new=True,
+        )
+
+    def run_one(self) -> bool:
+        """
+        Run the next task that is due.
+
+        :return: Whether there was a task to run.
+        """
+        record = self.claim()
+        if record is None:
+            return False
+
+        try:
+            job = get_task(record.name)
+        except LookupError as exc:
+            logger.error("Can't run task: %s", exc, extra={"task": record.name})
+            record.update(set__status="failed", set__last_error=str(exc))
+            return True
+
+        if self.queue.execute(job, record.args, record.kwargs, record.attempts):
+            record.delete()
+        elif record.attempts > job.retries:
+            record.update(set__status="failed", set__last_error="Failed after %d attempts" % record.attempts)
+        else:
+            record.update(set__status="queued",
+                          set__run_at=datetime.utcnow() + timedelta(seconds=job.retry_delay(record.attempts)))
+        return True
+
+    def run(self, poll_interval: float = 1.0, burst: bool = False):
+        """
+        Run tasks until interrupted.
+
+        :param poll_interval: Seconds to wait when there are no tasks due.
+        :param burst: Return when there are no tasks due.
+        """
+        while True:
+            if self.run_one():
+                continue
+            if burst:
+                return
+            sleep(poll_interval)
+
+
+def init_tasks(app: Flask) -> TaskQueue:
+    """
+    Initialize the background task queue.
+    """
+    app.config.setdefault("TASKS_WORKERS", int(environ.get("TASKS_WORKERS", 2)))
+    app.config.setdefault("TASKS_QUEUE_SIZE", int(environ.get("TASKS_QUEUE_SIZE", 1000)))
+    app.config.setdefault("TASKS_EAGER", app.testing)
+    app.config.setdefault("TASKS_DURABLE", environ.get("TASKS_DURABLE", "false").lower() == "true")
+    app.config.setdefault("TASKS_LEASE", int(environ.get("TASKS_LEASE", 300)))
+
+    task_queue = TaskQueue(app)
+    app.extensions['tasks'] = task_queue
+    app.cli.add_command(worker)
+    return task_queue
+
+
+def enqueue(func: Callable, *args, **kwargs):
+    """
+    Run a plain function in the background, with the current application.
+    """
+    return current_app.extensions['tasks'].enqueue(func, args, kwargs)
+
+
+@click.command()
+@with_appcontext
+@click.option("--poll-interval", type=float, default=1.0, show_default=True,
+              help="Seconds to wait when there are no tasks.")
+@click.option("--burst", is_flag=True, help="Exit when there are no more tasks.")
+def worker(poll_interval: float, burst: bool):
+    """
+    Run the durable background tasks.
+
+    Example:
+        $ TASKS_DURABLE=true flask worker
+    """
+    click.echo("Starting task worker...")
+    DurableWorker(current_app._get_current_object()).run(poll_interval, burst)  # pylint: disable=protected-access
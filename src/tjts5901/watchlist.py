@@ -0,0 +1,232 @@
+"""
+Watchlist.
+
+Users can watch items, to be notified when an item gets a new bid, when it
+closes soon, and when it has closed, instead of reloading the item page.
+
+A popular item can have tens of thousands of watchers, so the notifications
+are never sent in the request. The request enqueues :func:`notify_watchers`,
+which notifies one batch of `WATCH_FANOUT_BATCH_SIZE` watchers with a bulk
+insert, and then enqueues itself for the next batch. Every task run does a
+bounded amount of work, and a retry repeats only its own batch. Watchers are
+paged through the item and user index, so each batch is one index range read.
+
+To keep bids on busy items from flooding the watchers, new bid notifications
+of an item are sent at most once per `WATCH_BID_INTERVAL_SECONDS`. Items keep
+count of their watchers, so bids on unwatched items don't enqueue anything.
+If the first batch of a bid notification fails, the turn is given back, so
+that the retry notifies the watchers.
+
+Items closing within `WATCH_CLOSING_SOON_MINUTES` are looked up by the
+scheduler, see :func:`notify_closing_soon`.
+"""
+
+from datetime import datetime, timedelta
+import logging
+from os import environ
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from flask import Flask, current_app
+from flask_babel import lazy_gettext
+from markupsafe import Markup
+from mongoengine import Q
+from pymongo.errors import DuplicateKeyError
+
+from .models import Item, User, Watch
+from .notification import send_notifications
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+WATCH_EVENTS = ("bid", "closing-soon", "closed")
+"Events the watchers are notified of."
+
+
+def init_watchlist(app: Flask):
+    """
+    Initialize the watchlist.
+    """
+    app.config.setdefault("WATCH_FANOUT_BATCH_SIZE", int(environ.get("WATCH_FANOUT_BATCH_SIZE", 1000)))
+    app.config.setdefault("WATCH_BID_INTERVAL_SECONDS", int(environ.get("WATCH_BID_INTERVAL_SECONDS", 300)))
+    app.config.setdefault("WATCH_CLOSING_SOON_MINUTES", int(environ.get("WATCH_CLOSING_SOON_MINUTES", 60)))
+
+
+def watch_item(item: Item, user: User) -> bool:
+    """
+    Add the item to the user's watchlist.
+
+    :return: Whether the item was added, ie. the user wasn't watching it already.
+    """
+    try:
+        result = Watch._get_collection().update_one(  # pylint: disable=protected-access
+            {"item": item.id, "user": user.id},
+            {"$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Watched concurrently, eg. by a double click.
+        return False
+
+    if result.upserted_id is None:
+        return False
+
+    Item.objects(id=item.id).update_one(inc__watchers=1)
+    return True
+
+
+def unwatch_item(item: Item, user: User) -> bool:
+    """
+    Remove the item from the user's watchlist.
+
+    :return: Whether the item was removed.
+    """
+    result = Watch._get_collection().delete_one({"item": item.id, "user": user.id})  # pylint: disable=protected-access
+    if not result.deleted_count:
+        return False
+
+    Item.objects(id=item.id).update_one(inc__watchers=-1)
+    return True
+
+
+def is_watching(item: Item, user: User) -> bool:
+    """
+    Return whether the user is watching the item.
+    """
+    if not user.is_authenticated:
+        return False
+    return Watch._get_collection().find_one(  # pylint: disable=protected-access
+        {"item": item.id, "user": user.id}, {"_id": 1}) is not None
+
+
+def notify_new_bid(item: Item, bidder_id: ObjectId):
+    """
+    Notify the watchers of the item of a new bid, in the background.
+
+    :param item: The item, as read before the bid.
+    :param bidder_id: Id of the bidder, who isn't notified of their own bid.
+    """
+    if item.watchers:
+        notify_watchers.delay(str(item.id), "bid", exclude=str(bidder_id))
+
+
+def event_message(event: str, item: Item) -> Tuple[str, str]:
+    """
+    Return the title and the message of an event, as lazy strings.
+    """
+    title = Markup.escape(item.title)
+    if event == "bid":
+        return (lazy_gettext("New bid on a watched item"),
+                lazy_gettext("<em>%(title)s</em> has a new bid. The highest bid is now %(price)s.",
+                             title=title, price=Markup.escape(item.price or item.starting_bid)))
+    if event == "closing-soon":
+        return (lazy_gettext("Watched item closes soon"),
+                lazy_gettext("<em>%(title)s</em> closes in %(minutes)s minutes.", title=title,
+                             minutes=max(0, int((item.closes_at - datetime.utcnow()).total_seconds() // 60))))
+    if event == "closed":
+        return (lazy_gettext("Watched item closed"),
+                lazy_gettext("<em>%(title)s</em> has closed.", title=title))
+    raise ValueError(f"Unknown watch event {event!r}")
+
+
+def _claim_bid_notification(item_id: ObjectId) -> Optional[datetime]:
+    """
+    Take the turn to notify the watchers of a new bid, unless they were notified recently.
+
+    :return: Time of the claim, for :func:`_release_bid_notification`, or `None` if not claimed.
+    """
+    now = datetime.utcnow()
+    # MongoDB stores milliseconds, so that the claim can be matched again on release.
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    since = now - timedelta(seconds=current_app.config["WATCH_BID_INTERVAL_SECONDS"])
+    if Item.objects(
+        Q(watchers_notified_at=None) | Q(watchers_notified_at__lte=since), id=item_id
+    ).update_one(set__watchers_notified_at=now):
+        return now
+    return None
+
+
+def _release_bid_notification(item_id: ObjectId, claimed_at: datetime):
+    """
+    Release a claim that failed to notify anyone, so that the retry can claim it again.
+    """
+    Item.objects(id=item_id, watchers_notified_at=claimed_at).update_one(unset__watchers_notified_at=True)
+
+
+@task(retries=3, backoff=5, durable=True)
+def notify_watchers(item_id: str, event: str, exclude: Optional[str] = None, after: Optional[str] = None):
+    """
+    Task to notify a batch of the item's watchers of an event.
+
+    If there are more watchers, the next batch is notified by another task.
+
+    :param event: One of :data:`WATCH_EVENTS`.
+    :param exclude: Id of a user not to notify, eg. the bidder.
+    :param after: Notify the watchers after this user id. Set for the following batches.
+    """
+    item = Item.objects(id=item_id).only("title", "starting_bid", "price", "closes_at").first()
+    if item is None:
+        logger.debug("Not notifying watchers, item %s not found", item_id)
+        return
+
+    claimed_at = None
+    if event == "bid" and after is None:
+        claimed_at = _claim_bid_notification(item.id)
+        if claimed_at is None:
+            logger.debug("Watchers of item %s were notified of a bid recently", item_id)
+            return
+
+    size = current_app.config["WATCH_FANOUT_BATCH_SIZE"]
+    query = {"item": item.id}
+    if after is not None:
+        query["user"] = {"$gt": ObjectId(after)}
+
+    title, message = event_message(event, item)
+    try:
+        watches = Watch._get_collection().find(query, {"_id": 0, "user": 1})  # pylint: disable=protected-access
+        users = [watch["user"] for watch in watches.sort("user", 1).limit(size)]
+        sent = send_notifications([user for user in users if str(user) != exclude], message,
+                                  category="watch", title=title)
+    except Exception:
+        # Otherwise the retry would find the claim taken, and notify no one.
+        if claimed_at is not None:
+            _release_bid_notification(item.id, claimed_at)
+        raise
+    logger.debug("Notified %d watchers of item %s of %s", sent, item_id, event,
+                 extra={"item_id": item_id, "event": event, "sent": sent})
+
+    # Enqueued after the batch is sent, so that a retry doesn't enqueue it twice.
+    if len(users) == size:
+        notify_watchers.delay(item_id, event, exclude=exclude, after=str(users[-1]))
+
+
+def notify_closing_soon() -> int:
+    """
+    Notify the watchers of the items closing within `WATCH_CLOSING_SOON_MINUTES`.
+
+    Each item is notified of once.
+
+    :return: Number of items whose watchers are notified.
+    """
+    now = datetime.utcnow()
+    closes_before = now + timedelta(minutes=current_app.config["WATCH_CLOSING_SOON_MINUTES"])
+
+    items = Item._get_collection()  # pylint: disable=protected-access
+    query = {
+        "closed": {"$ne": True},
+        "closes_at": {"$gt": now, "$lte": closes_before},
+        "watchers": {"$gt": 0},
+        "closing_soon_notified": {"$ne": True},
+    }
+
+    count = 0
+    for item in items.find(query, {"_id": 1}):
+        # Claim the item, in case the job runs in another process too.
+        claimed = items.update_one({"_id": item["_id"], "closing_soon_notified": {"$ne": True}},
+                                   {"$set": {"closing_soon_notified": True}})
+        if claimed.modified_count:
+            notify_watchers.delay(str(item["_id"]), "closing-soon")
+            count += 1
+
+    logger.debug("Notifying the watchers of %d items closing soon", count)
+    return count
@@ -4,9 +4,15 @@ from flask import Flask
 from faker import Faker
 from werkzeug.security import generate_password_hash
 
+from querybudget import QueryBudget, install as install_query_budgets
+
 # Disable Flask debug mode for testing
 environ["FLASK_DEBUG"] = "0"
 
+# Capture the MongoDB commands for `query_budget`. Needs to be done before the
+# app, and the database client, is created.
+install_query_budgets()
+
 
 def pytest_addoption(parser: pytest.Parser):
     """
@@ -75,7 +81,60 @@ def app():
 
 @pytest.fixture
 def client(app):
-    return app.test_client()
+    """
+    Test client, asking for English pages unless the test sets `Accept-Language`.
+    """
+    client = app.test_client()
+    client.environ_base["HTTP_ACCEPT_LANGUAGE"] = "en-GB,en;q=0.9"
+    return client
+
+
+@pytest.fixture
+def login(client):
+    """
+    Fixture to log a user in to the test client, without going through the login form.
+
+    Example:
+    >>> def test_profile(client: FlaskClient, login, user: User):
+    >>>     login(user)
+    >>>     client.get("/auth/profile")
+    """
+    def login_user(user):
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+
+    return login_user
+
+
+@pytest.fixture
+def currency_file(app: Flask, tmp_path):
+    """
+    Fixed currency rates, so that pages with prices can be rendered without
+    downloading the rates.
+    """
+    path = tmp_path / "currency.csv"
+    path.write_text("Date, USD, SEK, GBP, \n19 October 2026, 1.08, 11.5, 0.86, \n", encoding="ascii")
+    previous = app.config["CURRENCY_FILE"]
+    app.config["CURRENCY_FILE"] = str(path)
+    yield path
+    app.config["CURRENCY_FILE"] = previous
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Fixture to check the MongoDB commands run in a block against a budget.
+
+    If the block runs more commands than the budget allows, the test fails,
+    listing the commands run.
+
+    Example:
+    >>> def test_index(client: FlaskClient, query_budget):
+    >>>     with query_budget(queries=3, writes=0):
+    >>>         client.get("/")
+    """
+    return QueryBudget
 
 
 @pytest.fixture(scope='session', autouse=True)
@@ -0,0 +1,291 @@
+"""
+Query budgets
+=============
+
+Captures the MongoDB commands run in a block of code, and checks them
+against a budget. Used in the tests to catch changes that add queries to a
+page, like dereferencing a reference for every row of a listing:
+
+    >>> with QueryBudget(queries=3, writes=0):
+    ...     client.get("/")
+
+If the budget is exceeded, :class:`QueryBudgetExceeded` is raised, listing
+the commands by their shape: the command, collection and the filter with
+values replaced by `?`. Repeated shapes are counted, so that a query run for
+every row stands out.
+
+Commands are captured with a pymongo command listener. As mongomock doesn't
+emit command events, its collection methods are wrapped instead, and named
+after the pymongo command they stand for. Call :func:`install` before the
+database connection is made, as pymongo only picks up listeners registered
+before a client is created. `conftest.py` does, and provides the
+`query_budget` fixture.
+
+This is test tooling only, and isn't part of the package: capturing patches
+the mongomock `Collection` class for the whole process.
+
+Only commands run in the capturing thread are counted. With `TASKS_EAGER`,
+the background tasks run in the same thread, and are counted too.
+
+The read preference and write concern of each command are captured too, so
+the routing of reads and writes (see :mod:`tjts5901.db`) can be tested
+without a replica set.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from functools import wraps
+import json
+import logging
+import threading
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+WRITE_COMMANDS = frozenset(("insert", "update", "delete", "findAndModify", "bulkWrite"))
+
+IGNORED_COMMANDS = frozenset((
+    "buildInfo", "createIndexes", "endSessions", "hello", "isMaster", "ismaster", "killCursors",
+    "listCollections", "listIndexes", "ping", "saslContinue", "saslStart",
+))
+"Connection and index maintenance commands, which are not counted."
+
+SHAPE_KEYS = ("filter", "query", "pipeline", "update", "updates", "deletes", "q", "u", "sort", "projection")
+"Command arguments included in the query shape."
+
+LITERAL_KEYS = frozenset(("sort", "projection", "$sort", "$project", "$limit", "$skip"))
+"Arguments whose values are kept in the shape, as they tell which index is used."
+
+MONGOMOCK_METHODS = {
+    "find": "find",
+    "find_one": "find",
+    "aggregate": "aggregate",
+    "count_documents": "aggregate",
+    "estimated_document_count": "count",
+    "distinct": "distinct",
+    "insert_one": "insert",
+    "insert_many": "insert",
+    "update_one": "update",
+    "update_many": "update",
+    "replace_one": "update",
+    "delete_one": "delete",
+    "delete_many": "delete",
+    "find_one_and_update": "findAndModify",
+    "find_one_and_replace": "findAndModify",
+    "find_one_and_delete": "findAndModify",
+    "bulk_write": "bulkWrite",
+}
+"Mongomock collection methods, and the pymongo commands they stand for."
+
+_local = threading.local()
+_installed = False
+
+
+def shape(value: Any, literal: bool = False) -> Any:
+    """
+    Replace the values in a query with `?`, keeping the keys and operators.
+    """
+    if isinstance(value, dict):
+        return {key: shape(item, literal or key in LITERAL_KEYS) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes: List[Any] = []
+        for item in value:
+            if (item_shape := shape(item, literal)) not in shapes:
+                shapes.append(item_shape)
+        return shapes
+    if literal:
+        return value
+    return "?"
+
+
+@dataclass
+class Query:
+    """
+    A captured MongoDB command.
+    """
+
+    command: str
+    collection: str
+    shape: str
+    read_preference: str = "primary"
+    "Read preference mode, eg. `secondaryPreferred`."
+    write_concern: Optional[Dict[str, Any]] = None
+    "Write concern of a write, eg. `{'w': 'majority'}`. `None` for the default."
+
+    @property
+    def write(self) -> bool:
+        return self.command in WRITE_COMMANDS
+
+    def __str__(self) -> str:
+        if self.read_preference != "primary" and not self.write:
+            return f"{self.command} {self.collection} {self.shape} [{self.read_preference}]"
+        return f"{self.command} {self.collection} {self.shape}"
+
+
+def _describe(command: str, collection: str, arguments: Dict[str, Any],
+              read_preference: str = "primary", write_concern: Optional[Dict[str, Any]] = None) -> Query:
+    parts = {key: arguments[key] for key in SHAPE_KEYS if arguments.get(key) is not None}
+    return Query(command, str(collection), json.dumps(shape(parts), sort_keys=True, default=str),
+                 read_preference, write_concern or None)
+
+
+def _captures() -> List["QueryCapture"]:
+    if not hasattr(_local, "captures"):
+        _local.captures = []
+    return _local.captures
+
+
+class QueryCapture:
+    """
+    Context manager capturing the MongoDB commands run in the current thread.
+    """
+
+    def __init__(self):
+        self.queries: List[Query] = []
+        self.seconds = 0.0
+        self._started = 0.0
+
+    def __enter__(self) -> "QueryCapture":
+        _captures().append(self)
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = perf_counter() - self._started
+        _captures().remove(self)
+
+    @property
+    def writes(self) -> List[Query]:
+        return [query for query in self.queries if query.write]
+
+    def report(self) -> str:
+        """
+        List the captured commands by shape, with the number of times each was run.
+        """
+        shapes = Counter(str(query) for query in self.queries)
+        return "\n".join(f"  {count}x {query_shape}" for query_shape, count in shapes.most_common())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a block runs more commands, or takes longer, than its budget allows.
+    """
+
+
+class QueryBudget(QueryCapture):
+    """
+    Capture the commands run in the block, and check them against the budget.
+
+    :param queries: Maximum number of commands, including writes.
+    :param writes: Maximum number of write commands.
+    :param seconds: Maximum time the block may take.
+    :param name: Name of the block, for the error message.
+    """
+
+    def __init__(self, queries: Optional[int] = None, writes: Optional[int] = None,
+                 seconds: Optional[float] = None, name: Optional[str] = None):
+        super().__init__()
+        self.max_queries = queries
+        self.max_writes = writes
+        self.max_seconds = seconds
+        self.name = name
+
+    def __exit__(self, exc_type, *exc_info):
+        super().__exit__(exc_type, *exc_info)
+        if exc_type is None:
+            self.check()
+
+    def check(self):
+        """
+        :raises QueryBudgetExceeded: If the budget was exceeded.
+        """
+        problems = []
+        if self.max_queries is not None and len(self.queries) > self.max_queries:
+            problems.append(f"{len(self.queries)} queries, budget is {self.max_queries}")
+        if self.max_writes is not None and len(self.writes) > self.max_writes:
+            problems.append(f"{len(self.writes)} writes, budget is {self.max_writes}")
+        if self.max_seconds is not None and self.seconds > self.max_seconds:
+            problems.append(f"took {self.seconds:.3f}s, budget is {self.max_seconds}s")
+
+        if problems:
+            raise QueryBudgetExceeded(
+                f"{self.name or 'Block'} exceeded its budget: {'; '.join(problems)}\n{self.report()}")
+
+
+def _record(query: Query):
+    for capture in _captures():
+        capture.queries.append(query)
+
+
+class QueryListener(monitoring.CommandListener):
+    """
+    Pymongo command listener feeding the active captures.
+    """
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS or not _captures():
+            return
+        # The collection is given as the value of the command name, eg. `{"update": "item", ...}`.
+        arguments = dict(event.command)
+        collection = arguments.pop(event.command_name, None)
+        # Reads from primary don't have `$readPreference`.
+        mode = (arguments.get("$readPreference") or {}).get("mode", "primary")
+        _record(_describe(event.command_name, collection, arguments, mode, arguments.get("writeConcern")))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _wrap_mongomock_method(method, command: str):
+    @wraps(method)
+    def wrapper(collection, *args, **kwargs):
+        # Methods call each other, eg. find_one() calls find(). Only the
+        # outermost call is counted.
+        if getattr(_local, "depth", 0) or not _captures():
+            return method(collection, *args, **kwargs)
+
+        if method.__name__ == "aggregate":
+            arguments = {"pipeline": args[0] if args else kwargs.get("pipeline")}
+        else:
+            arguments = {"filter": args[0] if args else kwargs.get("filter")}
+            if command in ("update", "findAndModify") and len(args) > 1:
+                arguments["update"] = args[1]
+            arguments["projection"] = kwargs.get("projection")
+            arguments["sort"] = kwargs.get("sort")
+        _record(_describe(command, collection.name, arguments,
+                          collection.read_preference.mongos_mode, collection.write_concern.document))
+
+        _local.depth = 1
+        try:
+            return method(collection, *args, **kwargs)
+        finally:
+            _local.depth = 0
+
+    return wrapper
+
+
+def install():
+    """
+    Start capturing commands. Needs to be called before the database client is created.
+    """
+    global _installed  # pylint: disable=global-statement
+    if _installed:
+        return
+    _installed = True
+
+    monitoring.register(QueryListener())
+
+    try:
+        from mongomock.collection import Collection  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+
+    for name, command in MONGOMOCK_METHODS.items():
+        setattr(Collection, name, _wrap_mongomock_method(getattr(Collection, name), command))
+    logger.debug("Capturing mongomock commands for query budgets.")
@@ -0,0 +1,109 @@
+"""
+Test the auction archive.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.archive import archive_collection, archive_items, get_archived_item
+from tjts5901.models import READ_NOTIFICATION_TTL, Bid, Item, Notification, User
+
+
+@pytest.fixture
+def auctions(app: Flask, user: User):
+    """
+    An old closed item with bids, a recently closed item, and an open item.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        old = Item(title="Old", description="Closed long ago", starting_bid=10, seller=user,
+                   closes_at=now - timedelta(days=40), closed=True).save()
+        bids = [Bid(item=old, bidder=user, amount=amount, created_at=now - timedelta(days=41)).save()
+                for amount in (20, 30)]
+        old.winning_bid = bids[-1]
+        old.save()
+
+        recent = Item(title="Recent", description="Closed yesterday", starting_bid=10, seller=user,
+                      closes_at=now - timedelta(days=1), closed=True).save()
+        live = Item(title="Live", description="Still open", starting_bid=10, seller=user,
+                    closes_at=now + timedelta(days=1)).save()
+
+        yield {"old": old, "recent": recent, "live": live}
+
+        for item in (old, recent, live):
+            Bid.objects(item=item).delete()
+            item.delete()
+        archive_collection(Item).delete_many({})
+        archive_collection(Bid).delete_many({})
+
+
+def test_archive_items(app: Flask, auctions):
+    """
+    Test that only old closed items are moved into the archive, with their bids.
+    """
+    old = auctions["old"]
+    with app.app_context():
+        assert archive_items(timedelta(days=30), batch_size=1) == 1
+
+        assert Item.objects(id=old.id).first() is None
+        assert Bid.objects(item=old).count() == 0
+        assert Item.objects(id=auctions["recent"].id).first() is not None
+        assert Item.objects(id=auctions["live"].id).first() is not None
+
+        assert archive_collection(Item).find_one({"_id": old.id})["archived_at"]
+        assert archive_collection(Bid).count_documents({"item": old.id}) == 2
+
+        # Nothing left to archive.
+        assert archive_items(timedelta(days=30)) == 0
+
+
+def test_get_archived_item(app: Flask, auctions):
+    old = auctions["old"]
+    with app.app_context():
+        archive_items(timedelta(days=30))
+
+        item = get_archived_item(str(old.id))
+        assert item.title == "Old"
+        assert item.closed
+        assert item.winning_bid.amount == 30
+
+        assert get_archived_item(str(auctions["live"].id)) is None
+        assert get_archived_item("not-an-id") is None
+
+
+def test_view_archived_item(client: FlaskClient, app: Flask, auctions, currency_file):  # pylint: disable=unused-argument
+    """
+    Test that the item page falls back to the archive.
+    """
+    old = auctions["old"]
+    with app.app_context():
+        archive_items(timedelta(days=30))
+
+    response = client.get(f"/item/{old.id}")
+    assert response.status_code == 200
+    assert b"Closed long ago" in response.data
+
+    response = client.get("/item/000000000000000000000000")
+    assert response.status_code == 404
+
+
+def test_archive_command(app: Flask, auctions):
+    result = app.test_cli_runner().invoke(args=["archive-items", "--older-than-days", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Archived" in result.output
+
+    with app.app_context():
+        assert Item.objects(id=auctions["recent"].id).first() is None
+        assert Item.objects(id=auctions["live"].id).first() is not None
+
+
+def test_read_notification_ttl(app: Flask):
+    with app.app_context():
+        Notification.ensure_indexes()
+        indexes = Notification._get_collection().index_information()  # pylint: disable=protected-access
+
+    ttl = [index for index in indexes.values() if "expireAfterSeconds" in index]
+    assert [index["key"] for index in ttl] == [[("read_at", 1)]]
+    assert ttl[0]["expireAfterSeconds"] == READ_NOTIFICATION_TTL.total_seconds()
@@ -0,0 +1,256 @@
+"""
+Test the async bid API.
+"""
+import asyncio
+from datetime import datetime, timedelta
+import json
+import threading
+from urllib.parse import urlencode
+
+import pytest
+from bson import ObjectId
+from flask import Flask
+
+pytest.importorskip("asgiref")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def call(application, method: str, path: str, body: bytes = b"", headers=()):
+    """
+    Run a request through the ASGI application, and return the status and JSON body.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers],
+        "server": ("localhost.localdomain", 80),
+        "client": ("127.0.0.1", 12345),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+
+    status = sent[0]["status"]
+    content = b"".join(message.get("body", b"") for message in sent[1:])
+    return status, content
+
+
+@pytest.fixture
+def database():
+    return mongomock_motor.AsyncMongoMockClient()["test"]
+
+
+@pytest.fixture
+def seeded(database):
+    """
+    Seed a user, a token and an item into the async database.
+    """
+    user_id, item_id = ObjectId(), ObjectId()
+
+    async def seed():
+        await database.user.insert_one({"_id": user_id, "email": "bidder@example.com", "locale": "en_GB.UTF-8"})
+        await database.access_token.insert_one({"user": user_id, "token": "secret", "name": "test"})
+        await database.item.insert_one({
+            "_id": item_id,
+            "title": "Test item",
+            "seller": ObjectId(),
+            "starting_bid": 10,
+            "closes_at": datetime.utcnow() + timedelta(days=1),
+        })
+
+    asyncio.run(seed())
+    return user_id, item_id
+
+
+@pytest.fixture
+def application(app: Flask, database, monkeypatch):
+    from tjts5901.asgi import create_asgi_app
+    from tjts5901.ratelimit import MemoryBackend
+
+    # Rate limit buckets of the tests' own.
+    monkeypatch.setattr(app.extensions['ratelimit'], "backend", MemoryBackend())
+    return create_asgi_app(app, database)
+
+
+AUTH = [("Authorization", "Bearer secret")]
+
+
+def test_place_bid(application, database, seeded):
+    """
+    Test that bids are validated with the shared rules, and saved.
+    """
+    _, item_id = seeded
+    path = f"/api/async/items/{item_id}/bids"
+    form = [("Content-Type", "application/x-www-form-urlencoded")]
+
+    status, content = call(application, "POST", path, urlencode({"amount": 5}).encode(), AUTH + form)
+    assert status == 200
+    data = json.loads(content)
+    assert data["success"] is False
+    assert "at least" in data["error"]
+
+    status, content = call(application, "POST", path, json.dumps({"amount": 12}).encode(),
+                           AUTH + [("Content-Type", "application/json")])
+    assert json.loads(content)["success"] is True
+
+    # Next bid has to be higher than the winning bid.
+    status, content = call(application, "POST", path, urlencode({"amount": 12}).encode(), AUTH + form)
+    assert json.loads(content)["success"] is False
+
+    status, content = call(application, "POST", path, urlencode({"amount": "a lot"}).encode(), AUTH + form)
+    assert "Invalid value" in json.loads(content)["error"]
+
+    status, content = call(application, "GET", path, headers=AUTH)
+    assert status == 200
+    bids = json.loads(content)["bids"]
+    assert [bid["amount"] for bid in bids] == [12]
+    assert bids[0]["item"] == str(item_id)
+
+    async def seller_stats():
+        item = await database.item.find_one({"_id": item_id})
+        return await database.seller_stats.find_one({"_id": item["seller"]})
+
+    assert asyncio.run(seller_stats())["bids_received"] == 1
+
+
+def test_requires_token(application, seeded):
+    """
+    Test that the async API requires a valid access token.
+    """
+    _, item_id = seeded
+    path = f"/api/async/items/{item_id}/bids"
+
+    status, _ = call(application, "GET", path)
+    assert status == 401
+
+    status, _ = call(application, "GET", path, headers=[("Authorization", "Bearer wrong")])
+    assert status == 401
+
+    status, _ = call(application, "GET", f"/api/async/items/{ObjectId()}/bids", headers=AUTH)
+    assert status == 404
+
+
+def test_flask_fallback(application):
+    """
+    Test that other paths are served by the Flask application.
+    """
+    status, content = call(application, "GET", "/livez")
+    assert status == 200
+    assert json.loads(content) == {"status": "ok"}
+
+
+FORM = [("Content-Type", "application/x-www-form-urlencoded")]
+
+
+def test_rate_limited(application, app: Flask, seeded, monkeypatch):
+    """
+    Test that async bids go through the same rate limit as the sync API.
+    """
+    _, item_id = seeded
+    monkeypatch.setitem(app.config, "RATELIMIT_BID", "1/hour")
+    monkeypatch.setitem(app.config, "RATELIMIT_BID_BURST", 1)
+    path = f"/api/async/items/{item_id}/bids"
+
+    status, _ = call(application, "POST", path, urlencode({"amount": 12}).encode(), AUTH + FORM)
+    assert status == 200
+
+    status, content = call(application, "POST", path, urlencode({"amount": 20}).encode(), AUTH + FORM)
+    assert status == 429
+    assert json.loads(content)["success"] is False
+
+    # Reading the bids is not limited.
+    status, _ = call(application, "GET", path, headers=AUTH)
+    assert status == 200
+
+
+def test_outbid_notification(application, database, seeded, monkeypatch):
+    import tjts5901.asgi
+    sent = []
+    threads = []
+
+    def send(*args):
+        sent.append(args)
+        threads.append(threading.get_ident())
+    monkeypatch.setattr(tjts5901.asgi, "send_outbid_notification", send)
+
+    _, item_id = seeded
+    other = ObjectId()
+    asyncio.run(database.bid.insert_one({"item": item_id, "bidder": other, "amount": 15,
+                                         "created_at": datetime.utcnow()}))
+
+    status, content = call(application, "POST", f"/api/async/items/{item_id}/bids",
+                           urlencode({"amount": 20}).encode(), AUTH + FORM)
+    assert json.loads(content)["success"] is True
+    assert sent == [(other, "Test item", 20)]
+    # Enqueuing can block, so it's kept off the event loop.
+    assert threads != [threading.get_ident()]
+
+
+def test_concurrent_bid_is_validated_again(application, database, seeded, monkeypatch):
+    """
+    Test that a bid outbid between validation and the price update is rejected.
+    """
+    from tjts5901.asgi import AsyncBidAPI
+
+    _, item_id = seeded
+    original = AsyncBidAPI.get_winning_bid
+    calls = []
+
+    async def racing_winning_bid(self, item):
+        winning_bid = await original(self, item)
+        if not calls:
+            # Another bid gets in right after this one has been validated.
+            await database.bid.insert_one({"item": item_id, "bidder": ObjectId(), "amount": 50,
+                                           "created_at": datetime.utcnow()})
+            await database.item.update_one({"_id": item_id}, {"$set": {"price": 50}})
+        calls.append(item)
+        return winning_bid
+
+    monkeypatch.setattr(AsyncBidAPI, "get_winning_bid", racing_winning_bid)
+
+    status, content = call(application, "POST", f"/api/async/items/{item_id}/bids",
+                           urlencode({"amount": 20}).encode(), AUTH + FORM)
+    assert status == 200
+    assert "at least" in json.loads(content)["error"]
+    assert len(calls) == 2
+
+    item = asyncio.run(database.item.find_one({"_id": item_id}))
+    assert item["price"] == 50
+
+
+def test_pool_options(app: Flask, monkeypatch):
+    """
+    Test that the Motor client gets the same pool settings as the sync client.
+    """
+    import tjts5901.asgi
+    clients = []
+
+    class FakeClient:
+        def __init__(self, host, **options):
+            clients.append((host, options))
+
+        def get_default_database(self, default=None):
+            return mongomock_motor.AsyncMongoMockClient()[default]
+
+    monkeypatch.setattr(tjts5901.asgi, "AsyncIOMotorClient", FakeClient)
+    monkeypatch.setitem(app.config, "MONGO_MAX_POOL_SIZE", 50)
+    monkeypatch.setitem(app.config, "MONGO_WAIT_QUEUE_TIMEOUT_MS", 200)
+
+    tjts5901.asgi.create_asgi_app(app)
+    _host, options = clients[0]
+    assert options["maxPoolSize"] == 50
+    assert options["waitQueueTimeoutMS"] == 200
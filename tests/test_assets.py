@@ -0,0 +1,76 @@
+"""
+Test the static assets module.
+"""
+import gzip
+
+import pytest
+from flask import Flask, render_template_string
+
+from tjts5901.assets import init_assets, build_manifest
+
+
+@pytest.fixture
+def assets_app(tmp_path) -> Flask:
+    """
+    Flask application with its own static folder, and a built asset manifest.
+    """
+    static = tmp_path / "static"
+    (static / "fonts").mkdir(parents=True)
+    (static / "fonts" / "klingon.ttf").write_bytes(b"\0font" * 200)
+    (static / "style.css").write_text('@font-face { src: url("fonts/klingon.ttf"); }\n' * 20)
+
+    flask_app = Flask(__name__, static_folder=str(static))
+    flask_app.config["ASSETS_BUILD_DIR"] = str(tmp_path / "build")
+    build_manifest(flask_app.static_folder, flask_app.config["ASSETS_BUILD_DIR"])
+    init_assets(flask_app)
+
+    return flask_app
+
+
+def test_fingerprinted_url(assets_app: Flask):
+    """
+    Test that url_for() emits fingerprinted urls, and stylesheets refer to fingerprinted fonts.
+    """
+    manifest = assets_app.extensions["assets"]
+
+    with assets_app.test_request_context():
+        url = render_template_string("{{ url_for('static', filename='style.css') }}")
+
+    assert url == "/static/" + manifest.assets["style.css"]
+    assert url != "/static/style.css", "Url was not fingerprinted"
+
+    response = assets_app.test_client().get(url)
+    assert response.status_code == 200
+    assert manifest.assets["fonts/klingon.ttf"].encode() in response.data, "Font url was not rewritten"
+
+
+def test_immutable_caching(assets_app: Flask):
+    """
+    Test that fingerprinted assets are served with long-lived caching, and original ones are not.
+    """
+    client = assets_app.test_client()
+    hashed = assets_app.extensions["assets"].assets["style.css"]
+
+    response = client.get("/static/" + hashed)
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert response.mimetype == "text/css"
+
+    response = client.get("/static/style.css")
+    assert response.status_code == 200
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+
+
+def test_precompressed_variant(assets_app: Flask):
+    """
+    Test that a precompressed variant is served when the client accepts it.
+    """
+    client = assets_app.test_client()
+    hashed = assets_app.extensions["assets"].assets["style.css"]
+
+    plain = client.get("/static/" + hashed)
+    assert "Content-Encoding" not in plain.headers
+
+    response = client.get("/static/" + hashed, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
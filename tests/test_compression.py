@@ -0,0 +1,119 @@
+"""
+Test the response compression.
+"""
+import gzip
+import json
+
+import pytest
+from flask import Flask, Response, stream_with_context
+
+from tjts5901.compression import init_compression
+
+
+@pytest.fixture
+def compress_app() -> Flask:
+    """
+    Flask application with compression and a few test views.
+    """
+    flask_app = Flask(__name__)
+    init_compression(flask_app)
+
+    @flask_app.route("/large")
+    def large():
+        return "<p>Great Scott!</p>" * 100
+
+    @flask_app.route("/small")
+    def small():
+        return "<p>Great Scott!</p>"
+
+    @flask_app.route("/binary")
+    def binary():
+        return Response(b"\0" * 2000, mimetype="image/png")
+
+    @flask_app.route("/stream")
+    def stream():
+        def generate():
+            for i in range(100):
+                yield f'{{"amount": {i}}}\n'
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @flask_app.route("/export")
+    def export():
+        def generate():
+            for i in range(10000):
+                yield json.dumps({"id": f"{i:024x}", "item": "63f5e8a1c2", "amount": 100 + i}) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    return flask_app
+
+
+def test_compress_large_response(compress_app: Flask):
+    """
+    Test that large html responses are gzipped, when client accepts it.
+    """
+    client = compress_app.test_client()
+
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) < 1900
+    assert gzip.decompress(response.data) == b"<p>Great Scott!</p>" * 100
+
+    response = client.get("/large")
+    assert "Content-Encoding" not in response.headers
+
+
+@pytest.mark.parametrize("path", ["/small", "/binary"])
+def test_skip_compression(compress_app: Flask, path: str):
+    """
+    Test that small responses, and responses not in allowlist are passed as is.
+    """
+    response = compress_app.test_client().get(path, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress_stream(compress_app: Flask):
+    """
+    Test that generator responses are compressed, and stay streamed.
+    """
+    response = compress_app.test_client().get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.is_streamed
+    assert "Content-Length" not in response.headers
+
+    lines = gzip.decompress(response.data).decode().splitlines()
+    assert len(lines) == 100
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_stream_compresses_like_one_shot(compress_app: Flask, encoding: str):
+    """
+    Test that streaming a row per chunk compresses nearly as well as compressing the whole body.
+    """
+    from tjts5901.compression import brotli, compress  # pylint: disable=import-outside-toplevel
+    if encoding == "br" and brotli is None:
+        pytest.skip("brotli is not installed")
+
+    client = compress_app.test_client()
+    raw = client.get("/export").data
+    response = client.get("/export", headers={"Accept-Encoding": encoding})
+    assert response.headers["Content-Encoding"] == encoding
+
+    one_shot = compress(raw, encoding, compress_app.config["COMPRESS_LEVEL" if encoding == "gzip"
+                                                          else "COMPRESS_BR_LEVEL"])
+    assert len(response.data) < len(one_shot) * 1.1
+
+
+def test_blueprint_override(compress_app: Flask):
+    """
+    Test that compression can be disabled per blueprint.
+    """
+    from flask import Blueprint
+
+    bp = Blueprint("uncompressed", __name__)
+    bp.add_url_rule("/large", view_func=lambda: "<p>Great Scott!</p>" * 100)
+    compress_app.register_blueprint(bp, url_prefix="/uncompressed")
+    compress_app.config["COMPRESS_BLUEPRINTS"] = {"uncompressed": False}
+
+    response = compress_app.test_client().get("/uncompressed/large", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,201 @@
+"""
+Test the routing of reads and writes.
+
+Mongomock has no replica set, so the routing decisions are checked from the
+read preferences and write concerns captured by :class:`QueryCapture`.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from pymongo.read_preferences import Nearest, Primary, SecondaryPreferred
+
+from tjts5901 import create_app
+from tjts5901.db import SECONDARY_READS, db, init_db, read_preference, warm_pool, write_concern
+from tjts5901.items import handle_item_closing
+from tjts5901.models import AccessToken, Bid, Item, User
+
+from querybudget import QueryCapture
+
+
+@pytest.fixture
+def item(app: Flask, user: User):
+    with app.app_context():
+        item = Item(title="Routed", description="Routed item", starting_bid=10, seller=user,
+                    closes_at=datetime.utcnow() + timedelta(days=1)).save()
+        yield item
+        Bid.objects(item=item).delete()
+        item.delete()
+
+
+def reads(capture: QueryCapture, collection: str):
+    return {query.read_preference for query in capture.queries if query.collection == collection and not query.write}
+
+
+def test_read_preference(app: Flask, monkeypatch):
+    """
+    Test that only the listed endpoints read from the secondaries.
+    """
+    with app.app_context():
+        assert read_preference("items.index") == SecondaryPreferred(max_staleness=90)
+        assert read_preference("api_items.api_item_bids_export") == SecondaryPreferred(max_staleness=90)
+        assert read_preference("items.bid") == Primary()
+
+        # Outside of a request, eg. in background tasks.
+        assert read_preference() == Primary()
+
+        monkeypatch.setitem(app.config, "MONGO_READ_PREFERENCE", "nearest")
+        monkeypatch.setitem(app.config, "MONGO_MAX_STALENESS", 120)
+        assert read_preference("auth.profile") == Nearest(max_staleness=120)
+
+        monkeypatch.setitem(app.config, "MONGO_READ_PREFERENCE", "primary")
+        assert read_preference("auth.profile") == Primary()
+
+
+def test_request_read_preference(app: Flask):
+    """
+    Test that the endpoint defaults to the endpoint of the current request.
+    """
+    with app.test_request_context("/"):
+        assert read_preference() == SecondaryPreferred(max_staleness=90)
+    with app.test_request_context("/sell"):
+        assert read_preference() == Primary()
+
+
+def test_write_concern(app: Flask, monkeypatch):
+    with app.app_context():
+        assert write_concern() == {"w": "majority", "wtimeout": 5000}
+
+        monkeypatch.setitem(app.config, "MONGO_WRITE_CONCERN", "2")
+        assert write_concern()["w"] == 2
+
+
+def test_unknown_read_preference(monkeypatch):
+    monkeypatch.setenv("MONGO_READ_PREFERENCE", "secondaryOnly")
+    with pytest.raises(ValueError):
+        create_app({"TESTING": True})
+
+
+@pytest.fixture
+def token(app: Flask, user: User):
+    with app.app_context():
+        token = AccessToken(name="routing", user=user).save()
+        yield token
+        token.delete()
+
+
+def test_pool_options(monkeypatch):
+    """
+    Test that the pool settings are passed to the database client.
+    """
+    monkeypatch.setenv("MONGO_URL", "mongomock://localhost/pool")
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")
+    # Only the settings are checked, the test app is already connected.
+    monkeypatch.setattr(db, "init_app", lambda app: None)
+
+    app = Flask(__name__)
+    app.config["MONGO_MIN_POOL_SIZE"] = 2
+    init_db(app)
+
+    assert app.config["MONGO_MAX_POOL_SIZE"] == 20
+    assert app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"] is None
+
+    settings = app.config["MONGODB_SETTINGS"]
+    assert settings["maxPoolSize"] == 20
+    assert settings["minPoolSize"] == 2
+    assert settings["waitQueueTimeoutMS"] == 2000
+    assert "serverSelectionTimeoutMS" not in settings
+
+
+def test_pool_options_without_url(monkeypatch):
+    """
+    Test that the pool settings are applied without `MONGO_URL` too.
+    """
+    monkeypatch.delenv("MONGO_URL", raising=False)
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setattr(db, "init_app", lambda app: None)
+
+    app = Flask(__name__)
+    app.config["MONGODB_HOST"] = "mongomock://localhost/pool"
+    init_db(app)
+    assert app.config["MONGODB_SETTINGS"] == {"MONGODB_HOST": "mongomock://localhost/pool", "maxPoolSize": 20}
+
+    app = Flask(__name__)
+    app.config["MONGODB_SETTINGS"] = [{"host": "mongomock://localhost/one"},
+                                      {"host": "mongomock://localhost/two", "maxPoolSize": 5}]
+    init_db(app)
+    assert [settings["maxPoolSize"] for settings in app.config["MONGODB_SETTINGS"]] == [20, 5]
+
+
+def test_secondary_reads_example():
+    """
+    Test that the example in `dotenv` lists the default secondary read endpoints.
+    """
+    with open(Path(__file__).parents[1] / "dotenv", encoding="utf-8") as dotenv:
+        example = next(line for line in dotenv if line.startswith("#MONGO_SECONDARY_READS="))
+    assert example.strip().partition("=")[2].split(",") == list(SECONDARY_READS)
+
+
+def test_warm_pool(app: Flask, caplog):
+    with caplog.at_level("INFO", logger="tjts5901.db"):
+        warm_pool(app, 2)
+    assert "Warmed the database connection pool" in caplog.text
+
+
+def test_listing_reads_from_secondaries(client: FlaskClient, item, token,
+                                        currency_file):  # pylint: disable=unused-argument
+    """
+    Test that the listing and bid history read from the secondaries.
+    """
+    headers = {"Authorization": f"Bearer {token.token}"}
+    for path in (f"/api/items/{item.id}/bids", f"/api/items/{item.id}/bids/export"):
+        with QueryCapture() as capture:
+            response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        assert reads(capture, "bid") == {"secondaryPreferred"}
+
+    with QueryCapture() as capture:
+        response = client.get("/")
+    assert response.status_code == 200
+    assert reads(capture, "item") == {"secondaryPreferred"}
+
+
+def test_cli_export_reads_from_secondaries(app: Flask, item):
+    """
+    Test that the bid export command, run outside of a request, reads from the secondaries.
+    """
+    with QueryCapture() as capture:
+        result = app.test_cli_runner().invoke(args=["export-bids", "--item", str(item.id)])
+    assert result.exit_code == 0, result.output
+    assert reads(capture, "bid") == {"secondaryPreferred"}
+
+
+def test_bids_use_primary(client: FlaskClient, item, token):
+    """
+    Test that bidding reads from the primary, and writes with the majority write concern.
+    """
+    with QueryCapture() as capture:
+        response = client.post(f"/api/items/{item.id}/bids", headers={"Authorization": f"Bearer {token.token}"},
+                               data={"amount": 20})
+    assert response.json["success"] is True
+
+    assert reads(capture, "item") == {"primary"}
+    assert reads(capture, "bid") == {"primary"}
+    writes = {query.collection: query.write_concern for query in capture.writes}
+    assert writes["bid"]["w"] == "majority"
+    assert writes["item"]["w"] == "majority"
+
+
+def test_closing_uses_majority(app: Flask, item):
+    with app.app_context():
+        item.closes_at = datetime.utcnow() - timedelta(minutes=1)
+        item.save()
+
+        with QueryCapture() as capture:
+            handle_item_closing(item)
+
+    closing = [query for query in capture.writes if query.collection == "item"]
+    assert closing and all(query.write_concern["w"] == "majority" for query in closing)
@@ -0,0 +1,61 @@
+"""
+Test the health check endpoints.
+"""
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.health import HealthProber
+
+
+def test_server_info(client: FlaskClient):
+    """
+    Test that the server info is answered from the cached status.
+    """
+    response = client.get("/server-info", query_string={"ping": "Marty"})
+    assert response.status_code == 200
+    assert response.json["pong"] == "Marty"
+    assert "database_ping_ms" in response.json
+    assert response.json["checked_at"] is not None
+
+    first = response.json["checked_at"]
+    response = client.get("/server-info")
+    assert response.json["checked_at"] == first, "Status was not cached"
+
+
+def test_livez(client: FlaskClient):
+    """
+    Test that the liveness probe doesn't depend on the database.
+    """
+    response = client.get("/livez")
+    assert response.status_code == 200
+    assert response.json["status"] == "ok"
+
+
+def test_readyz_follows_database(app: Flask, monkeypatch):
+    """
+    Test that the readiness probe reports the database status.
+    """
+    prober = HealthProber(app)
+
+    monkeypatch.setattr("tjts5901.health.ping_database", lambda: True)
+    status = prober.refresh()
+    assert status.database_connectable
+    assert status.database_ping_ms is not None
+    assert prober.is_fresh()
+
+    def fail():
+        raise ConnectionError("Great Scott!")
+
+    monkeypatch.setattr("tjts5901.health.ping_database", fail)
+    status = prober.refresh()
+    assert not status.database_connectable
+    assert "Great Scott!" in status.error
+
+    monkeypatch.setitem(app.extensions, "health", prober)
+    prober.start()
+    try:
+        response = app.test_client().get("/readyz")
+        assert response.status_code == 503
+        assert response.json["status"] == "unavailable"
+    finally:
+        prober.stop()
@@ -0,0 +1,228 @@
+"""
+Test the item images.
+"""
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_babel import force_locale, gettext
+
+from tjts5901.images import THUMBNAIL_SIZES, get_bucket, item_image_url, make_thumbnails, sniff_content_type
+from tjts5901.models import Item, User
+
+# Smallest valid GIF, a single transparent pixel.
+GIF = (b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00"
+       b",\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;")
+
+
+
+
+def failing_save(*args, **kwargs):
+    raise RuntimeError("Database is down")
+
+
+def sell(client: FlaskClient, title: str, image: bytes, filename: str = "image.gif"):
+    return client.post("/sell", content_type="multipart/form-data", data={
+        "title": title, "description": "Item with an image", "starting_bid": "10",
+        "image": (BytesIO(image), filename),
+    })
+
+
+@pytest.fixture
+def item(app: Flask, user: User):
+    with app.app_context():
+        item = Item(title="Imaged", description="Item with an image", starting_bid=10, seller=user,
+                    closes_at=datetime.utcnow() + timedelta(days=1)).save()
+        yield item
+        item.reload()
+        item.delete()
+
+
+def test_sniff_content_type():
+    assert sniff_content_type(GIF) == "image/gif"
+    assert sniff_content_type(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(b"<svg xmlns=...") is None
+
+
+def test_sell_with_image(client: FlaskClient, login, app: Flask, user: User,
+                         currency_file):  # pylint: disable=unused-argument
+    """
+    Test that the uploaded image is stored in GridFS with the item.
+    """
+    login(user)
+    response = sell(client, "Item with an image", GIF)
+    assert response.status_code == 302
+
+    with app.app_context():
+        item = Item.objects.get(title="Item with an image")
+        assert item.image
+        assert get_bucket().open_download_stream(item.image).read() == GIF
+        item.delete()
+
+        # Images are deleted with the item.
+        assert not list(get_bucket().find({"_id": item.image}))
+
+
+@pytest.mark.parametrize("image, max_size, message", [
+    (b"not an image", None, "Image must be a JPEG, PNG, GIF or WebP file."),
+    (GIF, 16, "Image can be at most %(size)s MB."),
+])
+def test_sell_rejected_image(client: FlaskClient, login, app: Flask, user: User, monkeypatch,
+                             currency_file,  # pylint: disable=unused-argument
+                             image, max_size, message):
+    if max_size:
+        monkeypatch.setitem(app.config, "IMAGE_MAX_SIZE", max_size)
+
+    login(user)
+    with app.app_context():
+        files = len(list(get_bucket().find({})))
+
+    response = sell(client, "Rejected image", image)
+    assert response.status_code == 200
+    # Flashed messages are rendered as JSON.
+    with app.test_request_context(), force_locale(user.locale):
+        assert app.json.dumps(gettext(message, size=0)) in response.text
+
+    with app.app_context():
+        assert Item.objects(title="Rejected image").first() is None
+        # Partial uploads are cleaned up.
+        assert len(list(get_bucket().find({}))) == files
+
+
+def test_update_image(client: FlaskClient, login, app: Flask, user: User, item: Item):
+    """
+    Test that a new image replaces the old one, and its thumbnails.
+    """
+    login(user)
+    for _ in range(2):
+        response = client.post(f"/item/{item.id}/update", content_type="multipart/form-data",
+                               data={"title": item.title, "description": item.description,
+                                     "image": (BytesIO(GIF), "image.gif")})
+        assert response.status_code == 302
+
+    with app.app_context():
+        item.reload()
+        files = list(get_bucket().find({"metadata.item": item.id}))
+        assert item.image in [file._id for file in files]  # pylint: disable=protected-access
+        # Only the latest image, and its thumbnails if Pillow is installed.
+        assert len(files) in (1, 1 + len(THUMBNAIL_SIZES))
+
+
+def test_failed_update_keeps_image(client: FlaskClient, login, app: Flask, user: User, item: Item, monkeypatch):
+    """
+    Test that the old image is kept, and the new one deleted, if the item can't be saved.
+    """
+    with app.app_context():
+        item.image = get_bucket().upload_from_stream("image.gif", BytesIO(GIF),
+                                                     metadata={"item": item.id, "content_type": "image/gif"})
+        item.save()
+        files = len(list(get_bucket().find({})))
+
+    monkeypatch.setattr(Item, "save", failing_save)
+
+    login(user)
+    response = client.post(f"/item/{item.id}/update", content_type="multipart/form-data",
+                           data={"title": item.title, "description": item.description,
+                                 "image": (BytesIO(GIF), "image.gif")})
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert Item.objects.get(id=item.id).image == item.image
+        assert get_bucket().open_download_stream(item.image).read() == GIF
+        assert len(list(get_bucket().find({}))) == files
+
+
+def test_failed_sell_deletes_image(client: FlaskClient, login, app: Flask, user: User, monkeypatch,
+                                   currency_file):  # pylint: disable=unused-argument
+    monkeypatch.setattr(Item, "save", failing_save)
+
+    login(user)
+    with app.app_context():
+        files = len(list(get_bucket().find({})))
+
+    response = sell(client, "Unsaved image", GIF)
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert len(list(get_bucket().find({}))) == files
+
+
+def test_request_size_limit(client: FlaskClient, login, app: Flask, user: User, monkeypatch):
+    assert app.config["MAX_CONTENT_LENGTH"] == app.config["IMAGE_MAX_SIZE"] + 1024 * 1024
+
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 1024)
+    login(user)
+    response = sell(client, "Too large request", GIF + b"\0" * 2048)
+    assert response.status_code == 413
+
+
+def test_serve_image(client: FlaskClient, app: Flask, item: Item):
+    """
+    Test the caching headers, conditional requests and ranges of served images.
+    """
+    with app.test_request_context():
+        item.image = get_bucket().upload_from_stream("image.gif", BytesIO(GIF),
+                                                     metadata={"content_type": "image/gif"})
+        url = item_image_url(item)
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == GIF
+    assert response.mimetype == "image/gif"
+    assert response.headers["ETag"] == f'"{item.image}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+
+    response = client.get(url, headers={"If-None-Match": f'"{item.image}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = client.get(url, headers={"Range": "bytes=0-5"})
+    assert response.status_code == 206
+    assert response.data == b"GIF89a"
+    assert response.headers["Content-Range"] == f"bytes 0-5/{len(GIF)}"
+
+    assert client.get("/images/000000000000000000000000").status_code == 404
+    assert client.get("/images/not-an-id").status_code == 404
+
+
+def test_make_thumbnails(app: Flask, item: Item):
+    Image = pytest.importorskip("PIL.Image")  # pylint: disable=invalid-name
+
+    data = BytesIO()
+    Image.new("RGB", (1200, 600), "red").save(data, "PNG")
+    data.seek(0)
+
+    with app.app_context():
+        item.image = get_bucket().upload_from_stream("image.png", data, metadata={"content_type": "image/png"})
+        item.save()
+
+        make_thumbnails(str(item.id), str(item.image))
+
+        item.reload()
+        assert set(item.thumbnails) == set(THUMBNAIL_SIZES)
+        with Image.open(get_bucket().open_download_stream(item.thumbnails["small"])) as thumbnail:
+            assert thumbnail.format == "JPEG"
+            assert thumbnail.size == (160, 80)
+
+
+def test_item_image_url(app: Flask):
+    """
+    Test that the listing thumbnails don't fall back to the full image.
+    """
+    with app.test_request_context():
+        item = Item(title="No image")
+        assert item_image_url(item) is None
+        assert item_image_url(item, "medium") is None
+
+        item.image = "0" * 24
+        assert item_image_url(item, "medium") == f"/images/{'0' * 24}"
+        assert item_image_url(item, "small") is None
+
+        item.thumbnails = {"small": "1" * 24}
+        assert item_image_url(item, "small") == f"/images/{'1' * 24}"
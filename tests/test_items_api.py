@@ -0,0 +1,264 @@
+"""
+Test the items API.
+"""
+from datetime import datetime, timedelta
+import json
+
+import mongomock
+import pytest
+from bson import ObjectId
+from flask import Flask
+from flask.testing import FlaskClient
+from pymongo.errors import BulkWriteError
+
+from tjts5901 import items as items_module
+from tjts5901.models import AccessToken, Bid, Item, Notification, User
+
+
+@pytest.fixture
+def token(app: Flask, user: User):
+    """
+    Access token for the user.
+    """
+    with app.app_context():
+        token = AccessToken(name="test", user=user, token="test-batch-token")
+        token.save()
+        yield token
+        token.delete()
+
+
+@pytest.fixture
+def other_token(app: Flask, faker):
+    """
+    Access token for a second user.
+    """
+    with app.app_context():
+        other = User(email=faker.email(), password="x")
+        other.save()
+        token = AccessToken(name="test", user=other, token="test-other-token")
+        token.save()
+        yield token
+        token.delete()
+        other.delete()
+
+
+@pytest.fixture
+def items(app: Flask, user: User):
+    """
+    An open and a closed item.
+    """
+    with app.app_context():
+        open_item = Item(title="Open", description="Open item", starting_bid=10, seller=user,
+                         closes_at=datetime.utcnow() + timedelta(days=1))
+        closed_item = Item(title="Closed", description="Closed item", starting_bid=10, seller=user,
+                           closes_at=datetime.utcnow() - timedelta(days=1))
+        open_item.save()
+        closed_item.save()
+        Bid(item=open_item, bidder=user, amount=15).save()
+        open_item.update(price=15, top_bidder=user)
+
+        yield open_item, closed_item
+
+        Bid.objects(item__in=[open_item, closed_item]).delete()
+        open_item.delete()
+        closed_item.delete()
+
+
+def test_batch_bids(client: FlaskClient, token: AccessToken, items):
+    """
+    Test that a batch of bids is validated and placed per entry.
+    """
+    open_item, closed_item = items
+
+    response = client.post("/api/items/bids:batch",
+                           headers={"Authorization": f"Bearer {token.token}"},
+                           json={"bids": [
+                               {"item": str(open_item.id), "amount": 15},
+                               {"item": str(open_item.id), "amount": 16},
+                               {"item": str(open_item.id), "amount": 16},
+                               {"item": str(open_item.id), "amount": "lots"},
+                               {"item": str(closed_item.id), "amount": 100},
+                               {"item": str(ObjectId()), "amount": 100},
+                               {"item": "not-an-id", "amount": 100},
+                               {"amount": 100},
+                           ]})
+    assert response.status_code == 200
+
+    results = response.json["results"]
+    assert [result["success"] for result in results] == [False, True, False, False, False, False, False, False]
+    assert results[1]["bid"]["amount"] == 16
+
+    assert sorted(bid.amount for bid in Bid.objects(item=open_item)) == [15, 16]
+    assert Bid.objects(item=closed_item).count() == 0
+
+
+def test_batch_bids_failed_write(client: FlaskClient, app: Flask, items, user: User, other_token: AccessToken,
+                                 monkeypatch):
+    """
+    Test that bids that failed to be written don't send notifications.
+    """
+    open_item, _ = items
+
+    original = mongomock.collection.Collection.bulk_write
+
+    def failing_bulk_write(self, requests, *args, **kwargs):
+        if self.name != "bid":
+            return original(self, requests, *args, **kwargs)
+        original(self, requests[:1], *args, **kwargs)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "Write failed"}],
+                              "nInserted": 1})
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", failing_bulk_write)
+
+    response = client.post("/api/items/bids:batch", headers={"Authorization": f"Bearer {other_token.token}"},
+                           json={"bids": [{"item": str(open_item.id), "amount": 20},
+                                          {"item": str(open_item.id), "amount": 30}]})
+    assert [result["success"] for result in response.json["results"]] == [True, False]
+
+    with app.app_context():
+        outbid = Notification.objects(user=user)
+        assert outbid.count() == 1
+        assert "20" in outbid.first().message and "30" not in outbid.first().message
+        outbid.delete()
+
+
+def test_batch_bids_invalid(client: FlaskClient, token: AccessToken, app: Flask):
+    """
+    Test that malformed and oversized batches are rejected.
+    """
+    headers = {"Authorization": f"Bearer {token.token}"}
+
+    assert client.post("/api/items/bids:batch", headers=headers, json={}).status_code == 400
+
+    bids = [{"item": str(ObjectId()), "amount": 1}] * (app.config.get("BID_BATCH_MAX_SIZE", 100) + 1)
+    assert client.post("/api/items/bids:batch", headers=headers, json={"bids": bids}).status_code == 413
+
+
+def test_export_bids(client: FlaskClient, token: AccessToken, items, user: User):
+    """
+    Test that the item bids are streamed as NDJSON and CSV.
+    """
+    open_item, _ = items
+    headers = {"Authorization": f"Bearer {token.token}"}
+
+    response = client.get(f"/api/items/{open_item.id}/bids/export", headers=headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 1
+    assert rows[0]["amount"] == 15
+    assert rows[0]["bidder"] == str(user.id)
+    assert set(rows[0]) == {"amount", "created_at", "bidder"}
+
+    response = client.get(f"/api/items/{open_item.id}/bids/export?format=csv&fields=amount,item",
+                          headers=headers)
+    assert response.mimetype == "text/csv"
+    assert response.get_data(as_text=True).splitlines() == ["amount,item", f"15,{open_item.id}"]
+
+    response = client.get(f"/api/items/{open_item.id}/bids/export?fields=password", headers=headers)
+    assert response.status_code == 400
+
+
+def test_export_bids_cli(app: Flask, items):
+    """
+    Test the `flask export-bids` command.
+    """
+    open_item, _ = items
+
+    result = app.test_cli_runner().invoke(args=["export-bids", "--item", str(open_item.id), "--fields", "amount"])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.output.splitlines()] == [{"amount": 15}]
+
+
+def test_export_bids_cli_invalid_item(app: Flask):
+    """
+    Test that `flask export-bids` rejects an invalid item id.
+    """
+    result = app.test_cli_runner().invoke(args=["export-bids", "--item", "not-an-id"])
+    assert result.exit_code == 2
+    assert "Invalid value for --item: Not an item id: not-an-id" in result.output
+
+
+def test_item_bids(client: FlaskClient, token: AccessToken, items, user: User):
+    """
+    Test that the bids are returned as objects.
+    """
+    open_item, _ = items
+
+    response = client.get(f"/api/items/{open_item.id}/bids", headers={"Authorization": f"Bearer {token.token}"})
+    assert response.status_code == 200
+
+    bids = response.json["bids"]
+    assert len(bids) == 1
+    assert bids[0]["amount"] == 15
+    assert bids[0]["bidder"] == str(user.id)
+    assert bids[0]["item"] == str(open_item.id)
+
+
+def test_outbid_notification(client: FlaskClient, other_token: AccessToken, items, user: User):
+    """
+    Test that the previous top bidder is notified when outbid.
+    """
+    open_item, _ = items
+    Notification.objects(user=user).delete()
+
+    response = client.post(f"/api/items/{open_item.id}/bids",
+                           headers={"Authorization": f"Bearer {other_token.token}"},
+                           data={"amount": 20})
+    assert response.json["success"] is True
+
+    notifications = Notification.objects(user=user)
+    assert notifications.count() == 1
+    assert open_item.title in notifications.first().message
+    assert "20" in notifications.first().message
+
+    # Outbidding yourself doesn't notify.
+    response = client.post(f"/api/items/{open_item.id}/bids",
+                           headers={"Authorization": f"Bearer {other_token.token}"},
+                           data={"amount": 25})
+    assert response.json["success"] is True
+    assert Notification.objects(user=other_token.user).count() == 0
+    assert Notification.objects(user=user).count() == 1
+
+
+def test_concurrent_bids_notify_displaced_bidder(client: FlaskClient, app: Flask, other_token: AccessToken,
+                                                 items, user: User, faker):
+    """
+    Test that of two bids validated against the same top bid, each displaced bidder is notified once.
+    """
+    open_item, _ = items
+    with app.app_context():
+        third = User(email=faker.unique.email(), password="x").save()
+    Notification.objects(user__in=[user, other_token.user, third]).delete()
+
+    # A higher bid gets in right after the other user's bid has been validated.
+    original = items_module.raise_item_price
+    displaced = []
+
+    def racing_raise_item_price(item_id, amount, bidder_id):
+        if bidder_id == other_token.user.id:
+            with app.app_context():
+                Bid(item=open_item, bidder=third, amount=40).save()
+                # The third user's request notifies the bidder it displaced.
+                displaced.append(original(item_id, 40, third.id)["top_bidder"])
+        return original(item_id, amount, bidder_id)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(items_module, "raise_item_price", racing_raise_item_price)
+        response = client.post(f"/api/items/{open_item.id}/bids",
+                               headers={"Authorization": f"Bearer {other_token.token}"}, data={"amount": 30})
+    assert response.json["success"] is True
+
+    with app.app_context():
+        assert Item.objects.get(id=open_item.id).price == 40
+        assert Item.objects.get(id=open_item.id).top_bidder == third
+        # The original top bidder was displaced by the higher bid only, and the other user's bid was outbid.
+        assert displaced == [user.id]
+        assert Notification.objects(user=user).count() == 0
+        assert Notification.objects(user=other_token.user).count() == 1
+        assert "40" in Notification.objects(user=other_token.user).first().message
+        assert Notification.objects(user=third).count() == 0
+
+        Notification.objects(user=other_token.user).delete()
+        third.delete()
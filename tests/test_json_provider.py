@@ -0,0 +1,89 @@
+"""
+Test the JSON provider.
+"""
+from datetime import datetime
+from decimal import Decimal
+import json
+
+import pytest
+from bson import ObjectId
+from flask import Flask, render_template_string
+from flask_babel import lazy_gettext
+
+from tjts5901.json_provider import FastJSONProvider, orjson
+from tjts5901.models import Bid, Item, User
+
+
+@pytest.fixture(params=[
+    pytest.param(True, id="orjson", marks=pytest.mark.skipif(orjson is None, reason="orjson is not installed")),
+    pytest.param(False, id="stdlib"),
+])
+def provider(request, app: Flask):
+    return FastJSONProvider(app, use_orjson=request.param)
+
+
+def test_encode_types(provider: FastJSONProvider, app: Flask):
+    """
+    Test that both backends encode the extra types the same way.
+    """
+    oid = ObjectId()
+    payload = {
+        "id": oid,
+        "naive": datetime(2023, 3, 1, 12, 30, 15, 500),
+        "price": Decimal("10.50"),
+        "message": lazy_gettext("Message"),
+        "text": "Hyvää päivää",
+    }
+
+    with app.test_request_context():
+        data = json.loads(provider.dumps(payload))
+
+    assert data == {
+        "id": str(oid),
+        "naive": "2023-03-01T12:30:15.000500+00:00",
+        "price": "10.50",
+        "message": "Message",
+        "text": "Hyvää päivää",
+    }
+
+
+def test_encode_document(provider: FastJSONProvider):
+    """
+    Test that documents are encoded with field names, and references as ids.
+    """
+    bidder, item = User(id=ObjectId()), Item(id=ObjectId())
+    bid = Bid(id=ObjectId(), amount=10, bidder=bidder, item=item, created_at=datetime(2023, 3, 1))
+
+    data = json.loads(provider.dumps({"bids": [bid]}))
+
+    assert data["bids"] == [{
+        "id": str(bid.id),
+        "amount": 10,
+        "bidder": str(bidder.id),
+        "item": str(item.id),
+        "created_at": "2023-03-01T00:00:00+00:00",
+    }]
+
+
+def test_response(provider: FastJSONProvider, app: Flask):
+    """
+    Test that responses are compact JSON.
+    """
+    with app.app_context():
+        response = provider.response(success=True)
+
+    assert response.mimetype == "application/json"
+    assert response.get_data() == b'{"success":true}\n'
+
+
+def test_tojson_filter(app: Flask):
+    """
+    Test that the `tojson` template filter goes through the application's provider.
+    """
+    assert isinstance(app.json, FastJSONProvider)
+    assert app.jinja_env.policies["json.dumps_function"] == app.json.dumps
+
+    with app.app_context():
+        rendered = render_template_string("{{ value|tojson }}", value={"id": ObjectId("0" * 24), "tag": "<b>"})
+    assert json.loads(rendered) == {"id": "0" * 24, "tag": "<b>"}
+    assert "<" not in rendered
@@ -0,0 +1,149 @@
+"""
+Test the logging module.
+"""
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import queue
+
+import pytest
+import sentry_sdk
+from sentry_sdk.transport import Transport
+
+from flask import Flask
+
+from tjts5901.logging import (
+    DEFAULT_TRACES_SAMPLE_RULES,
+    DroppingQueueHandler,
+    JsonFormatter,
+    TracesSampler,
+)
+
+
+def _sampler() -> TracesSampler:
+    flask_app = Flask(__name__)
+    flask_app.config.update(
+        SENTRY_TRACES_SAMPLE_RATE=1.0,
+        SENTRY_TRACES_KEEP_RATE=0.0,
+        SENTRY_TRACES_SLOW_THRESHOLD=1.0,
+        SENTRY_TRACES_SAMPLE_RULES=DEFAULT_TRACES_SAMPLE_RULES,
+    )
+    return TracesSampler(flask_app)
+
+
+def _transaction(sampler: TracesSampler, duration: float, status: str = "ok") -> bool:
+    """
+    Finish a transaction through a Sentry client, and return whether it was sent.
+
+    The client serializes the event before `before_send_transaction`, like in production.
+    """
+    sent = []
+
+    class CaptureTransport(Transport):
+        def capture_envelope(self, envelope):
+            sent.append(envelope)
+
+    client = sentry_sdk.Client(dsn="https://key@sentry.invalid/1", traces_sample_rate=1.0,
+                               before_send_transaction=sampler.before_send_transaction,
+                               transport=CaptureTransport)
+    with sentry_sdk.isolation_scope() as scope:
+        scope.set_client(client)
+        now = datetime.now(timezone.utc)
+        transaction = sentry_sdk.start_transaction(name="/item/<id>", op="http.server",
+                                                   start_timestamp=now - timedelta(seconds=duration))
+        transaction.set_status(status)
+        transaction.finish(end_timestamp=now)
+    client.close()
+    return bool(sent)
+
+
+def test_traces_sampler_rules():
+    """
+    Test that the sample rate is picked by the path prefix, and rules are reloaded from config.
+    """
+    sampler = _sampler()
+
+    assert sampler({"wsgi_environ": {"PATH_INFO": "/item/123"}}) == 1.0
+    assert sampler({"wsgi_environ": {"PATH_INFO": "/static/style.css"}}) == 0.001
+    assert sampler({"wsgi_environ": {"PATH_INFO": "/notifications.json"}}) == 0.01
+    assert sampler({"wsgi_environ": {"PATH_INFO": "/static/"}, "parent_sampled": True}) == 1.0
+
+    sampler.app.config["SENTRY_TRACES_SAMPLE_RULES"] = {"/item/": 0.5}
+    assert sampler({"wsgi_environ": {"PATH_INFO": "/item/123"}}) == 0.5
+
+
+def test_traces_sampler_keeps_slow_and_errors():
+    """
+    Test that error and slow transactions are kept, and fast ones are sampled.
+    """
+    sampler = _sampler()
+
+    assert not _transaction(sampler, 0.01)
+    assert _transaction(sampler, 2.0)
+    assert _transaction(sampler, 0.01, "internal_error")
+
+    # Timestamps not serialized yet.
+    now = datetime.utcnow()
+    event = {"start_timestamp": now - timedelta(seconds=2), "timestamp": now}
+    assert sampler.before_send_transaction(event, {}) is event
+
+
+def test_queue_handler_drops_on_overload():
+    """
+    Test that the queue handler drops records instead of blocking when the queue is full.
+    """
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger("tjts5901.tests.queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    logger.warning("Bid placed: %s", 100)
+    logger.warning("Bid placed: %s", 200)
+
+    assert handler.dropped == 1
+    record = handler.queue.get_nowait()
+    assert record.msg == "Bid placed: 100", "Arguments were not merged into the message"
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Needs os.fork()")
+def test_queue_listener_runs_in_forked_process(tmp_path):
+    """
+    Test that records logged in a forked process are written, like in preloaded gunicorn workers.
+    """
+    target = logging.FileHandler(tmp_path / "log.txt")
+    handler = DroppingQueueHandler(queue.Queue(maxsize=100), target)
+    logger = logging.getLogger("tjts5901.tests.fork")
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    # Starts the listener in the parent, as creating the app does.
+    logger.warning("Parent record")
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            logger.warning("Child record")
+            handler.stop()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+
+    os.waitpid(pid, 0)
+    handler.stop()
+    target.close()
+
+    lines = (tmp_path / "log.txt").read_text().splitlines()
+    assert sorted(lines) == ["Child record", "Parent record"]
+
+
+def test_json_formatter():
+    """
+    Test that the JSON formatter includes the `extra` fields.
+    """
+    record = logging.LogRecord("tjts5901", logging.INFO, __file__, 1, "Closing item %s", ("abc",), None)
+    record.item_id = "abc"
+
+    data = json.loads(JsonFormatter().format(record))
+    assert data["message"] == "Closing item abc"
+    assert data["level"] == "INFO"
+    assert data["item_id"] == "abc"
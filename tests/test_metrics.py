@@ -0,0 +1,114 @@
+"""
+Test the metrics module.
+"""
+from types import SimpleNamespace
+
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.metrics import (
+    CommandMetricsListener,
+    MetricsRegistry,
+    PoolMetricsListener,
+    registry,
+)
+
+
+def test_histogram_rendering():
+    """
+    Test that histograms are rendered in cumulative Prometheus format.
+    """
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("test_seconds", "Test histogram.", ["endpoint"], buckets=(0.1, 1))
+    histogram.labels("index").observe(0.05)
+    histogram.labels("index").observe(0.5)
+    histogram.labels(endpoint="index").observe(5)
+
+    text = metrics.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{endpoint="index",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{endpoint="index",le="1"} 2' in text
+    assert 'test_seconds_bucket{endpoint="index",le="+Inf"} 3' in text
+    assert 'test_seconds_count{endpoint="index"} 3' in text
+    assert 'test_seconds_sum{endpoint="index"} 5.55' in text
+
+
+def test_gauge_rendering():
+    metrics = MetricsRegistry()
+    gauge = metrics.gauge("test_connections", "Test gauge.", ["state"])
+    gauge.labels("open").inc(3)
+    gauge.labels("open").dec()
+    gauge.labels("checked_out").set(1)
+
+    text = metrics.render()
+    assert "# TYPE test_connections gauge" in text
+    assert 'test_connections{state="open"} 2' in text
+    assert 'test_connections{state="checked_out"} 1' in text
+
+
+def test_request_metrics(client: FlaskClient):
+    """
+    Test that request latency and template render time are exposed at /metrics.
+    """
+    client.get("/hello")
+    client.get("/")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    text = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="hello",method="GET",status="200"}' in text
+    assert 'template_render_duration_seconds_count{template="items/index.html"}' in text
+
+
+def test_mongodb_command_metrics(app: Flask):
+    """
+    Test that the command listener adds commands into the request totals.
+    """
+    listener = CommandMetricsListener()
+    event = SimpleNamespace(command_name="find", duration_micros=1500)
+
+    with app.test_request_context("/_404"):
+        app.preprocess_request()
+        listener.succeeded(event)
+        listener.succeeded(event)
+        app.process_response(app.response_class())
+
+    commands = registry.get("http_request_mongodb_commands").labels("<unmatched>")
+    assert commands.counts[commands.buckets.index(2)] >= 1, "Request command count was not recorded"
+    assert registry.get("mongodb_command_duration_seconds").labels("find", "ok").sum >= 0.003
+
+
+def test_mongodb_pool_metrics(app: Flask):
+    """
+    Test that the pool listener records the checkout waits and pool utilization.
+    """
+    listener = PoolMetricsListener()
+    address = ("pool-test", 27017)
+    event = SimpleNamespace(address=address)
+
+    listener.pool_created(SimpleNamespace(address=address, options={"maxPoolSize": 4}))
+    listener.connection_created(event)
+
+    with app.test_request_context("/_404"):
+        app.preprocess_request()
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        app.process_response(app.response_class())
+
+    listener.connection_check_out_started(event)
+    listener.connection_check_out_failed(SimpleNamespace(address=address, reason="timeout"))
+
+    assert registry.get("mongodb_pool_max_size").labels("pool-test:27017").value == 4
+    assert registry.get("mongodb_pool_connections").labels("pool-test:27017", "open").value == 1
+    assert registry.get("mongodb_pool_connections").labels("pool-test:27017", "checked_out").value == 2
+    assert registry.get("mongodb_pool_utilization").labels("pool-test:27017").value == 0.5
+    assert sum(registry.get("mongodb_pool_checkout_wait_seconds").labels("pool-test:27017", "ok").counts) == 2
+    assert sum(registry.get("mongodb_pool_checkout_wait_seconds").labels("pool-test:27017", "timeout").counts) == 1
+    assert sum(registry.get("http_request_mongodb_pool_wait_seconds").labels("<unmatched>").counts) >= 1
+
+    listener.connection_checked_in(event)
+    assert registry.get("mongodb_pool_utilization").labels("pool-test:27017").value == 0.25
@@ -0,0 +1,227 @@
+"""
+Query budgets for the routes.
+
+Every route in the `items`, `auth` and `notification` blueprints has a
+budget for the MongoDB commands it may run. When a change adds queries to a
+route, eg. dereferencing `item.seller` for every row in a template, the test
+fails and lists the commands run. If the new queries are needed, raise the
+budget in :data:`BUDGETS`.
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.security import generate_password_hash
+
+from tjts5901.models import AccessToken, Bid, Item, Notification, User, Watch
+from tjts5901.rankings import refresh_rankings
+from tjts5901.watchlist import watch_item
+
+from querybudget import QueryBudget, QueryBudgetExceeded, QueryCapture, QueryListener
+
+BLUEPRINTS = ("items", "api_items", "auth", "notification")
+
+SECONDS = 2.0
+"Latency budget for requests. Generous, to catch only pathological slowdowns."
+
+PASSWORD = "budget-password"
+PASSWORD_HASH = generate_password_hash(PASSWORD)
+
+BUDGETS = {
+    # endpoint, method: (queries, writes)
+    #
+    # Pages rendering the base template mark the user's notifications as read,
+    # which is one write. Background tasks run eagerly in tests, so eg. outbid
+    # notifications are included in the bid routes. With mongomock, search
+    # builds its in-memory index on the first search, which is one query.
+    # Listing, bidding on and deleting items updates the seller statistics,
+    # which is one write. The front page reads the items ending soon from
+    # their ranking, which is one query. The bid item is watched, so the bid
+    # routes include notifying its watchers, and deleting an item counts its
+    # watches.
+    ("items.index", "GET"): (5, 0),
+    ("items.ranking", "GET"): (1, 0),
+    ("items.view", "GET"): (8, 1),
+    ("items.search", "GET"): (2, 0),
+    ("items.sell", "GET"): (3, 1),
+    ("items.sell", "POST"): (3, 2),
+    ("items.update", "GET"): (5, 1),
+    ("items.update", "POST"): (4, 1),
+    ("items.delete", "POST"): (9, 2),
+    ("items.bid", "POST"): (13, 6),
+    ("items.watch", "POST"): (4, 2),
+    ("items.unwatch", "POST"): (4, 2),
+    ("api_items.api_search", "GET"): (2, 0),
+    ("api_items.api_ranking", "GET"): (1, 0),
+    ("api_items.api_item_bids", "GET"): (5, 1),
+    ("api_items.api_item_bids_export", "GET"): (5, 1),
+    ("api_items.api_item_place_bid", "POST"): (15, 7),
+    ("api_items.api_place_bids_batch", "POST"): (19, 9),
+    ("auth.register", "GET"): (0, 0),
+    ("auth.register", "POST"): (1, 1),
+    ("auth.login", "GET"): (0, 0),
+    ("auth.login", "POST"): (1, 0),
+    ("auth.logout", "GET"): (1, 0),
+    ("auth.profile", "GET"): (9, 1),
+    ("auth.user_access_tokens", "GET"): (5, 1),
+    ("auth.user_access_tokens", "POST"): (6, 2),
+    ("auth.delete_user_access_token", "POST"): (4, 1),
+    ("notification.user_notifications", "GET"): (3, 1),
+}
+"Maximum number of MongoDB commands, and writes, per route."
+
+
+@pytest.fixture
+def data(app: Flask, faker, currency_file):  # pylint: disable=unused-argument
+    """
+    A full page of items from different sellers, with bids from different bidders.
+    """
+    with app.app_context():
+        users = [User(email=faker.unique.email(), password=PASSWORD_HASH,
+                      locale="en_GB.UTF-8").save() for _ in range(4)]
+        user = users[0]
+        token = AccessToken(name="budget", user=user).save()
+        closes_at = datetime.utcnow() + timedelta(days=1)
+
+        items = []
+        for i in range(12):
+            item = Item(title=faker.sentence(nb_words=3), description=faker.sentence(),
+                        starting_bid=10, seller=users[i % len(users)], closes_at=closes_at).save()
+            for amount, bidder in enumerate(users[1:], start=20):
+                Bid(item=item, bidder=bidder, amount=amount).save()
+            items.append(item)
+
+        Notification(user=user, message="Hello", title="Hello").save()
+        watch_item(items[1], users[2])
+        refresh_rankings()
+
+        yield SimpleNamespace(user=user, token=token, own_item=items[0], other_item=items[1], items=items,
+                              word=items[1].title.split()[0].strip("."))
+
+        Bid.objects(item__in=items).delete()
+        Watch.objects(item__in=items).delete()
+        Item.objects(seller__in=users).delete()
+        for other in users:
+            other.delete()
+
+
+
+# endpoint, method, path, login, request arguments
+ROUTES = [
+    ("items.index", "GET", lambda d: "/", False, {}),
+    ("items.index", "GET", lambda d: "/items/2", False, {}),
+    ("items.view", "GET", lambda d: f"/item/{d.other_item.id}", True, {}),
+    ("items.search", "GET", lambda d: f"/search?q={d.word}&status=open&max_price=100", False, {}),
+    ("items.search", "GET", lambda d: "/search?status=open&max_price=100", False, {}),
+    ("items.ranking", "GET", lambda d: "/rankings/trending", False, {}),
+    ("items.sell", "GET", lambda d: "/sell", True, {}),
+    ("items.sell", "POST", lambda d: "/sell", True,
+     {"data": {"title": "New", "description": "New item", "starting_bid": "10"}}),
+    ("items.update", "GET", lambda d: f"/item/{d.own_item.id}/update", True, {}),
+    ("items.update", "POST", lambda d: f"/item/{d.own_item.id}/update", True,
+     {"data": {"title": "Updated", "description": "Updated item"}}),
+    ("items.delete", "POST", lambda d: f"/item/{d.own_item.id}/delete", True, {}),
+    ("items.bid", "POST", lambda d: f"/item/{d.other_item.id}/bid", True, {"data": {"amount": "100"}}),
+    ("items.watch", "POST", lambda d: f"/item/{d.other_item.id}/watch", True, {}),
+    ("items.unwatch", "POST", lambda d: f"/item/{d.other_item.id}/unwatch", True, {}),
+    ("api_items.api_search", "GET", lambda d: f"/api/items/search?q={d.word}&min_price=10", False, {}),
+    ("api_items.api_ranking", "GET", lambda d: "/api/items/rankings/ending-soon", False, {}),
+    ("api_items.api_item_bids", "GET", lambda d: f"/api/items/{d.other_item.id}/bids", False, {}),
+    ("api_items.api_item_bids_export", "GET", lambda d: f"/api/items/{d.other_item.id}/bids/export", False, {}),
+    ("api_items.api_item_place_bid", "POST", lambda d: f"/api/items/{d.other_item.id}/bids", False,
+     {"data": {"amount": "100"}}),
+    ("api_items.api_place_bids_batch", "POST", lambda d: "/api/items/bids:batch", False,
+     {"json_items": True}),
+    ("auth.register", "GET", lambda d: "/auth/register", False, {}),
+    ("auth.register", "POST", lambda d: "/auth/register", False,
+     {"data": {"email": "budget-new@example.com", "password": "x", "password2": "x", "terms": "on"}}),
+    ("auth.login", "GET", lambda d: "/auth/login", False, {}),
+    ("auth.login", "POST", lambda d: "/auth/login", False, {"credentials": True}),
+    ("auth.logout", "GET", lambda d: "/auth/logout", True, {}),
+    ("auth.profile", "GET", lambda d: "/auth/profile", True, {}),
+    ("auth.profile", "GET", lambda d: f"/auth/profile/{d.user.email}", True, {}),
+    ("auth.user_access_tokens", "GET", lambda d: "/auth/profile/me/token", True, {}),
+    ("auth.user_access_tokens", "POST", lambda d: "/auth/profile/me/token", True, {"data": {"name": "New"}}),
+    ("auth.delete_user_access_token", "POST", lambda d: f"/auth/profile/{d.user.email}/token/{d.token.id}",
+     True, {}),
+    ("notification.user_notifications", "GET", lambda d: "/notifications.json", True, {}),
+]
+
+
+def test_all_routes_have_budgets(app: Flask):
+    """
+    Test that every route in the checked blueprints has a budget, and is requested.
+    """
+    routes = {
+        (rule.endpoint, method)
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint.split(".")[0] in BLUEPRINTS
+        for method in rule.methods - {"HEAD", "OPTIONS"}
+    }
+    assert routes <= set(BUDGETS), f"Routes without a budget: {sorted(routes - set(BUDGETS))}"
+    assert routes <= {(endpoint, method) for endpoint, method, *_ in ROUTES}
+
+
+@pytest.mark.parametrize("endpoint, method, path, logged_in, kwargs", ROUTES,
+                         ids=[f"{method} {endpoint}" for endpoint, method, *_ in ROUTES])
+def test_route_query_budget(client: FlaskClient, login, query_budget, data, endpoint, method, path, logged_in, kwargs):
+    """
+    Test that the route stays within its query budget.
+    """
+    if logged_in:
+        login(data.user)
+
+    kwargs = dict(kwargs)
+    headers = {}
+    if endpoint.startswith("api_items."):
+        headers["Authorization"] = f"Bearer {data.token.token}"
+    if kwargs.pop("json_items", False):
+        kwargs["json"] = {"bids": [{"item": str(item.id), "amount": 100} for item in data.items[1:4]]}
+    if kwargs.pop("credentials", False):
+        kwargs["data"] = {"email": data.user.email, "password": PASSWORD}
+
+    queries, writes = BUDGETS[endpoint, method]
+    with query_budget(queries=queries, writes=writes, seconds=SECONDS, name=f"{method} {endpoint}"):
+        response = client.open(path(data), method=method, headers=headers, **kwargs)
+
+    assert response.status_code < 400, response.get_data(as_text=True)
+
+
+def test_budget_lists_queries(app: Flask):
+    """
+    Test that an exceeded budget lists the queries by shape.
+    """
+    with app.app_context():
+        with pytest.raises(QueryBudgetExceeded) as excinfo:
+            with QueryBudget(queries=1, name="lookup"):
+                User.objects(email="first@example.com").first()
+                User.objects(email="second@example.com").first()
+
+    message = str(excinfo.value)
+    assert "lookup exceeded its budget: 2 queries, budget is 1" in message
+    assert '2x find user {"filter": {"email": "?"}}' in message
+
+
+def test_command_listener():
+    """
+    Test that pymongo command events are captured by shape, without the maintenance commands.
+    """
+    listener = QueryListener()
+
+    def event(command_name, **command):
+        return SimpleNamespace(command_name=command_name, command={command_name: "item", **command})
+
+    with QueryCapture() as capture:
+        listener.started(event("find", filter={"_id": ObjectId()}, sort={"closes_at": -1}, limit=10))
+        listener.started(event("update", updates=[{"q": {"_id": ObjectId()}, "u": {"$set": {"closed": True}}}]))
+        listener.started(event("createIndexes", indexes=[]))
+
+    assert [str(query) for query in capture.queries] == [
+        'find item {"filter": {"_id": "?"}, "sort": {"closes_at": -1}}',
+        'update item {"updates": [{"q": {"_id": "?"}, "u": {"$set": {"closed": "?"}}}]}',
+    ]
+    assert len(capture.writes) == 1
@@ -0,0 +1,123 @@
+"""
+Test the item rankings.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.models import Bid, Item, Ranking, User
+from tjts5901.rankings import get_ranking, refresh_rankings
+
+
+
+@pytest.fixture
+def items(app: Flask, user: User):
+    """
+    Open items closing in a few minutes, with high prices and recent bids, and a closed one.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        items = {}
+        for name, minutes, price, bids in (("first", 1, 2_000_000, 1), ("second", 2, 3_000_000, 3),
+                                           ("third", 3, 1_000_000, 2)):
+            item = Item(title=f"Ranked {name}", description="Ranked item", starting_bid=10, seller=user,
+                        closes_at=now + timedelta(minutes=minutes), price=price).save()
+            for _ in range(bids):
+                Bid(item=item, bidder=user, amount=price).save()
+            # Old bids are not trending.
+            Bid(item=item, bidder=user, amount=10, created_at=now - timedelta(days=1)).save()
+            items[name] = item
+
+        closed = Item(title="Ranked closed", description="Ranked item", starting_bid=10, seller=user,
+                      closes_at=now + timedelta(seconds=30), price=5_000_000, closed=True).save()
+        for _ in range(10):
+            Bid(item=closed, bidder=user, amount=10).save()
+        items["closed"] = closed
+
+        yield items
+
+        for item in items.values():
+            Bid.objects(item=item).delete()
+            item.delete()
+        Ranking.objects.delete()
+
+
+def titles(entries, items) -> list:
+    ids = {item.id: name for name, item in items.items()}
+    return [ids[entry["id"]] for entry in entries if entry["id"] in ids]
+
+
+def test_refresh_rankings(app: Flask, items):
+    with app.app_context():
+        refresh_rankings()
+
+        assert titles(get_ranking("ending-soon"), items) == ["first", "second", "third"]
+        assert titles(get_ranking("highest-price"), items) == ["second", "first", "third"]
+        assert titles(get_ranking("trending"), items) == ["second", "third", "first"]
+
+        trending = {entry["id"]: entry["bids"] for entry in get_ranking("trending")}
+        assert trending[items["second"].id] == 3
+
+        entry = get_ranking("ending-soon")[0]
+        assert set(entry) == {"id", "title", "price", "closes_at", "thumbnail"}
+        assert len(get_ranking("ending-soon", limit=2)) == 2
+
+        assert get_ranking("unknown") == []
+
+
+def test_closed_items_are_dropped(app: Flask, items):
+    """
+    Test that items that closed after the refresh are left out.
+    """
+    with app.app_context():
+        refresh_rankings(["ending-soon"])
+
+        ranking = Ranking.objects.get(name="ending-soon")
+        ranking.items[0]["closes_at"] = datetime.utcnow() - timedelta(seconds=1)
+        ranking.save()
+
+        assert titles(get_ranking("ending-soon"), items) == ["second", "third"]
+
+
+def test_ranking_pages(client: FlaskClient, app: Flask, items, currency_file):  # pylint: disable=unused-argument
+    with app.app_context():
+        refresh_rankings()
+
+    response = client.get("/rankings/trending")
+    assert response.status_code == 200
+    assert b"Ranked second" in response.data
+    assert b"Ranked closed" not in response.data
+
+    assert client.get("/rankings/unknown").status_code == 404
+
+    response = client.get("/")
+    assert response.status_code == 200
+    assert b"ending-soon" in response.data
+    assert b"Ranked first" in response.data
+
+
+def test_ranking_api(client: FlaskClient, app: Flask, items):
+    with app.app_context():
+        refresh_rankings()
+
+    response = client.get("/api/items/rankings/highest-price")
+    assert response.status_code == 200
+    assert response.json["success"] is True
+    ids = [entry["id"] for entry in response.json["items"]]
+    assert ids.index(str(items["second"].id)) < ids.index(str(items["first"].id))
+
+    response = client.get("/api/items/rankings/unknown")
+    assert response.status_code == 404
+    assert response.json["success"] is False
+
+
+def test_refresh_command(app: Flask):
+    result = app.test_cli_runner().invoke(args=["refresh-rankings", "trending"])
+    assert result.exit_code == 0, result.output
+    assert "Refreshed trending." in result.output
+
+    with app.app_context():
+        assert Ranking.objects(name="trending").first() is not None
+        Ranking.objects.delete()
@@ -0,0 +1,94 @@
+"""
+Test the rate limiting.
+"""
+from time import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.metrics import registry
+from tjts5901.ratelimit import MemoryBackend, MongoBackend, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("60/minute") == 1
+    assert parse_rate("10/seconds") == 10
+    with pytest.raises(ValueError):
+        parse_rate("10/fortnight")
+
+
+def test_single_token_bucket():
+    """
+    Test that an empty bucket allows a request, even when `now + interval` rounds up.
+    """
+    now = 260620.64908453598
+    assert now + 3600 - 3600 > now
+
+    backend = MemoryBackend()
+    assert backend.consume("test:hourly", 1 / 3600, 1, now=now) == (True, 0.0)
+    assert not backend.consume("test:hourly", 1 / 3600, 1, now=now)[0]
+
+
+@pytest.mark.parametrize("backend_class", [MemoryBackend, MongoBackend])
+def test_token_bucket(app: Flask, backend_class):
+    """
+    Test that the bucket allows a burst, and then refills at the rate.
+    """
+    backend = backend_class()
+    key = f"test:{backend_class.__name__}"
+    # Mongo backend removes expired buckets, so use the current time.
+    now = time()
+
+    with app.app_context():
+        # Burst of three, then one per second.
+        assert [backend.consume(key, 1, 3, now=now)[0] for _ in range(3)] == [True, True, True]
+
+        allowed, retry_after = backend.consume(key, 1, 3, now=now)
+        assert not allowed
+        assert retry_after == pytest.approx(1)
+
+        assert backend.consume(key, 1, 3, now=now + 1)[0]
+        assert not backend.consume(key, 1, 3, now=now + 1)[0]
+
+        # Other clients have their own buckets.
+        assert backend.consume(key + ":other", 1, 3, now=now + 1)[0]
+
+
+def test_rate_limited_endpoint(client: FlaskClient, app: Flask, monkeypatch):
+    """
+    Test that the bid endpoint answers 429 with Retry-After when limited.
+    """
+    monkeypatch.setitem(app.config, "RATELIMIT_BID", "1/minute")
+    monkeypatch.setitem(app.config, "RATELIMIT_BID_BURST", 1)
+    limited = registry.get("ratelimit_requests_total").labels("bid", "limited")
+    before = limited.value
+
+    headers = {"Authorization": "Bearer rate-limit-test"}
+    # First request passes the limiter, and fails authentication.
+    response = client.post("/api/items/bids:batch", headers=headers, json={"bids": []})
+    assert response.status_code != 429
+
+    response = client.post("/api/items/bids:batch", headers=headers, json={"bids": []})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 59
+    assert response.json["success"] is False
+    assert limited.value == before + 1
+
+
+def test_admission_control(client: FlaskClient, app: Flask):
+    """
+    Test that requests are rejected with 503 when all the slots are taken.
+    """
+    limiter = app.extensions['ratelimit']
+    slots = app.config["RATELIMIT_MAX_CONCURRENT"]
+
+    for _ in range(slots):
+        limiter.admission.acquire()
+    try:
+        response = client.post("/api/items/bids:batch", json={"bids": []})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        for _ in range(slots):
+            limiter.admission.release()
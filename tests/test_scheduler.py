@@ -0,0 +1,105 @@
+"""
+Test the scheduled jobs.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from tjts5901.items import FLASH_SALE_LENGTH, SALE_LENGTH
+from tjts5901.models import Item, User
+from tjts5901 import scheduler as scheduler_module
+
+
+@pytest.fixture
+def items(app: Flask, user: User):
+    """
+    An expired item, one closing before the next sweep, and one closing later.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        items = {
+            name: Item(title=name, description="Scheduled item", starting_bid=10, seller=user,
+                       closes_at=now + delta).save()
+            for name, delta in (("expired", timedelta(minutes=-1)),
+                                ("upcoming", timedelta(minutes=5)),
+                                ("later", timedelta(hours=2)))
+        }
+        yield items
+        for item in items.values():
+            item.delete()
+
+
+def test_closing_not_scheduled_without_running_scheduler(app: Flask, items):
+    """
+    Test that a process not running the scheduler doesn't add jobs that would never run.
+    """
+    assert not scheduler_module.scheduler.running
+    with app.app_context():
+        scheduler_module._schedule_item_closing_task(Item, items["upcoming"])  # pylint: disable=protected-access
+
+    assert scheduler_module.scheduler.get_job(f"close-item-{items['upcoming'].id}") is None
+
+
+def test_sweep_schedules_upcoming_items(app: Flask, items, monkeypatch):
+    """
+    Test that the sweep closes expired items, and schedules the ones closing before the next sweep.
+    """
+    scheduled, closed = [], []
+    monkeypatch.setitem(app.config, "DEBUG", False)
+    monkeypatch.setattr(scheduler_module.scheduler, "app", app)
+    monkeypatch.setattr(scheduler_module, "_schedule_closing", lambda item_id, closes_at: scheduled.append(item_id))
+    monkeypatch.setattr(scheduler_module.close_item, "delay", closed.append)
+
+    scheduler_module._close_items()  # pylint: disable=protected-access
+
+    assert str(items["expired"].id) in closed
+    assert items["upcoming"].id in scheduled
+    assert items["later"].id not in scheduled
+
+
+@pytest.mark.parametrize("debug, sale_length", ((False, SALE_LENGTH), (True, FLASH_SALE_LENGTH)))
+def test_sweep_runs_within_shortest_sale(app: Flask, monkeypatch, debug, sale_length):
+    """
+    Test that the sweep runs at least as often as the shortest sale lasts.
+    """
+    monkeypatch.setitem(app.config, "DEBUG", debug)
+    assert scheduler_module.close_items_interval(app) <= sale_length
+
+
+def test_sweep_schedules_item_listed_after_sweep(app: Flask, user: User, monkeypatch):
+    """
+    Test that an item listed in another process right after a sweep is scheduled by the next one.
+    """
+    scheduled, closed = [], []
+    monkeypatch.setitem(app.config, "DEBUG", True)
+    monkeypatch.setattr(scheduler_module.scheduler, "app", app)
+    monkeypatch.setattr(scheduler_module, "_schedule_closing", lambda item_id, closes_at: scheduled.append(item_id))
+    monkeypatch.setattr(scheduler_module.close_item, "delay", closed.append)
+
+    interval = scheduler_module.close_items_interval(app)
+    sweep_at = datetime.utcnow()
+
+    class FakeDatetime(datetime):
+        """Datetime whose clock is the time of the sweep."""
+        @classmethod
+        def utcnow(cls):
+            return sweep_at
+
+    monkeypatch.setattr(scheduler_module, "datetime", FakeDatetime)
+    scheduler_module._close_items()  # pylint: disable=protected-access
+
+    # Listed a second after the sweep, as a flash sale.
+    listed_at = sweep_at + timedelta(seconds=1)
+    with app.app_context():
+        item = Item(title="Flash sale", description="Scheduled item", starting_bid=10, seller=user,
+                    closes_at=listed_at + FLASH_SALE_LENGTH).save()
+    try:
+        assert item.id not in scheduled
+
+        sweep_at += interval
+        scheduler_module._close_items()  # pylint: disable=protected-access
+        assert item.id in scheduled or str(item.id) in closed
+        assert item.closes_at > sweep_at, "Sweep should schedule the item before it closes"
+    finally:
+        item.delete()
@@ -0,0 +1,164 @@
+"""
+Test the item search.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tjts5901.models import AccessToken, Bid, Item, User
+from tjts5901.search import InvertedIndex, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def catalog(app: Flask, user: User):
+    """
+    Items with searchable titles and descriptions.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        items = {
+            "delorean": Item(title="Flux capacitor DeLorean", description="Needs 1.21 gigawatts",
+                             starting_bid=100, seller=user, closes_at=now + timedelta(days=1)),
+            "almanac": Item(title="Sports almanac", description="Fits in a DeLorean glovebox",
+                            starting_bid=20, seller=user, closes_at=now + timedelta(days=2)),
+            "hoverboard": Item(title="Hoverboard", description="Does not work on water",
+                               starting_bid=50, seller=user, closes_at=now - timedelta(days=1)),
+        }
+        for item in items.values():
+            item.save()
+
+        yield items
+
+        for item in items.values():
+            Bid.objects(item=item).delete()
+            item.delete()
+
+
+def search(client: FlaskClient, **args):
+    response = client.get("/api/items/search", query_string=args)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def titles(data):
+    return [item["title"] for item in data["items"]]
+
+
+def test_search_relevance(client: FlaskClient, catalog):
+    """
+    Test that title matches rank above description matches.
+    """
+    data = search(client, q="delorean")
+    assert titles(data) == ["Flux capacitor DeLorean", "Sports almanac"]
+    assert data["next_cursor"] is None
+
+    assert titles(search(client, q="HOVERBOARD")) == ["Hoverboard"]
+    assert titles(search(client, q="nothing-like-this")) == []
+
+
+def test_search_filters(client: FlaskClient, catalog):
+    """
+    Test the status and price filters.
+    """
+    assert titles(search(client, q="delorean hoverboard", status="closed")) == ["Hoverboard"]
+    assert "Hoverboard" not in titles(search(client, q="delorean hoverboard", status="open"))
+
+    assert titles(search(client, q="delorean", max_price=50)) == ["Sports almanac"]
+    assert titles(search(client, q="delorean", min_price=50)) == ["Flux capacitor DeLorean"]
+
+
+def test_search_price_follows_bids(client: FlaskClient, app: Flask, catalog, user: User):
+    """
+    Test that placed bids update the price used by the price filter.
+    """
+    with app.app_context():
+        token = AccessToken(name="search", user=user).save()
+
+    response = client.post(f"/api/items/{catalog['almanac'].id}/bids",
+                           headers={"Authorization": f"Bearer {token.token}"},
+                           data={"amount": 80})
+    assert response.json["success"] is True
+
+    assert titles(search(client, q="delorean", max_price=50)) == []
+    assert titles(search(client, q="delorean", min_price=80, max_price=80)) == ["Sports almanac"]
+
+    with app.app_context():
+        token.delete()
+
+
+def test_search_cursor(client: FlaskClient, catalog):
+    """
+    Test that the cursor pages through all the results once.
+    """
+    seen = []
+    cursor = None
+    for _ in range(3):
+        data = search(client, q="delorean hoverboard", limit=1, **({"cursor": cursor} if cursor else {}))
+        seen += titles(data)
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == ["Flux capacitor DeLorean", "Hoverboard", "Sports almanac"]
+    assert cursor is None
+
+    # Without search words, items are listed by closing time.
+    first = search(client, limit=1)
+    second = search(client, limit=1, cursor=first["next_cursor"])
+    assert first["items"][0]["closes_at"] >= second["items"][0]["closes_at"]
+
+
+@pytest.mark.parametrize("args", [
+    {"status": "sold"},
+    {"min_price": "lots"},
+    {"max_price": "-1"},
+    {"cursor": "not-a-cursor"},
+])
+def test_search_invalid_arguments(client: FlaskClient, args):
+    """
+    Test that invalid arguments are rejected.
+    """
+    response = client.get("/api/items/search", query_string=args)
+    assert response.status_code == 400
+    assert response.json["success"] is False
+
+
+def test_search_page(client: FlaskClient, catalog, currency_file):  # pylint: disable=unused-argument
+    """
+    Test that the search page lists the matching items.
+    """
+    response = client.get("/search", query_string={"q": "almanac"})
+    assert response.status_code == 200
+    assert b"Sports almanac" in response.data
+    assert b"Hoverboard" not in response.data
+
+
+def test_inverted_index():
+    """
+    Test that the inverted index follows item changes.
+    """
+    index = InvertedIndex()
+    index.built = True
+
+    item = Item(id=ObjectId(), title="Time machine", description="Goes back to the future")
+    index.add(item)
+    assert index.search("machine future") == {item.id: 12}
+
+    item.title = "Car"
+    index.add(item)
+    assert index.search("machine") == {}
+    assert index.search("car") == {item.id: 10}
+
+    index.remove(item.id)
+    assert index.search("car future") == {}
+
+
+def test_cursor_roundtrip():
+    """
+    Test that cursors decode into the values they were made from.
+    """
+    item_id = ObjectId()
+    assert decode_cursor(encode_cursor([1.5, str(item_id)])) == [1.5, item_id]
@@ -0,0 +1,101 @@
+"""
+Startup time benchmarks
+=======================
+
+Measures the module import time, and the time to serve the first request, in
+a fresh interpreter. Run with `pytest -s` to see the summaries.
+
+Budgets are generous, and are meant to catch gross regressions, like creating
+the application on import again.
+"""
+import json
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+IMPORT_BUDGET = 3.0
+"Seconds the `tjts5901.app` import may take."
+
+FIRST_REQUEST_BUDGET = 6.0
+"Seconds from interpreter start to the first response."
+
+FIRST_REQUEST_SCRIPT = """
+import json, sys
+from time import perf_counter
+started = perf_counter()
+from tjts5901.app import create_app
+imported = perf_counter()
+app = create_app({"TESTING": True})
+created = perf_counter()
+response = app.test_client().get("/hello")
+responded = perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import": imported - started,
+    "create_app": created - imported,
+    "first_request": responded - created,
+    "total": responded - started,
+    "sentry_imported": "sentry_sdk" in sys.modules,
+    "apscheduler_imported": "apscheduler" in sys.modules,
+}))
+"""
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, timeout=60, check=True)
+
+
+def parse_importtime(output: str) -> List[Tuple[str, float, float]]:
+    """
+    Parse `python -X importtime` output into (module, self seconds, cumulative seconds).
+    """
+    modules = []
+    for line in output.splitlines():
+        if match := re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line):
+            self_us, cumulative_us, _, module = match.groups()
+            modules.append((module, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def test_import_does_not_create_app():
+    """
+    Test that importing the application module doesn't create the application.
+    """
+    result = _run_python("-X", "importtime", "-c", "import tjts5901.app as m; print('flask_app' in vars(m))")
+    assert result.stdout.strip() == "False", "Application was created on import"
+
+    modules = parse_importtime(result.stderr)
+    total = {module: cumulative for module, _, cumulative in modules}["tjts5901.app"]
+
+    print(f"\nImport time of tjts5901.app: {total:.3f}s. Slowest own modules:")
+    own = sorted((m for m in modules if m[0].startswith("tjts5901")), key=lambda m: m[1], reverse=True)
+    for module, self_time, cumulative in own[:5]:
+        print(f"  {module:30} self {self_time:.4f}s  cumulative {cumulative:.4f}s")
+
+    assert total < IMPORT_BUDGET, f"Importing tjts5901.app took {total:.2f}s"
+
+
+def test_time_to_first_request():
+    """
+    Test the time from a cold interpreter to the first served request.
+    """
+    result = _run_python("-c", FIRST_REQUEST_SCRIPT)
+    timings: Dict = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print("\nTime to first request: " + ", ".join(
+        f"{key} {value:.3f}s" for key, value in timings.items() if isinstance(value, float)))
+
+    assert timings["status"] == 200
+    assert not timings["apscheduler_imported"], "Scheduler was imported while testing"
+    assert timings["total"] < FIRST_REQUEST_BUDGET, f"First request took {timings['total']:.2f}s"
+
+
+def test_sentry_is_imported_lazily():
+    """
+    Test that Sentry is not imported, when it's not configured.
+    """
+    script = "import os; os.environ.pop('SENTRY_DSN', None)\n" + FIRST_REQUEST_SCRIPT
+    result = _run_python("-c", script)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    assert timings["sentry_imported"] is False, "Sentry was imported without DSN"
@@ -0,0 +1,150 @@
+"""
+Test the seller statistics.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.security import generate_password_hash
+
+from tjts5901.archive import archive_collection, archive_items
+from tjts5901.items import handle_item_closing
+from tjts5901.models import AccessToken, Bid, Item, SellerStats, User
+from tjts5901.stats import get_seller_stats, rebuild_seller_stats, record_item_deleted
+
+COUNTERS = ("items_listed", "items_open", "items_sold", "revenue", "bids_received")
+
+
+def counters(stats: SellerStats) -> dict:
+    return {name: getattr(stats, name) for name in COUNTERS}
+
+
+
+@pytest.fixture
+def seller(app: Flask, faker):
+    with app.app_context():
+        seller = User(email=faker.unique.email(), password=generate_password_hash("x"),
+                      locale="en_GB.UTF-8").save()
+        yield seller
+
+        for item in Item.objects(seller=seller):
+            Bid.objects(item=item).delete()
+            item.delete()
+        archive_collection(Item).delete_many({"seller": seller.id})
+        SellerStats.objects(seller=seller).delete()
+        seller.delete()
+
+
+@pytest.fixture
+def token(app: Flask, user: User):
+    with app.app_context():
+        token = AccessToken(name="stats", user=user).save()
+        yield token
+        token.delete()
+
+
+def test_incremental_stats(client: FlaskClient, login, app: Flask, seller: User, token: AccessToken,
+                           currency_file):  # pylint: disable=unused-argument
+    """
+    Test that listing, bidding and closing update the statistics, and that a rebuild agrees.
+    """
+    login(seller)
+    for title in ("Sold", "Unsold"):
+        response = client.post("/sell", data={"title": title, "description": "Statistics", "starting_bid": "10"})
+        assert response.status_code == 302
+
+    with app.app_context():
+        sold = Item.objects.get(seller=seller, title="Sold")
+        unsold = Item.objects.get(seller=seller, title="Unsold")
+        assert counters(get_seller_stats(seller)) == {
+            "items_listed": 2, "items_open": 2, "items_sold": 0, "revenue": 0, "bids_received": 0}
+
+    headers = {"Authorization": f"Bearer {token.token}"}
+    for amount in (20, 35):
+        response = client.post(f"/api/items/{sold.id}/bids", headers=headers, data={"amount": amount})
+        assert response.json["success"] is True
+    response = client.post("/api/items/bids:batch", headers=headers,
+                           json={"bids": [{"item": str(sold.id), "amount": 40}]})
+    assert response.json["results"][0]["success"] is True
+
+    with app.app_context():
+        for item in (sold, unsold):
+            item.reload()
+            item.closes_at = datetime.utcnow()
+            item.save()
+            handle_item_closing(item)
+
+        # Closing twice is counted once.
+        handle_item_closing(Item.objects.get(id=sold.id))
+
+        stats = get_seller_stats(seller)
+        expected = {"items_listed": 2, "items_open": 0, "items_sold": 1, "revenue": 40, "bids_received": 3}
+        assert counters(stats) == expected
+        assert stats.average_price == 40
+
+        rebuild_seller_stats()
+        assert counters(get_seller_stats(seller)) == expected
+
+
+def test_delete_item(app: Flask, seller: User, user: User):
+    with app.app_context():
+        item = Item(title="Deleted", description="Statistics", starting_bid=10, seller=seller,
+                    closes_at=datetime.utcnow() + timedelta(days=1)).save()
+        Bid(item=item, bidder=user, amount=20).save()
+        rebuild_seller_stats()
+        assert get_seller_stats(seller).bids_received == 1
+
+        item.delete()
+        record_item_deleted(item)
+        Bid.objects(item=item).delete()
+
+        assert counters(get_seller_stats(seller)) == dict.fromkeys(COUNTERS, 0)
+
+
+def test_rebuild_includes_archive(app: Flask, seller: User, user: User):
+    """
+    Test that the rebuild counts archived auctions, and removes sellers without items.
+    """
+    with app.app_context():
+        item = Item(title="Archived", description="Statistics", starting_bid=10, seller=seller,
+                    closes_at=datetime.utcnow() - timedelta(days=60), closed=True).save()
+        bid = Bid(item=item, bidder=user, amount=25, created_at=item.closes_at - timedelta(hours=1)).save()
+        item.winning_bid = bid
+        item.price = 25
+        item.save()
+        archive_items(timedelta(days=30))
+
+        SellerStats(seller=user, items_listed=5).save()
+        rebuild_seller_stats()
+
+        assert counters(get_seller_stats(seller)) == {
+            "items_listed": 1, "items_open": 0, "items_sold": 1, "revenue": 25, "bids_received": 1}
+        assert SellerStats.objects(seller=user).first() is None
+
+        archive_collection(Bid).delete_many({"item": item.id})
+
+
+def test_profile_dashboard(client: FlaskClient, login, app: Flask, seller: User, user: User,
+                           currency_file):  # pylint: disable=unused-argument
+    """
+    Test that the dashboard is shown to the seller only.
+    """
+    with app.app_context():
+        SellerStats(seller=seller, items_listed=3, items_sold=2, revenue=50).save()
+
+    login(user)
+    response = client.get(f"/auth/profile/{seller.email}")
+    assert response.status_code == 200
+    assert b"seller-stats" not in response.data
+
+    login(seller)
+    response = client.get("/auth/profile")
+    assert response.status_code == 200
+    assert b"seller-stats" in response.data
+
+
+def test_rebuild_command(app: Flask, seller: User):  # pylint: disable=unused-argument
+    result = app.test_cli_runner().invoke(args=["rebuild-seller-stats"])
+    assert result.exit_code == 0, result.output
+    assert "Rebuilt the statistics of" in result.output
@@ -0,0 +1,116 @@
+"""
+Test the background task queue.
+"""
+from time import monotonic, sleep
+
+import pytest
+from flask import Flask
+
+from tjts5901.models import QueuedTask
+from tjts5901.tasks import DurableWorker, TaskQueue, task
+
+calls = []
+
+
+@task(retries=2, backoff=0.01)
+def flaky(key: str, failures: int):
+    calls.append(key)
+    if calls.count(key) <= failures:
+        raise RuntimeError("Try again")
+
+
+@task(retries=1, backoff=0, durable=True)
+def durable(key: str, failures: int = 0):
+    calls.append(key)
+    if calls.count(key) <= failures:
+        raise RuntimeError("Try again")
+
+
+@pytest.fixture
+def background(app: Flask, monkeypatch):
+    """
+    Run tasks in background threads.
+    """
+    monkeypatch.setitem(app.config, "TASKS_EAGER", False)
+    task_queue = TaskQueue(app)
+    monkeypatch.setitem(app.extensions, "tasks", task_queue)
+    yield task_queue
+    task_queue.shutdown()
+
+
+def wait_for(condition, timeout=5):
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+    return condition()
+
+
+def test_retry(app: Flask, background: TaskQueue):
+    """
+    Test that failed tasks are retried, until they run out of retries.
+    """
+    with app.app_context():
+        flaky.delay("retry", 2)
+        flaky.delay("give-up", 5)
+
+    assert wait_for(lambda: calls.count("retry") == 3)
+    assert wait_for(lambda: calls.count("give-up") == 3)
+    sleep(0.1)
+    assert calls.count("give-up") == 3
+
+
+def test_queue_full(app: Flask, monkeypatch):
+    """
+    Test that tasks are run in the caller when the queue is full.
+    """
+    monkeypatch.setitem(app.config, "TASKS_EAGER", False)
+    monkeypatch.setitem(app.config, "TASKS_WORKERS", 0)
+    monkeypatch.setitem(app.config, "TASKS_QUEUE_SIZE", 1)
+    task_queue = TaskQueue(app)
+
+    task_queue.enqueue(flaky, ("queued", 0))
+    task_queue.enqueue(flaky, ("overflow", 0))
+
+    assert "queued" not in calls
+    assert calls.count("overflow") == 1
+
+
+def test_durable(app: Flask, background: TaskQueue, monkeypatch):
+    """
+    Test that durable tasks are saved, and run by the worker.
+    """
+    monkeypatch.setitem(app.config, "TASKS_DURABLE", True)
+
+    with app.app_context():
+        QueuedTask.objects.delete()
+        durable.delay("durable-ok", failures=1)
+        durable.delay("durable-fail", failures=5)
+        assert QueuedTask.objects.count() == 2
+
+        worker = DurableWorker(app)
+        # First round fails both, second round runs the retries.
+        worker.run(burst=True)
+
+        assert calls.count("durable-ok") == 2
+        assert calls.count("durable-fail") == 2
+
+        failed = QueuedTask.objects.get()
+        assert failed.status == "failed"
+        assert failed.kwargs == {"failures": 5}
+        failed.delete()
+
+
+def test_worker_command(app: Flask, monkeypatch):
+    """
+    Test the `flask worker` command.
+    """
+    with app.app_context():
+        QueuedTask.objects.delete()
+        QueuedTask(name=durable.name, args=["from-cli"]).save()
+
+    result = app.test_cli_runner().invoke(args=["worker", "--burst"])
+    assert result.exit_code == 0, result.output
+    assert calls.count("from-cli") == 1
+
+    with app.app_context():
+        assert QueuedTask.objects.count() == 0
@@ -0,0 +1,187 @@
+"""
+Test the watchlist.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.security import generate_password_hash
+
+from tjts5901.items import handle_item_closing
+from tjts5901.models import AccessToken, Bid, Item, Notification, User, Watch
+from tjts5901.watchlist import notify_closing_soon, notify_watchers, watch_item
+
+PASSWORD_HASH = generate_password_hash("watcher")
+
+
+
+@pytest.fixture
+def item(app: Flask, user: User):
+    with app.app_context():
+        item = Item(title="Watched", description="Watched item", starting_bid=10, seller=user,
+                    closes_at=datetime.utcnow() + timedelta(days=1)).save()
+        yield item
+        Bid.objects(item=item).delete()
+        Watch.objects(item=item).delete()
+        item.delete()
+
+
+@pytest.fixture
+def watchers(app: Flask, item: Item, faker):
+    """
+    Users watching the item, the first one in Finnish.
+    """
+    with app.app_context():
+        watchers = [User(email=faker.unique.email(), password=PASSWORD_HASH,
+                         locale="fi_FI.UTF-8" if i == 0 else "en_GB.UTF-8").save() for i in range(25)]
+        for watcher in watchers:
+            watch_item(item, watcher)
+        yield watchers
+
+        for watcher in watchers:
+            Notification.objects(user=watcher).delete()
+            watcher.delete()
+
+
+def watch_notifications(users, title=None) -> int:
+    query = {"user__in": users, "category": "watch"}
+    if title is not None:
+        query["title"] = title
+    return Notification.objects(**query).count()
+
+
+def test_watch_and_unwatch(client: FlaskClient, login, app: Flask, item: Item, faker,
+                           currency_file):  # pylint: disable=unused-argument
+    with app.app_context():
+        watcher = User(email=faker.unique.email(), password=PASSWORD_HASH,
+                       locale="en_GB.UTF-8").save()
+
+    login(watcher)
+    for _ in range(2):
+        response = client.post(f"/item/{item.id}/watch")
+        assert response.status_code == 302
+
+    with app.app_context():
+        assert Item.objects.get(id=item.id).watchers == 1
+        assert Watch.objects(item=item, user=watcher).count() == 1
+
+    response = client.get(f"/item/{item.id}")
+    assert f"/item/{item.id}/unwatch".encode() in response.data
+
+    for _ in range(2):
+        response = client.post(f"/item/{item.id}/unwatch")
+        assert response.status_code == 302
+
+    with app.app_context():
+        assert Item.objects.get(id=item.id).watchers == 0
+        assert Watch.objects(item=item, user=watcher).count() == 0
+        watcher.delete()
+
+
+def test_fan_out_in_batches(app: Flask, item: Item, watchers, monkeypatch):
+    """
+    Test that every watcher is notified once, in their own language, when sent in batches.
+    """
+    monkeypatch.setitem(app.config, "WATCH_FANOUT_BATCH_SIZE", 10)
+
+    with app.app_context():
+        notify_watchers(str(item.id), "closed", exclude=str(watchers[1].id))
+
+        assert watch_notifications(watchers) == 24
+        assert watch_notifications(watchers[1:2]) == 0
+        assert watch_notifications(watchers[2:], title="Watched item closed") == 23
+
+        finnish = Notification.objects.get(user=watchers[0], category="watch")
+        assert finnish.title == "Seuraamasi tuote on sulkeutunut"
+        assert "Watched" in finnish.message
+
+
+def test_bid_notifications(client: FlaskClient, app: Flask, item: Item, watchers):
+    """
+    Test that watchers are notified of a new bid, but not of every bid on a busy item.
+    """
+    with app.app_context():
+        token = AccessToken(name="watch", user=watchers[0]).save()
+
+    headers = {"Authorization": f"Bearer {token.token}"}
+    for amount in (20, 30):
+        response = client.post(f"/api/items/{item.id}/bids", headers=headers, data={"amount": amount})
+        assert response.json["success"] is True
+
+    with app.app_context():
+        # The bidder isn't notified of their own bid.
+        assert watch_notifications(watchers[:1]) == 0
+        assert watch_notifications(watchers[1:], title="New bid on a watched item") == 24
+        assert "20" in Notification.objects(user=watchers[1], category="watch").first().message
+
+        token.delete()
+
+
+def test_failed_bid_notification_is_retried(app: Flask, item: Item, watchers, monkeypatch):
+    """
+    Test that a retry of a failed first batch still notifies the watchers of the bid.
+    """
+    import tjts5901.watchlist
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Database is down")
+
+    with app.app_context():
+        with monkeypatch.context() as patch:
+            patch.setattr(tjts5901.watchlist, "send_notifications", fail)
+            with pytest.raises(RuntimeError):
+                notify_watchers(str(item.id), "bid", exclude=str(watchers[0].id))
+
+        notify_watchers(str(item.id), "bid", exclude=str(watchers[0].id))
+        assert watch_notifications(watchers[1:], title="New bid on a watched item") == 24
+
+        # The successful one keeps the claim.
+        notify_watchers(str(item.id), "bid", exclude=str(watchers[0].id))
+        assert watch_notifications(watchers[1:]) == 24
+
+
+def test_unwatched_bids_enqueue_nothing(client: FlaskClient, app: Flask, item: Item, user: User, monkeypatch):
+    calls = []
+    monkeypatch.setattr(notify_watchers, "delay", lambda *args, **kwargs: calls.append(args))
+
+    with app.app_context():
+        token = AccessToken(name="watch", user=user).save()
+
+    response = client.post(f"/api/items/{item.id}/bids", headers={"Authorization": f"Bearer {token.token}"},
+                           data={"amount": 20})
+    assert response.json["success"] is True
+    assert calls == []
+
+    with app.app_context():
+        token.delete()
+
+
+def test_closing_soon(app: Flask, item: Item, watchers):
+    with app.app_context():
+        item.closes_at = datetime.utcnow() + timedelta(minutes=30)
+        item.save()
+
+        assert notify_closing_soon() == 1
+        assert notify_closing_soon() == 0
+
+        assert watch_notifications(watchers, title="Watched item closes soon") == 24
+        message = Notification.objects(user=watchers[1], category="watch").first().message
+        assert "closes in 29 minutes" in message or "closes in 30 minutes" in message
+
+
+def test_item_closing_notifies_watchers(app: Flask, item: Item, watchers):
+    """
+    Test that the watchers are notified when the item closes, except the winner.
+    """
+    with app.app_context():
+        Bid(item=item, bidder=watchers[2], amount=50).save()
+        item.reload()
+        item.closes_at = datetime.utcnow()
+        item.save()
+
+        handle_item_closing(item)
+        handle_item_closing(Item.objects.get(id=item.id))
+
+        assert watch_notifications(watchers, title="Watched item closed") == 23
+        assert watch_notifications(watchers[2:3]) == 0